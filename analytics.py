@@ -0,0 +1,195 @@
+"""Score analytics for Progress, Oracle and the teacher Class Dashboard.
+
+Aggregation happens in SQLite (GROUP BY) and ranking in vectorised pandas /
+NumPy, so cost grows with topics x students rather than with score rows and
+there are no per-user Python loops. Class-level reads go to one school's
+shard (db.query_shards with schools=); only the leaderboard merges schools.
+Results are cached per process and invalidated by db.save_score /
+db.save_quiz_results through db.on_score_write.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import db
+import metrics
+
+CACHE_TTL = 60  # seconds; bounds staleness when another replica writes scores
+AT_RISK = 50    # mastery % below which a student/topic is flagged
+MAX_POINTS = 120  # chart points sent to the browser
+CACHE_MAX = 2000
+# Month-day pairs where school terms begin
+TERM_STARTS = [tuple(int(x) for x in md.split("-")) for md in os.getenv("MENTIS_TERM_STARTS", "01-06,04-20,09-01").split(",")]
+
+WINDOWS = ["Last 30 days", "This term", "All time"]
+
+_lock = threading.Lock()
+_cache = OrderedDict()  # key -> (version, stored_at, value), LRU order
+_user_versions = {}    # username -> int
+_global_version = 0
+
+
+@db.on_score_write
+def invalidate(username):
+    global _global_version
+    with _lock:
+        _user_versions[username] = _user_versions.get(username, 0) + 1
+        _global_version += 1
+
+
+def _cached(key, version, fn):
+    now = time.monotonic()
+    with _lock:
+        hit = _cache.get(key)
+        if hit and hit[0] == version and now - hit[1] < CACHE_TTL:
+            _cache.move_to_end(key)
+            metrics.hit("analytics", True)
+            return hit[2]
+    metrics.hit("analytics", False)
+    value = fn()
+    with _lock:
+        _cache[key] = (version, now, value)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_MAX: _cache.popitem(last=False)
+    return value
+
+
+def _user_version(username):
+    with _lock: return _user_versions.get(username, 0)
+
+
+def _read(sql, params=(), username=None):
+    conn = db.connect(username)
+    df = pd.read_sql_query(sql, conn, params=params)
+    conn.close()
+    return df
+
+
+# ==========================================
+# TIME WINDOWS
+# ==========================================
+def term_start(today=None):
+    today = today or date.today()
+    starts = [date(today.year, m, d) for m, d in TERM_STARTS] + [date(today.year - 1, m, d) for m, d in TERM_STARTS]
+    return max(s for s in starts if s <= today)
+
+
+def window_since(label):
+    """'YYYY-MM-DD' lower bound for a WINDOWS label (None for all time)."""
+    if label == "Last 30 days": return (date.today() - timedelta(days=30)).isoformat()
+    if label == "This term": return term_start().isoformat()
+    return None
+
+
+def downsample(df, x, y, max_points=MAX_POINTS):
+    """Averages consecutive rows into at most max_points buckets (vectorised)."""
+    if len(df) <= max_points: return df
+    bucket = np.arange(len(df)) * max_points // len(df)
+    return df.groupby(bucket).agg({x: "last", y: "mean"}).reset_index(drop=True)
+
+
+# ==========================================
+# PER-STUDENT
+# ==========================================
+def user_mastery(username, since=None):
+    """topic, mastery (avg %), attempts, best, last_date — one row per topic."""
+    where, params = ("AND date >= ?", (username, since)) if since else ("", (username,))
+    return _cached(("mastery", username, since), _user_version(username), lambda: _read(
+        f'''SELECT topic, AVG(score) AS mastery, COUNT(*) AS attempts, MAX(score) AS best, MAX(date) AS last_date
+            FROM scores WHERE username = ? {where} GROUP BY topic ORDER BY topic''', params, username))
+
+
+def user_trend(username, since=None, max_points=MAX_POINTS):
+    """Daily average score, downsampled server-side to at most max_points."""
+    where, params = ("AND date >= ?", (username, since)) if since else ("", (username,))
+    return _cached(("trend", username, since, max_points), _user_version(username), lambda: downsample(_read(
+        f'''SELECT substr(date, 1, 10) AS day, AVG(score) AS score FROM scores
+            WHERE username = ? {where} GROUP BY day ORDER BY day''', params, username), "day", "score", max_points))
+
+
+def _schools(school):
+    return [school] if school else None
+
+
+def _topic_user_means(school=None):
+    """One row per (topic, username) with that student's mean, for every student of the school (every school if None)."""
+    return _cached(("topic_user_means", school), _global_version, lambda: db.query_shards(
+        '''SELECT s.topic, s.username, AVG(s.score) AS mastery, COUNT(*) AS attempts
+           FROM scores s LEFT JOIN users u ON u.username = s.username
+           WHERE u.role IS NULL OR u.role = 'Student'
+           GROUP BY s.topic, s.username''', schools=_schools(school)))
+
+
+def _ranked(school=None):
+    def build():
+        df = _topic_user_means(school).copy()
+        if df.empty: return df.assign(percentile=pd.Series(dtype=float))
+        df["percentile"] = df.groupby("topic")["mastery"].rank(pct=True, method="max") * 100
+        return df
+    return _cached(("ranked", school), _global_version, build)
+
+
+def percentile_ranks(username):
+    """topic -> percentile of this student's mastery among the students of their school on that topic."""
+    df = _ranked(db.school_of(username))
+    mine = df[df["username"] == username]
+    return dict(zip(mine["topic"], np.round(mine["percentile"].to_numpy(), 1)))
+
+
+# ==========================================
+# CLASS LEVEL (teacher dashboard)
+# ==========================================
+def class_overview(school=None):
+    """Per topic: students, mean, median, p25/p75 of student mastery, and how many are at risk."""
+    def build():
+        df = _topic_user_means(school)
+        if df.empty: return df
+        g = df.groupby("topic")["mastery"]
+        out = pd.DataFrame({
+            "students": g.size(),
+            "mean": g.mean(),
+            "median": g.median(),
+            "p25": g.quantile(0.25),
+            "p75": g.quantile(0.75),
+            "at_risk": df.assign(r=df["mastery"] < AT_RISK).groupby("topic")["r"].sum().astype(int),
+        })
+        return out.round(1).sort_values("mean")
+    return _cached(("class_overview", school), _global_version, build)
+
+
+def class_matrix(school=None):
+    """Student x topic mastery grid."""
+    def build():
+        df = _topic_user_means(school)
+        if df.empty: return df
+        return df.pivot(index="username", columns="topic", values="mastery").round(0)
+    return _cached(("class_matrix", school), _global_version, build)
+
+
+def at_risk_students(limit=50, school=None):
+    """Students whose overall mean is below AT_RISK, weakest first."""
+    def build():
+        df = _topic_user_means(school)
+        if df.empty: return df
+        per = df.groupby("username").agg(mastery=("mastery", "mean"), topics=("topic", "size"),
+                                         attempts=("attempts", "sum"))
+        weak = df.loc[df.groupby("username")["mastery"].idxmin(), ["username", "topic"]].set_index("username")
+        per["weakest_topic"] = weak["topic"]
+        return per[per["mastery"] < AT_RISK].sort_values("mastery").head(limit).round(1)
+    return _cached(("at_risk", limit, school), _global_version, build)
+
+
+def class_trend(weeks=12, school=None):
+    """Weekly class average per topic over the last `weeks` weeks."""
+    def build():
+        df = db.query_shards('''SELECT strftime('%Y-%W', substr(date, 1, 10)) AS week, topic, SUM(score) AS total, COUNT(*) AS n
+                                FROM scores WHERE date >= date('now', ?) GROUP BY week, topic''', (f"-{weeks * 7} days",), _schools(school))
+        if df.empty: return df
+        g = df.groupby(["week", "topic"])[["total", "n"]].sum()
+        return (g["total"] / g["n"]).rename("score").reset_index().pivot(index="week", columns="topic", values="score").sort_index()
+    return _cached(("class_trend", weeks, school), _global_version, build)
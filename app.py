@@ -1,20 +1,31 @@
 #Helloo
 import streamlit as st
-import sqlite3
 import google.generativeai as genai
 import pandas as pd
 from datetime import datetime
 import os
 from dotenv import load_dotenv
-import bcrypt
-from fpdf import FPDF
 import io
-import PyPDF2
 import streamlit.components.v1 as components
 import subprocess
 import re
 import sys
 from PIL import Image
+import llm
+import quiz
+import analytics
+import oracle
+import simulations
+import knowledge_map
+import manim_render
+import image_index
+import scanner
+import question_bank
+import batch
+import metrics
+from db import ADMINS, init_db, check_user, register_user, save_quiz_results, get_score_page, count_scores, get_leaderboard, school_of
+import sessions
+from pdf_tools import extract_text_from_pdf, create_pdf, pdf_key
 
 # Load env variables
 load_dotenv()
@@ -37,135 +48,183 @@ if "GEMINI_API_KEY" in st.secrets:
     API_KEY = st.secrets["GEMINI_API_KEY"]
 elif os.getenv("GEMINI_API_KEY"):
     API_KEY = os.getenv("GEMINI_API_KEY")
+elif isinstance(llm.backend, llm.FakeBackend):
+    API_KEY = ""  # offline mode (MENTIS_LLM_BACKEND=fake), no key needed
 else:
     st.error("🚨 API Key missing! Please set GEMINI_API_KEY in .streamlit/secrets.toml")
     st.stop()
 
 genai.configure(api_key=API_KEY)
+metrics.start_exporter()  # serves /metrics when MENTIS_METRICS_PORT is set
+HISTORY_PAGE = 50  # rows per page in Progress history
 
-# USE THE FLASH MODEL (Supports Images + Text)
-# FIX: Changed to reliable 2.0-flash-exp (3-preview often errors)
-MODEL = 'gemini-2.5-flash' 
-DB = "school.db"
+# Model, rate limiter and request coalescing live in llm.py (shared by all sessions)
 
 # ==========================================
 # 2. DATABASE SETUP
 # ==========================================
-def init_db():
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users 
-                 (username TEXT PRIMARY KEY, password TEXT, role TEXT, name TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS scores 
-                 (username TEXT, topic TEXT, score INTEGER, date TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS notes 
-                 (username TEXT PRIMARY KEY, content TEXT)''')
-    conn.commit()
-    conn.close()
-
 init_db()
+sessions.init_sessions()
+question_bank.init_bank()
+oracle.init_oracle()
+simulations.init_simulations()
+image_index.init_index()
+simulations.prewarm()
+manim_render.warm()
+
+# Restore the login from the signed token after a refresh or websocket reconnect
+if not st.session_state['logged_in'] and "s" in st.query_params:
+    restored = sessions.validate_token(st.query_params["s"])
+    if restored:
+        st.session_state.update({"logged_in": True, "username": restored["username"], "role": restored["role"], "name": restored["name"]})
+    else:
+        del st.query_params["s"]
 
 # ==========================================
 # 3. HELPER FUNCTIONS
 # ==========================================
-def hash_password(pwd):
-    return bcrypt.hashpw(pwd.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-
-def check_user(username, password):
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-    c.execute('SELECT * FROM users WHERE username = ?', (username,))
-    user = c.fetchone()
-    conn.close()
-    if not user: return None
-    try:
-        if bcrypt.checkpw(password.encode('utf-8'), user[1].encode('utf-8')):
-            return user
-    except: return None 
-    return None
-
-def register_user(username, password, role, name):
-    if len(username) < 4: return False, "Username must be at least 4 chars."
-    if len(password) < 6: return False, "Password must be at least 6 chars."
-    if not re.search(r"[A-Z]", password): return False, "Password needs 1 uppercase letter."
-    if not re.search(r"\d", password): return False, "Password needs 1 number."
-
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-    try:
-        hashed = hash_password(password)
-        c.execute('INSERT INTO users(username, password, role, name) VALUES (?, ?, ?, ?)',
-                  (username, hashed, role, name))
-        conn.commit()
-        return True, "Account created successfully!"
-    except sqlite3.IntegrityError:
-        return False, "Username exists."
-    finally:
-        conn.close()
-
-def save_score(username, topic, score):
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-    c.execute('INSERT INTO scores (username, topic, score, date) VALUES (?, ?, ?, ?)',
-              (username, topic, score, datetime.now().strftime('%Y-%m-%d %H:%M')))
-    conn.commit()
-    conn.close()
-
-def get_user_scores(username):
-    conn = sqlite3.connect(DB)
-    df = pd.read_sql_query("SELECT topic, score, date FROM scores WHERE username = ? ORDER BY date DESC", conn, params=(username,))
-    conn.close()
-    return df
-
-def extract_text_from_pdf(pdf_file):
-    reader = PyPDF2.PdfReader(pdf_file)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() + "\n"
-    return text
-
-def sanitize_for_pdf(text):
-    return text.encode('latin-1', 'replace').decode('latin-1')
-
-def create_pdf(title, content):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", 'B', 16)
-    pdf.cell(0, 10, title[:50], 0, 1, 'C')
-    pdf.ln(5)
-    pdf.set_font("Arial", size=11)
-    pdf.multi_cell(0, 8, sanitize_for_pdf(content))
-    return pdf.output(dest='S').encode('latin-1')
-
-def ask_ai(prompt):
-    try:
-        model = genai.GenerativeModel(MODEL, generation_config={"temperature": 0.3})
-        response = model.generate_content(prompt)
-        return response.text
-    except Exception as e:
-        return f"Error: {str(e)}"
-
-def ask_ai_vision(prompt, image):
-    try:
-        model = genai.GenerativeModel(MODEL)
-        response = model.generate_content([prompt, image])
-        return response.text
-    except Exception as e:
-        return f"Error processing image: {str(e)}"
-
-# --- NEW: ROBUST CODE CLEANER (Prevents SyntaxErrors) ---
-def clean_ai_response(response):
-    """Extracts code from markdown blocks to prevent crashes"""
-    match = re.search(r"```python(.*?)```", response, re.DOTALL)
-    if match: return match.group(1).strip()
-    match = re.search(r"```(.*?)```", response, re.DOTALL)
-    if match: return match.group(1).strip()
-    return response.replace("```python", "").replace("```", "").strip()
+# Storage/account helpers live in db.py, PDF helpers in pdf_tools.py
+
+def ai_priority():
+    # Teachers get the fast lane of the shared limiter
+    return llm.TEACHER if st.session_state['role'] == "Teacher" else llm.STUDENT
+
+def ask_ai(prompt, task=llm.DEFAULT_ROUTE):
+    return llm.ask_ai(prompt, task, ai_priority())
+
+def render_metrics_page():
+    st.header("System Metrics")
+    st.caption("Spans from this server process (ring buffer of the most recent calls).")
+    span_df = pd.DataFrame(metrics.recent_spans(), columns=["span", "start", "seconds", "ok"])
+    if span_df.empty:
+        st.info("No spans recorded yet.")
+    else:
+        span_df["ms"] = span_df["seconds"] * 1000
+        summary = span_df.groupby("span")["ms"].describe(percentiles=[.5, .95, .99])[["count", "50%", "95%", "99%", "max"]]
+        summary["errors"] = span_df[~span_df["ok"]].groupby("span").size()
+        st.subheader("⏱️ Latency by span (ms)")
+        st.dataframe(summary.fillna(0).round(1), use_container_width=True)
+
+        pick = st.selectbox("Histogram", sorted(span_df["span"].unique()))
+        ms = span_df.loc[span_df["span"] == pick, "ms"]
+        bins = pd.cut(ms, bins=min(20, max(1, ms.nunique())))
+        hist = bins.value_counts(sort=False)
+        hist.index = [f"{iv.right:.0f}" for iv in hist.index]
+        st.bar_chart(hist, color="#00c6ff")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("🎯 Cache hit rates")
+        rates = metrics.cache_hit_rates()
+        if rates: st.dataframe(pd.DataFrame(rates).T, use_container_width=True)
+        else: st.caption("No cache traffic yet.")
+    with col2:
+        st.subheader("📥 Queue depths")
+        st.json(metrics.gauges())
+    st.subheader("🧭 Model routes")
+    st.dataframe(pd.DataFrame(llm.route_stats()).T, use_container_width=True)
+    with st.expander("Prometheus export"):
+        st.code(metrics.export_text(), language="text")
+
+def pdf_download(title, content, filename):
+    """Builds the PDF only when asked for; create_pdf memoises the bytes for later reruns."""
+    key = "pdf_ready_" + pdf_key(title, content)
+    if st.session_state.get(key):
+        st.download_button("Download PDF", create_pdf(title, content), filename, "application/pdf")
+    elif st.button("📄 Prepare PDF", key=key + "_btn"):
+        st.session_state[key] = True
+        st.rerun()
 
 def render_simulation(html_code):
     html_code = html_code.replace("```html", "").replace("```", "").strip()
     components.html(html_code, height=700, scrolling=True)
 
+def render_hls(url):
+    components.html(f"""
+    <video id="v" controls style="width:100%;max-height:520px;background:#000"></video>
+    <script src="https://cdn.jsdelivr.net/npm/hls.js@1"></script>
+    <script>
+      const v = document.getElementById('v');
+      if (v.canPlayType('application/vnd.apple.mpegurl')) {{ v.src = '{url}'; }}
+      else if (window.Hls && Hls.isSupported()) {{ const h = new Hls(); h.loadSource('{url}'); h.attachMedia(v); }}
+    </script>
+    """, height=540)
+
+def holodeck_view():
+    st.header("Generative Simulation Lab")
+    tab_new, tab_lib = st.tabs(["Simulate", "📚 Library"])
+    with tab_new:
+        sim_topic = st.text_input("What system to simulate?", "Projectile Motion")
+        col1, col2 = st.columns([1, 1])
+        with col1: go = st.button("Generate Simulation")
+        with col2: fresh = st.button("Regenerate (new version)")
+        if go or fresh:
+            with st.spinner("Coding..."):
+                try:
+                    version, html, valid, stored = simulations.get_or_generate(sim_topic, ai_priority(), regenerate=fresh)
+                    st.session_state['last_sim'] = html
+                    if stored: st.caption(f"⚡ Served from the library (v{version})")
+                    elif not valid: st.warning("This simulation failed the canvas/script check; it was not added to the library.")
+                except llm.RateLimitError:
+                    st.error("🚨 The AI is busy right now (rate limit). Please try again in a minute.")
+                except Exception as e:
+                    st.error(f"Error: {e}")
+    with tab_lib:
+        query = st.text_input("Search simulations", "")
+        rows = simulations.search(query)
+        if not rows: st.caption("Nothing in the library yet.")
+        for row in rows:
+            c1, c2 = st.columns([4, 1])
+            c1.write(f"**{row['topic']}** · v{row['version']} · {row['views']} views · {row['size_kb']} KB")
+            if c2.button("Open", key=f"sim_{row['key']}"):
+                found = simulations.latest(row['topic'])
+                if found: st.session_state['last_sim'] = found[1]
+    if st.session_state['last_sim']: render_simulation(st.session_state['last_sim'])
+
+def knowledge_map_view():
+    st.header("Knowledge Graph")
+    if not st.session_state['file_content']:
+        st.warning("⚠️ Upload a PDF first!")
+    else:
+        whole = st.toggle("Map the whole document", value=len(st.session_state['file_content']) > 3000)
+        top_n = st.slider("Concepts", 10, 40, knowledge_map.TOP_N, disabled=not whole)
+        if st.button("Generate Map"):
+            with st.spinner("Mapping..."):
+                if whole:
+                    try:
+                        st.session_state['map_dot'] = knowledge_map.build_map(st.session_state['file_content'], top_n, ai_priority())
+                    except (ValueError, llm.RateLimitError) as e:
+                        st.error(f"Error: {e}")
+                        st.stop()
+                else:
+                    graph_prompt = f"Source: {st.session_state['file_content'][:3000]}\nTask: Create a CLEAN hierarchical concept map (Top 15 concepts). Format: Graphviz DOT. Layout: rankdir=TB, splines=ortho. Return ONLY DOT code inside ```dot ... ```."
+                    st.session_state['map_dot'] = knowledge_map.normalize(ask_ai(graph_prompt, "dot-graph"))
+                st.session_state.pop('map_svg', None)
+                st.session_state.pop('map_err', None)
+                st.session_state['map_sum'] = ask_ai(f"Summarize this text as smart notes:\n{st.session_state['file_content'][:3000]}", "summary")
+
+    if 'map_dot' in st.session_state:
+        st.subheader("🕸️ Concept Map")
+        if not knowledge_map.available():
+            st.graphviz_chart(st.session_state['map_dot'])  # no graphviz binary here: lay out in the browser
+        else:
+            if 'map_svg' not in st.session_state:
+                try:
+                    st.session_state['map_dot'], st.session_state['map_svg'] = knowledge_map.svg_for(st.session_state['map_dot'], ai_priority())
+                except knowledge_map.DotError as e:
+                    st.session_state['map_svg'] = None
+                    st.session_state['map_err'] = f"Could not draw this map: {e}"
+                except llm.RateLimitError:
+                    st.error("🚨 The AI is busy right now (rate limit). Please try again in a minute.")
+            if st.session_state.get('map_svg'):
+                st.markdown(f'<div class="concept-map">{st.session_state["map_svg"]}</div>', unsafe_allow_html=True)
+                st.download_button("📥 Download SVG", st.session_state['map_svg'], file_name="concept_map.svg", mime="image/svg+xml")
+            elif st.session_state.get('map_err'):
+                st.error(st.session_state['map_err'])
+    if 'map_sum' in st.session_state:
+        st.divider()
+        st.markdown(st.session_state['map_sum'])
+
 # ==========================================
 # 4. UI STYLES (PERMANENT DARK NEON)
 # ==========================================
@@ -263,6 +322,9 @@ def inject_css():
         pointer-events: none;
         backdrop-filter: blur(5px);
     }
+
+    .concept-map { background: #ffffff; border-radius: 10px; padding: 10px; overflow-x: auto; }
+    .concept-map svg { max-width: 100%; height: auto; }
     </style>
     """, unsafe_allow_html=True)
 
@@ -286,6 +348,7 @@ if not st.session_state['logged_in']:
                 user = check_user(u, p)
                 if user:
                     st.session_state.update({"logged_in": True, "username": u, "role": user[2], "name": user[3]})
+                    st.query_params["s"] = sessions.issue_token(u, user[2], user[3])
                     st.rerun()
                 else:
                     st.error("Invalid credentials")
@@ -294,12 +357,11 @@ if not st.session_state['logged_in']:
             np = st.text_input("New Password", type="password")
             nn = st.text_input("Full Name")
             nr = st.selectbox("Role", ["Student", "Teacher"])
+            ns = st.text_input("School code", help="Given by your school; leave empty if you don't have one.")
             if st.button("Create Account"):
-                success, msg = register_user(nu, np, nr, nn)
+                success, msg = register_user(nu, np, nr, nn, ns)
                 if success: st.success(msg)
                 else: st.error(msg)
-    with col2:
-        st.info("Demo: admin / admin")
 
 
 # ==========================================
@@ -317,15 +379,51 @@ else:
         st.divider()
         
         if st.session_state['role'] == "Teacher":
-            menu = st.radio("Menu", ["Lesson Plans", "Create Content", "Knowledge Map", "Holodeck","Video"])
+            menu = st.radio("Menu", ["Class Dashboard", "Lesson Plans", "Create Content", "Unit Pack", "Knowledge Map", "Holodeck","Video"])
         else:
             menu = st.radio("Menu", ["Learn", "Homework Scanner", "Knowledge Map", "Holodeck", "Quiz", "Progress","Oracle", "Video"])
+        if st.session_state['username'] in ADMINS:
+            if st.toggle("Admin: Metrics"): menu = "Metrics"
 
     # --- MAIN CONTENT AREA ---
     
+    # === ADMIN VIEW ===
+    if menu == "Metrics":
+        render_metrics_page()
+
     # === TEACHER VIEW ===
-    if st.session_state['role'] == "Teacher":
-        if menu == "Lesson Plans":
+    elif st.session_state['role'] == "Teacher":
+        if menu == "Class Dashboard":
+            st.header("Class Dashboard")
+            school = school_of(st.session_state['username'])  # teachers only see their own school's shard
+            overview = analytics.class_overview(school)
+            if overview.empty:
+                st.info("No student scores yet.")
+            else:
+                c1, c2, c3 = st.columns(3)
+                c1.metric("Students", int(analytics.class_matrix(school).shape[0]))
+                c2.metric("Topics", len(overview))
+                c3.metric("Avg mastery", f"{overview['mean'].mean():.0f}%")
+
+                st.subheader("📊 Topic Mastery")
+                st.bar_chart(overview["mean"], color="#00c6ff")
+                st.dataframe(overview.rename(columns={"students": "Students", "mean": "Mean %", "median": "Median %",
+                                                      "p25": "P25", "p75": "P75", "at_risk": f"< {analytics.AT_RISK}%"}),
+                             use_container_width=True)
+
+                st.subheader("📈 Weekly Trend")
+                trend = analytics.class_trend(school=school)
+                if not trend.empty: st.line_chart(trend)
+
+                st.subheader("⚠️ Students Needing Support")
+                risk = analytics.at_risk_students(school=school)
+                if risk.empty: st.success("Nobody is below the at-risk threshold.")
+                else: st.dataframe(risk, use_container_width=True)
+
+                with st.expander("Student x Topic grid"):
+                    st.dataframe(analytics.class_matrix(school), use_container_width=True)
+
+        elif menu == "Lesson Plans":
             st.header("Generate Lesson Plans")
             topic = st.text_input("Topic")
             grade = st.selectbox("Grade", ["1-5", "6-8", "9-12"])
@@ -335,17 +433,20 @@ else:
                 prompt = f"{context}\n\nCreate a lesson plan on {topic} for grade {grade}. Examples, Notes, Experiments, everything needed."
                 
                 with st.spinner("Generating..."):
-                    res = ask_ai(prompt)
-                    st.markdown(f'<div class="lesson">{res}</div>', unsafe_allow_html=True)
-                    
-                    st.divider()
-                    st.subheader("🛡️ Audit")
-                    if st.button("Run Bias Check"):
-                        audit_res = ask_ai(f"Audit this lesson for bias/hallucinations:\n\n{res[:4000]}")
-                        st.markdown(f'<div class="audit-pass">{audit_res}</div>', unsafe_allow_html=True)
+                    st.session_state['lesson_out'] = {"topic": topic, "text": ask_ai(prompt, "lesson")}
 
-                    pdf = create_pdf(f"Lesson: {topic}", res)
-                    st.download_button("Download PDF", pdf, f"lesson_{topic}.pdf", "application/pdf")
+            # Kept in session state so the audit/PDF buttons below survive their own rerun
+            if st.session_state.get('lesson_out'):
+                topic, res = st.session_state['lesson_out']["topic"], st.session_state['lesson_out']["text"]
+                st.markdown(f'<div class="lesson">{res}</div>', unsafe_allow_html=True)
+                
+                st.divider()
+                st.subheader("🛡️ Audit")
+                if st.button("Run Bias Check"):
+                    audit_res = ask_ai(f"Audit this lesson for bias/hallucinations:\n\n{res[:4000]}", "audit")
+                    st.markdown(f'<div class="audit-pass">{audit_res}</div>', unsafe_allow_html=True)
+
+                pdf_download(f"Lesson: {topic}", res, f"lesson_{topic}.pdf")
 
         elif menu == "Create Content":
             st.header("Quiz & Worksheet Creator")
@@ -357,39 +458,49 @@ else:
                 prompt = f"{context}\n\nCreate a {ctype} for {topic} with answers."
                 
                 with st.spinner("Working..."):
-                    res = ask_ai(prompt)
-                    st.markdown(f'<div class="lesson">{res}</div>', unsafe_allow_html=True)
-                    st.download_button("Download PDF", create_pdf(f"{ctype}: {topic}", res), f"{ctype}_{topic}.pdf", "application/pdf")
+                    st.session_state['content_out'] = {"title": f"{ctype}: {topic}", "file": f"{ctype}_{topic}.pdf", "text": ask_ai(prompt, "quiz")}
+
+            if st.session_state.get('content_out'):
+                out = st.session_state['content_out']
+                st.markdown(f'<div class="lesson">{out["text"]}</div>', unsafe_allow_html=True)
+                pdf_download(out["title"], out["text"], out["file"])
         
+        elif menu == "Unit Pack":
+            st.header("Unit Pack Builder")
+            st.caption("Generate lessons, quizzes and worksheets for a whole term in one background job.")
+            topics_txt = st.text_area("Topics (one per line)", height=150)
+            col1, col2, col3 = st.columns(3)
+            with col1: grades = st.multiselect("Grades", ["1-5", "6-8", "9-12"], default=["6-8"])
+            with col2: kinds = st.multiselect("Include", list(batch.KINDS), default=list(batch.KINDS))
+            with col3: fmt = st.radio("Deliver as", ["ZIP of PDFs", "One merged PDF"])
+
+            topics = list(dict.fromkeys(t.strip() for t in topics_txt.splitlines() if t.strip()))
+            if st.button("Build Pack"):
+                if topics and grades and kinds:
+                    context = f"SOURCE MATERIAL:\n{st.session_state['file_content'][:5000]}" if st.session_state['file_content'] else ""
+                    job = batch.start_job(topics, grades, kinds, "zip" if fmt.startswith("ZIP") else "pdf", context, ai_priority())
+                    st.session_state['pack_job'] = job.id
+                else:
+                    st.error("Add at least one topic, grade and content type.")
+
+            @st.fragment(run_every=2)
+            def pack_progress():
+                job = batch.get_job(st.session_state.get('pack_job', ""))
+                if not job: return
+                st.progress(job.progress(), text=f"{job.status.title()} · {job.generated}/{job.total} generated · {job.built} PDFs built")
+                if job.finished:
+                    st.caption(f"Finished in {job.finished - job.started:.0f}s")
+                    if job.result:
+                        mime = "application/zip" if job.fmt == "zip" else "application/pdf"
+                        st.download_button("Download Unit Pack", job.result, job.filename(), mime)
+                    for err in job.failed: st.warning(err)
+            pack_progress()
+
         elif menu == "Knowledge Map":
-            st.header("Knowledge Graph")
-            if not st.session_state['file_content']:
-                st.warning("⚠️ Upload a PDF first!")
-            else:
-                if st.button("Generate Map"):
-                    with st.spinner("Mapping..."):
-                        graph_prompt = f"Source: {st.session_state['file_content'][:3000]}\nTask: Create a CLEAN hierarchical concept map (Top 15 concepts). Format: Graphviz DOT. Layout: rankdir=TB, splines=ortho. Return ONLY DOT code inside ```dot ... ```."
-                        graph_res = ask_ai(graph_prompt)
-                        dot_code = clean_ai_response(graph_res) # FIX: Use Cleaner
-                        if "digraph" not in dot_code: dot_code = f"digraph G {{ {dot_code} }}"
-                        st.session_state['map_dot'] = dot_code
-                        st.session_state['map_sum'] = ask_ai(f"Summarize this text as smart notes:\n{st.session_state['file_content'][:3000]}")
-
-            if 'map_dot' in st.session_state:
-                st.subheader("🕸️ Concept Map")
-                st.graphviz_chart(st.session_state['map_dot'])
-            if 'map_sum' in st.session_state:
-                st.divider()
-                st.markdown(st.session_state['map_sum'])
+            knowledge_map_view()
 
         elif menu == "Holodeck":
-            st.header("Generative Simulation Lab")
-            sim_topic = st.text_input("What system to simulate?", "Projectile Motion")
-            if st.button("Generate Simulation"):
-                with st.spinner("Coding..."):
-                    sim_prompt = f"Write a single HTML5 file with Canvas/JS to simulate: {sim_topic}. Requirements: Canvas Height 400px, Dark Mode, Sliders at top. Return ONLY raw HTML."
-                    st.session_state['last_sim'] = clean_ai_response(ask_ai(sim_prompt)) # FIX: Use Cleaner
-            if st.session_state['last_sim']: render_simulation(st.session_state['last_sim'])
+            holodeck_view()
 
     # === STUDENT VIEW ===
     else:
@@ -416,55 +527,37 @@ else:
         # 2. HOMEWORK SCANNER
         elif menu == "Homework Scanner":
             st.header("AI Homework Helper")
-            st.caption("Upload a photo of a math problem, diagram, or essay.")
-            img_file = st.file_uploader("Upload Image", type=["jpg", "png", "jpeg"])
+            st.caption("Upload photos of a math problem, diagram, or essay — several pages at once is fine.")
+            img_files = st.file_uploader("Upload Images", type=["jpg", "png", "jpeg"], accept_multiple_files=True)
             
-            if img_file:
-                image = Image.open(img_file)
-                st.image(image, caption="Uploaded Homework", width=300)
+            if img_files:
+                thumbs = st.columns(min(len(img_files), 6))
+                for i, f in enumerate(img_files): thumbs[i % len(thumbs)].image(f, caption=f"Page {i + 1}", width=150)
                 task_type = st.radio("What should AI do?", ["Solve Math Problem", "Analyze Diagram", "Grade Handwritten Text"])
                 
-                if st.button("Analyze Image"):
-                    with st.spinner("Processing..."):
+                if st.button("Analyze Images" if len(img_files) > 1 else "Analyze Image"):
+                    with st.spinner(f"Processing {len(img_files)} page(s)..."):
                         if task_type == "Solve Math Problem": v_prompt = "Solve this math problem. Use LaTeX for math.If there are multiple problems, solve all of them."
                         elif task_type == "Analyze Diagram": v_prompt = "Explain this scientific diagram in detail."
                         else: v_prompt = "Transcribe and grade this handwritten text."
                         
-                        res = ask_ai_vision(v_prompt, image)
-                        st.subheader("Analysis")
-                        st.markdown(f'<div class="lesson">{res}</div>', unsafe_allow_html=True)
+                        pages = scanner.analyse_pages(img_files, task_type, v_prompt, ai_priority())
+                    st.subheader("Analysis")
+                    for i, (image, res, source) in enumerate(pages, 1):
+                        with st.expander(f"Page {i}", expanded=len(pages) == 1 or i == 1):
+                            if source == "error":
+                                st.error(res)
+                                continue
+                            if source == "library": st.caption("⚡ Same page as one already analysed — answer served from the library.")
+                            st.markdown(f'<div class="lesson">{res}</div>', unsafe_allow_html=True)
 
         # 3. KNOWLEDGE MAP
         elif menu == "Knowledge Map":
-            st.header("Knowledge Graph")
-            if not st.session_state['file_content']:
-                st.warning("⚠️ Upload a PDF first!")
-            else:
-                if st.button("Generate Map"):
-                    with st.spinner("Mapping..."):
-                        graph_prompt = f"Source: {st.session_state['file_content'][:3000]}\nTask: Create a CLEAN hierarchical concept map (Top 15 concepts). Format: Graphviz DOT. Layout: rankdir=TB, splines=ortho. Return ONLY DOT code inside ```dot ... ```."
-                        graph_res = ask_ai(graph_prompt)
-                        dot_code = clean_ai_response(graph_res) # FIX: Use Cleaner
-                        if "digraph" not in dot_code: dot_code = f"digraph G {{ {dot_code} }}"
-                        st.session_state['map_dot'] = dot_code
-                        st.session_state['map_sum'] = ask_ai(f"Summarize this text as smart notes:\n{st.session_state['file_content'][:3000]}")
-
-            if 'map_dot' in st.session_state:
-                st.subheader("🕸️ Concept Map")
-                st.graphviz_chart(st.session_state['map_dot'])
-            if 'map_sum' in st.session_state:
-                st.divider()
-                st.markdown(st.session_state['map_sum'])
+            knowledge_map_view()
 
         # 4. HOLODECK
         elif menu == "Holodeck":
-            st.header("Generative Simulation Lab")
-            sim_topic = st.text_input("What system to simulate?", "Projectile Motion")
-            if st.button("Generate Simulation"):
-                with st.spinner("Coding..."):
-                    sim_prompt = f"Write a single HTML5 file with Canvas/JS to simulate: {sim_topic}. Requirements: Canvas Height 400px, Dark Mode, Sliders at top. Return ONLY raw HTML."
-                    st.session_state['last_sim'] = clean_ai_response(ask_ai(sim_prompt)) # FIX: Use cleaner
-            if st.session_state['last_sim']: render_simulation(st.session_state['last_sim'])
+            holodeck_view()
 
         # 5. QUIZ
         elif menu == "Quiz":
@@ -475,83 +568,142 @@ else:
             with col3: num = st.text_input("Questions", "5")
             
             if st.button("Start Quiz"):
-                context = f"SOURCE:\n{st.session_state['file_content'][:5000]}" if st.session_state['file_content'] else ""
-                prompt = f"{context}\n\nCreate {num} MCQ questions about {topic} in {diff}. Answer key included."
-                with st.spinner("Generating..."):
-                    res = ask_ai(prompt)
-                    st.markdown(f'<div class="lesson">{res}</div>', unsafe_allow_html=True)
-            
-            st.divider()
-            st.subheader("📝 Self-Grading")
-            try: max_q = int(num)
-            except: max_q = 5
-            
-            correct_count = st.slider("How many did you get right?", 0, max_q, 0)
-            if max_q > 0: percentage = int((correct_count / max_q) * 100)
-            else: percentage = 0
-
-            if st.button("Save Result"):
-                if topic:
-                    save_score(st.session_state['username'], topic, percentage)
-                    st.success(f"✅ Saved! Score: {percentage}%")
-                    if percentage >= 80: st.balloons()
-                else:
+                if not topic:
                     st.error("Enter topic name first.")
+                else:
+                    try: n_q = int(num)
+                    except: n_q = 5
+                    context = f"SOURCE:\n{st.session_state['file_content'][:5000]}" if st.session_state['file_content'] else ""
+                    with st.spinner("Generating..."):
+                        try:
+                            questions = question_bank.get_quiz(topic, diff, n_q, context, ai_priority())
+                            st.session_state['quiz_n'] = st.session_state.get('quiz_n', 0) + 1
+                            st.session_state['quiz'] = {"id": st.session_state['quiz_n'], "topic": topic, "questions": questions, "results": None}
+                        except llm.RateLimitError:
+                            st.error("🚨 The AI is busy right now (rate limit). Please try again in a minute.")
+                        except Exception as e:
+                            st.error(f"Could not build the quiz: {e}")
+
+            active = st.session_state.get('quiz')
+            if active:
+                st.divider()
+                st.subheader(f"📝 {active['topic']}")
+                if active["results"] is None:
+                    with st.form("quiz_form"):
+                        picks = []
+                        for i, q in enumerate(active["questions"]):
+                            picks.append(st.radio(f"**{i + 1}. {q['question']}**", range(len(q["options"])),
+                                                  format_func=lambda k, q=q: q["options"][k], index=None, key=f"quiz_{active['id']}_q{i}"))
+                        if st.form_submit_button("Submit Answers"):
+                            correct_count, results = quiz.grade_quiz(active["questions"], picks)
+                            percentage = int(correct_count / len(results) * 100)
+                            save_quiz_results(st.session_state['username'], active["topic"], percentage, results)
+                            active["results"] = {"score": percentage, "correct": correct_count, "items": results}
+                            st.rerun()
+                else:
+                    res = active["results"]
+                    st.success(f"✅ Saved! Score: {res['score']}% ({res['correct']}/{len(res['items'])})")
+                    if res["score"] >= 80: st.balloons()
+                    for i, r in enumerate(res["items"]):
+                        mark = "✅" if r["is_correct"] else "❌"
+                        picked = r["options"][r["chosen"]] if r["chosen"] is not None else "(no answer)"
+                        with st.expander(f"{mark} {i + 1}. {r['question']}", expanded=not r["is_correct"]):
+                            st.write(f"Your answer: {picked}")
+                            st.write(f"Correct answer: {r['options'][r['correct']]}")
+                            if r["explanation"]: st.caption(r["explanation"])
+                    if st.button("New Quiz"):
+                        del st.session_state['quiz']
+                        st.rerun()
 
         # 6. PROGRESS (With Leaderboard)
         elif menu == "Progress":
             st.header("My Progress")
-            df = get_user_scores(st.session_state['username'])
-            if not df.empty:
+            user = st.session_state['username']
+            window = st.radio("Window", analytics.WINDOWS, horizontal=True, index=2)
+            since = analytics.window_since(window)
+            mastery = analytics.user_mastery(user, since)
+            if not mastery.empty:
                 st.subheader("📊 Skill Mastery (Average %)")
-                avg_df = df.groupby("topic")["score"].mean()
-                st.bar_chart(avg_df, color="#00c6ff")
+                st.bar_chart(mastery.set_index("topic")["mastery"], color="#00c6ff")
+
+                ranks = analytics.percentile_ranks(user)
+                trend = analytics.user_trend(user, since)
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.subheader("🏅 Class Percentile")
+                    st.dataframe(mastery.assign(percentile=mastery["topic"].map(ranks))[["topic", "mastery", "attempts", "percentile"]]
+                                 .rename(columns={"topic": "Topic", "mastery": "Mastery (%)", "attempts": "Attempts", "percentile": "Percentile"}).round(1),
+                                 use_container_width=True, hide_index=True)
+                with col2:
+                    st.subheader("📈 Trend")
+                    st.line_chart(trend.set_index("day")["score"], color="#FF0055")
                 
                 st.divider()
                 st.subheader("📜 History")
-                display_df = df.sort_values(by="date", ascending=False).rename(columns={"topic":"Topic", "score":"Score (%)", "date":"Date"})
+                # Keyset pages: a stack of cursors so "Newer" can walk back
+                if st.session_state.get('hist_window') != window:
+                    st.session_state.update({"hist_window": window, "hist_cursors": [None]})
+                cursors = st.session_state['hist_cursors']
+                page, next_cursor = get_score_page(user, cursors[-1], HISTORY_PAGE, since)
+                display_df = page.rename(columns={"topic":"Topic", "score":"Score (%)", "date":"Date"})
                 st.dataframe(display_df, use_container_width=True, hide_index=True)
+                total = count_scores(user, since)
+                start = (len(cursors) - 1) * HISTORY_PAGE
+                c1, c2, c3 = st.columns([1, 2, 1])
+                with c1:
+                    if len(cursors) > 1 and st.button("◀ Newer"):
+                        cursors.pop(); st.rerun()
+                with c2: st.caption(f"Rows {start + 1}-{start + len(page)} of {total}")
+                with c3:
+                    if next_cursor and st.button("Older ▶"):
+                        cursors.append(next_cursor); st.rerun()
             else:
                 st.info("No scores yet.")
             
             # --- GLOBAL LEADERBOARD (Added) ---
             st.divider()
             st.subheader("🏆 Global Leaderboard")
-            conn = sqlite3.connect(DB)
-            ldf = pd.read_sql_query("SELECT username, SUM(score) as total_xp FROM scores GROUP BY username ORDER BY total_xp DESC LIMIT 5", conn)
-            conn.close()
+            ldf = get_leaderboard(5)
             st.dataframe(ldf, use_container_width=True, hide_index=True)
 
         # 7. ORACLE (Added Logic)
         elif menu == "Oracle":
             st.header("The Oracle")
             st.caption("AI Career Predictor based on your performance.")
-            df = get_user_scores(st.session_state['username'])
+            avg_scores = oracle.avg_scores(st.session_state['username'])
             
-            if df.empty:
+            if not avg_scores:
                 st.info("The Oracle needs data. Go take some Quizzes first!")
             else:
-                avg_scores = df.groupby("topic")["score"].mean().to_dict()
                 col1, col2 = st.columns([1, 2])
                 with col1:
                     st.subheader("Your DNA")
                     st.json(avg_scores)
                 with col2:
-                    if st.button("Consult The Oracle"):
-                        with st.spinner("Analyzing neural patterns..."):
-                            oracle_prompt = f"""
-                            User Data: {avg_scores}
-                            Task: Predict 3 futuristic careers and a roadmap. Cyberpunk tone.
-                            """
-                            prediction = ask_ai(oracle_prompt)
-                            st.markdown(f'<div class="lesson" style="border-left: 5px solid #a200ff;">{prediction}</div>', unsafe_allow_html=True)
-                            st.balloons()
+                    prediction = oracle.cached_prediction(st.session_state['username'], avg_scores)
+                    if prediction:
+                        st.markdown(f'<div class="lesson" style="border-left: 5px solid #a200ff;">{prediction}</div>', unsafe_allow_html=True)
+                    else:
+                        if oracle.is_refreshing(st.session_state['username']):
+                            st.caption("🔮 The Oracle is reading your latest results...")
+                        if st.button("Consult The Oracle"):
+                            with st.spinner("Analyzing neural patterns..."):
+                                try:
+                                    prediction = oracle.predict(st.session_state['username'], ai_priority())
+                                    st.markdown(f'<div class="lesson" style="border-left: 5px solid #a200ff;">{prediction}</div>', unsafe_allow_html=True)
+                                    st.balloons()
+                                except llm.RateLimitError:
+                                    st.error("🚨 The AI is busy right now (rate limit). Please try again in a minute.")
+                                except Exception as e:
+                                    st.error(f"Error: {e}")
 
         # 8. VIDEO
         elif menu == "Video":
             st.header("AI Video Generator (Manim)")
     
             sim_topic = st.text_input("What do you want to visualize?", "Binary Search Visualization")
+            parallel = st.toggle("Parallel render (long scenes)", help="Splits the scene at animation boundaries and renders the parts on several cores.")
+            stream = st.toggle("Adaptive streaming (HLS)", help="Several bitrates for slow networks; used for clips longer than 30s.")
     
             if st.button("Generate Video"):
                 if sim_topic:
@@ -606,17 +758,22 @@ class GenScene(Scene):
                     
                     else:
                         with st.spinner(f"🤖 AI is scripting '{sim_topic}'..."):
+                            math_rule = ("Use MathTex(r'...') for formulas and Text for words" if manim_render.latex_available()
+                                         else "NO LATEX (Use Text only)")
                             manim_prompt = f"""
                             You are a Manim Python coder. Write a script using 'from manim import *'.
                             Task: Create a 10s animation for: {sim_topic}.
-                            Constraints: NO LATEX (Use Text only), Safe Positioning (.to_edge), Group Animations (bars[0].animate).
+                            Constraints: {math_rule}, Safe Positioning (.to_edge), Group Animations (bars[0].animate).
                             Return ONLY python code.
                             """
-                            code_response = ask_ai(manim_prompt)
-                            
-                            if "retry" in code_response.lower() or "error" in code_response.lower():
+                            try:
+                                code_response = llm.generate(manim_prompt, "manim-code", ai_priority())
+                            except llm.RateLimitError:
                                 st.error("🚨 Google AI Rate Limit Hit! (Wait 30s or use 'sort'/'search' demo)")
                                 st.stop()
+                            except Exception as e:
+                                st.error(f"AI Error: {e}")
+                                st.stop()
                             
                             clean_code = code_response.replace("```python", "").replace("```", "").strip()
 
@@ -627,16 +784,23 @@ class GenScene(Scene):
                             f.write(safe_imports + script_body)
                     
                         with st.spinner("⚙️ Rendering Video..."):
-                            cmd = [sys.executable, "-m", "manim", "-ql", "--disable_caching", "-o", "final_video.mp4", "manim_script.py", "GenScene"]
                             try:
-                                result = subprocess.run(cmd, cwd=os.getcwd(), capture_output=True, text=True, encoding="utf-8", errors="replace")
-                                if result.returncode == 0:
+                                result = (manim_render.render_parallel if parallel else manim_render.render)("manim_script.py")
+                                if result["ok"]:
                                     st.success("✨ Render Complete!")
-                                    st.video("media/videos/manim_script/480p15/final_video.mp4")
+                                    if result["overhead"] is not None:
+                                        segs = f" · {result['segments']} segments" if result.get('segments') else ""
+                                        st.caption(f"Startup {result['overhead']:.2f}s · frames {result['render']:.2f}s · total {result['wall']:.2f}s{segs}")
+                                    hls_url = None
+                                    if stream and manim_render.wants_hls(result["path"], "low_quality"):
+                                        with st.spinner("Packaging for streaming..."):
+                                            hls_url = manim_render.package_hls(result["path"])
+                                    if hls_url: render_hls(hls_url)
+                                    else: st.video(result["path"])
                                     with st.expander("Code"): st.code(clean_code)
                                 else:
                                     st.error("💥 Manim Error")
-                                    with st.expander("Logs"): st.code(result.stderr)
+                                    with st.expander("Logs"): st.code(result["log"])
                             except Exception as e:
                                 st.error(f"System Error: {e}")
 
@@ -657,5 +821,8 @@ class GenScene(Scene):
         
         st.divider()
         if st.button("Logout"):
+            if "s" in st.query_params:
+                sessions.revoke_token(st.query_params["s"])
+                del st.query_params["s"]
             st.session_state['logged_in'] = False
             st.rerun()
@@ -0,0 +1,172 @@
+"""Batch "unit pack" export: many topics x grade bands in one background job.
+
+The Gemini calls fan out on a thread pool (the shared limiter in llm.py keeps
+them inside quota) and the PDFs are built on a process pool, since FPDF is
+pure Python. Jobs are kept process-wide so a teacher can leave the page and
+come back to a finished pack.
+"""
+import io
+import os
+import re
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import PyPDF2
+
+import llm
+import metrics
+from pdf_tools import build_pdf
+
+CONCURRENCY = int(os.getenv("MENTIS_BATCH_CONCURRENCY", "8"))
+PDF_WORKERS = int(os.getenv("MENTIS_BATCH_PDF_WORKERS", str(os.cpu_count() or 2)))
+MAX_JOBS = 50  # finished jobs kept in memory
+
+KINDS = {
+    "Lesson Plan": ("lesson", "Create a lesson plan on {topic} for grade {grade}. Examples, Notes, Experiments, everything needed."),
+    "Quiz": ("quiz", "Create a Quiz for {topic} (grade {grade}) with answers."),
+    "Worksheet": ("quiz", "Create a Worksheet for {topic} (grade {grade}) with answers."),
+}
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_threads = ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix="batch-ai")
+_pdf_pool = None
+
+
+class BatchJob:
+    def __init__(self, items, fmt):
+        self.id = uuid.uuid4().hex[:8]
+        self.items = items  # [(kind, topic, grade)]
+        self.fmt = fmt      # "zip" or "pdf"
+        self.total = len(items)
+        self.generated = 0
+        self.built = 0
+        self.failed = []
+        self.status = "queued"
+        self.result = None
+        self.started = time.time()
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def progress(self):
+        # AI generation is most of the wall time, so weight it 80/20 against PDF building
+        if not self.total: return 1.0
+        return min(1.0, (0.8 * self.generated + 0.2 * self.built) / self.total)
+
+    def filename(self):
+        return f"unit_pack_{self.id}.{'zip' if self.fmt == 'zip' else 'pdf'}"
+
+
+def _slug(text):
+    return re.sub(r"[^A-Za-z0-9]+", "_", text).strip("_")[:40] or "item"
+
+
+def _get_pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is None:
+        _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+    return _pdf_pool
+
+
+def _generate(job, item, context, priority):
+    kind, topic, grade = item
+    task, template = KINDS[kind]
+    prompt = f"{context}\n\n{template.format(topic=topic, grade=grade)}"
+    try:
+        text = llm.generate(prompt, task, priority)
+    except Exception as e:
+        with job.lock: job.failed.append(f"{kind} - {topic} ({grade}): {e}")
+        text = None
+    with job.lock: job.generated += 1
+    return item, text
+
+
+def _build_one(job, out, item, build):
+    """Appends (item, pdf bytes) to out; a PDF that fails to build is listed in FAILED.txt instead of failing the pack."""
+    kind, topic, grade = item
+    try:
+        out.append((item, build()))
+    except BrokenProcessPool:
+        raise
+    except Exception as e:
+        with job.lock: job.failed.append(f"{kind}: {topic} ({grade}): PDF build failed: {e}")
+    with job.lock: job.built += 1
+
+
+def _build_all(job, done):
+    """done: [(item, text)] -> [(item, pdf bytes)] in the original item order."""
+    global _pdf_pool
+    order = {item: i for i, item in enumerate(job.items)}
+    out = []
+    finished = set()
+    try:
+        pool = _get_pdf_pool()
+        futures = {pool.submit(build_pdf, f"{kind}: {topic} ({grade})", text): (kind, topic, grade) for (kind, topic, grade), text in done}
+        for f in as_completed(futures):
+            _build_one(job, out, futures[f], f.result)
+            finished.add(futures[f])
+    except (BrokenProcessPool, OSError):
+        # Worker processes unavailable here: drop the pool (a broken one stays broken) and build the rest inline
+        _pdf_pool = None
+        for (kind, topic, grade), text in done:
+            if (kind, topic, grade) in finished: continue
+            _build_one(job, out, (kind, topic, grade), lambda: build_pdf(f"{kind}: {topic} ({grade})", text))
+    return sorted(out, key=lambda p: order[p[0]])
+
+
+def _package(job, pdfs):
+    buf = io.BytesIO()
+    if job.fmt == "zip":
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+            for (kind, topic, grade), data in pdfs:
+                z.writestr(f"{_slug(topic)}/{_slug(grade)}_{_slug(kind)}.pdf", data)
+            if job.failed:
+                z.writestr("FAILED.txt", "\n".join(job.failed))
+    else:
+        writer = PyPDF2.PdfWriter()
+        for _, data in pdfs:
+            writer.append(io.BytesIO(data))
+        writer.write(buf)
+    return buf.getvalue()
+
+
+def _run(job, context, priority):
+    job.status = "generating"
+    with metrics.span("batch.job"):
+        futures = [_threads.submit(_generate, job, item, context, priority) for item in job.items]
+        done = [f.result() for f in futures]
+        done = [(item, text) for item, text in done if text]
+        job.status = "building"
+        pdfs = _build_all(job, done)
+        job.status = "packaging"
+        job.result = _package(job, pdfs) if pdfs else None
+    job.finished = time.time()
+    job.status = "done" if job.result else "failed"
+
+
+def start_job(topics, grades, kinds, fmt="zip", context="", priority=llm.TEACHER):
+    """Queues a unit pack and returns its BatchJob (poll job.progress()/job.status)."""
+    items = [(kind, topic, grade) for topic in topics for grade in grades for kind in kinds]
+    job = BatchJob(items, fmt)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        for old in sorted(_jobs.values(), key=lambda j: j.started)[:-MAX_JOBS]:
+            del _jobs[old.id]
+
+    def runner():
+        try: _run(job, context, priority)
+        except Exception as e:
+            job.failed.append(f"Job error: {e}")
+            job.status = "failed"
+            job.finished = time.time()
+    threading.Thread(target=runner, daemon=True, name=f"batch-{job.id}").start()
+    return job
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
@@ -0,0 +1,110 @@
+"""Micro-benchmarks for the hot helpers.
+
+    pip install -r benchmarks/requirements.txt
+    cd benchmarks && pytest --benchmark-autosave            # record a run
+    cd benchmarks && pytest --benchmark-compare --benchmark-compare-fail=mean:20%
+"""
+import threading
+import time
+
+import pytest
+
+import db
+from conftest import lesson_text
+from llm import clean_ai_response
+from pdf_tools import create_pdf, extract_text_from_pdf
+
+
+# ==========================================
+# PDF
+# ==========================================
+@pytest.mark.parametrize("pages", [10, 100, 500])
+def bench_extract_text_from_pdf(benchmark, pdf_fixture, pages):
+    path = pdf_fixture(pages)
+    text = benchmark.pedantic(extract_text_from_pdf, args=(path,), rounds=3 if pages == 500 else 5)
+    assert f"Page {pages}" in text
+
+
+@pytest.mark.parametrize("chars", [5_000, 50_000, 200_000])
+def bench_create_pdf(benchmark, chars):
+    content = lesson_text(chars)
+    out = benchmark(create_pdf, "Lesson: Forces", content)
+    assert out.startswith(b"%PDF")
+
+
+# ==========================================
+# SCORES
+# ==========================================
+@pytest.mark.parametrize("rows", [10_000, 1_000_000])
+def bench_get_user_scores(benchmark, scores_db, rows):
+    scores_db(rows)
+    df = benchmark(db.get_user_scores, "user00042")
+    assert not df.empty
+
+
+@pytest.mark.parametrize("rows", [10_000, 1_000_000])
+def bench_leaderboard(benchmark, scores_db, rows):
+    scores_db(rows)
+    ldf = benchmark(db.get_leaderboard, 5)
+    assert len(ldf) == 5
+
+
+@pytest.mark.parametrize("rows", [10_000, 1_000_000])
+def bench_get_score_page(benchmark, scores_db, rows):
+    scores_db(rows)
+    page, cursor = benchmark(db.get_score_page, "user00042", None, 50)
+    assert 0 < len(page) <= 50
+
+
+# ==========================================
+# WRITES (sustained throughput, many submitters)
+# ==========================================
+@pytest.mark.parametrize("group_commit", [True, False], ids=["group", "direct"])
+def bench_save_score_throughput(benchmark, tmp_path, monkeypatch, group_commit):
+    """A class of 32 students each saving 25 scores at once; extra_info has writes/s."""
+    monkeypatch.setattr(db, "DB", str(tmp_path / "writes.db"))
+    monkeypatch.setattr(db, "GROUP_COMMIT", group_commit)
+    db.init_db()
+    students, each = 32, 25
+    rounds = []
+
+    def burst():
+        rounds.append(1)
+        def student(i):
+            for j in range(each): db.save_score(f"student{i:02d}", "Algebra", j)
+        threads = [threading.Thread(target=student, args=(i,)) for i in range(students)]
+        start = time.perf_counter()
+        for t in threads: t.start()
+        for t in threads: t.join()
+        return students * each / (time.perf_counter() - start)
+
+    rate = benchmark.pedantic(burst, rounds=3)
+    benchmark.extra_info["writes_per_s"] = round(rate)
+    assert rounds and db.count_scores("student00") == len(rounds) * each  # --benchmark-disable runs a single round
+
+
+# ==========================================
+# AUTH
+# ==========================================
+def bench_check_user(benchmark, tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB", str(tmp_path / "auth.db"))
+    db.init_db()
+    db.register_user("bench_user", "Passw0rd", "Student", "Bench")
+    user = benchmark(db.check_user, "bench_user", "Passw0rd")
+    assert user
+
+
+# ==========================================
+# AI RESPONSE CLEANER
+# ==========================================
+def _response(kb, fenced):
+    body = "".join(f"    x{i} = Text('step {i}').to_edge(UP)\n" for i in range(kb * 1024 // 40))
+    if fenced: return f"Here is your scene:\n```python\nfrom manim import *\n{body}```\nEnjoy!"
+    return body
+
+
+@pytest.mark.parametrize("kb", [100, 1024])
+@pytest.mark.parametrize("fenced", [True, False], ids=["fenced", "unfenced"])
+def bench_clean_ai_response(benchmark, kb, fenced):
+    code = benchmark(clean_ai_response, _response(kb, fenced))
+    assert "x1 = Text" in code
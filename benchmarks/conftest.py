@@ -0,0 +1,94 @@
+"""Locally generated fixtures for the micro-benchmarks (nothing is downloaded)."""
+import os
+import random
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from fpdf import FPDF
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+PARAGRAPH = ("Newton's second law states that the acceleration of an object depends on the net force "
+             "acting on it and its mass. Students should compare pushing an empty cart with a full one. ")
+TOPICS = ["Fractions", "Photosynthesis", "Gravity", "Algebra", "Cells", "Climate", "Optics", "Genetics"]
+
+
+def make_pdf(path, pages):
+    pdf = FPDF()
+    pdf.set_font("Arial", size=11)
+    for i in range(pages):
+        pdf.add_page()
+        pdf.multi_cell(0, 6, f"Page {i + 1}\n" + PARAGRAPH * 12)
+    pdf.output(path)
+
+
+@pytest.fixture(scope="session")
+def pdf_fixture(tmp_path_factory):
+    """Returns a function pages -> path, building each PDF once per session."""
+    root = tmp_path_factory.mktemp("pdfs")
+    built = {}
+
+    def get(pages):
+        if pages not in built:
+            built[pages] = str(root / f"doc_{pages}.pdf")
+            make_pdf(built[pages], pages)
+        return built[pages]
+    return get
+
+
+def lesson_text(chars):
+    blocks, size, i = [], 0, 0
+    while size < chars:
+        block = f"## Step {i}: Explore\n- {PARAGRAPH}\n- Experiment {i}: measure and record.\n\n"
+        blocks.append(block)
+        size += len(block)
+        i += 1
+    return "".join(blocks)[:chars]
+
+
+def fill_scores(path, rows, users=1000):
+    conn = sqlite3.connect(path)
+    rng = random.Random(rows)
+    start = datetime(2024, 1, 1)
+    batch = []
+    for i in range(rows):
+        date = (start + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M')
+        batch.append((f"user{rng.randrange(users):05d}", rng.choice(TOPICS), rng.randint(0, 100), date))
+        if len(batch) == 50000:
+            conn.executemany("INSERT INTO scores VALUES (?, ?, ?, ?)", batch)
+            batch.clear()
+    conn.executemany("INSERT INTO scores VALUES (?, ?, ?, ?)", batch)
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture(scope="session")
+def _score_dbs(tmp_path_factory):
+    """Returns a function rows -> db path with that many score rows spread over 1000 users, built once per session."""
+    root = tmp_path_factory.mktemp("dbs")
+    built = {}
+
+    def build(rows):
+        if rows not in built:
+            path = str(root / f"scores_{rows}.db")
+            with pytest.MonkeyPatch.context() as mp:
+                mp.setattr(db, "DB", path)
+                db.init_db()
+            fill_scores(path, rows)
+            built[rows] = path
+        return built[rows]
+    return build
+
+
+@pytest.fixture
+def scores_db(_score_dbs, monkeypatch):
+    """Like _score_dbs, and points db.DB at the returned file for the current benchmark only."""
+    def get(rows):
+        path = _score_dbs(rows)
+        monkeypatch.setattr(db, "DB", path)
+        return path
+    return get
@@ -0,0 +1,465 @@
+"""SQLite storage and account helpers (no Streamlit imports, so scripts can use them too).
+
+Per-school data (users, scores, notes, quiz_answers) lives in one SQLite
+shard per school so schools don't queue on each other's write lock. The
+directory tables (user_shards, schools) map usernames to shards; they live
+in DIRECTORY_DB, which defaults to the main DB, and the "default" school's
+shard is the main DB itself, so a single-school install is unchanged.
+App-wide tables (sessions, caches, the question bank) stay in the main DB.
+"""
+import json
+import os
+import queue
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+import metrics
+from passwords import hash_password, verify_password
+
+DB = os.getenv("MENTIS_DB", "school.db")
+GROUP_COMMIT = os.getenv("MENTIS_GROUP_COMMIT", "1") != "0"
+COMMIT_WINDOW = float(os.getenv("MENTIS_COMMIT_WINDOW_MS", "4")) / 1000  # how long a batch waits for company
+MAX_BATCH = 256
+BUSY_TIMEOUT = 10  # seconds to wait on another process's write lock
+DIRECTORY_DB = os.getenv("MENTIS_DIRECTORY_DB")  # None: the directory tables live in DB
+SHARD_DIR = os.getenv("MENTIS_SHARD_DIR")        # None: a "shards" folder next to DB
+DEFAULT_SCHOOL = "default"
+ADMINS = {u.strip() for u in os.getenv("MENTIS_ADMINS", "").split(",") if u.strip()}  # usernames that see the Metrics page
+RESERVED_USERNAMES = {"admin", "administrator", "root"}  # never available through sign-up
+
+# Called with the username after every score write (analytics cache invalidation etc.)
+score_hooks = []
+
+
+def on_score_write(fn):
+    score_hooks.append(fn)
+    return fn
+
+
+def _score_written(username):
+    for fn in score_hooks: fn(username)
+
+
+def connect(username=None):
+    """Connection to the main DB, or to the shard holding username's school."""
+    return sqlite3.connect(shard_for(username) if username else DB)
+
+
+# ==========================================
+# SHARDS
+# ==========================================
+_shard_cache = {}  # (DB, username) -> shard path; assignments never change
+_shard_lock = threading.Lock()
+_scatter = ThreadPoolExecutor(max_workers=8, thread_name_prefix="db-shard")
+
+
+def _directory():
+    return sqlite3.connect(DIRECTORY_DB or DB, timeout=BUSY_TIMEOUT)
+
+
+def _school_slug(school):
+    return re.sub(r"[^a-z0-9]+", "-", (school or "").lower()).strip("-")[:40] or DEFAULT_SCHOOL
+
+
+def _shard_path(slug):
+    if slug == DEFAULT_SCHOOL: return DB
+    return os.path.join(SHARD_DIR or os.path.join(os.path.dirname(os.path.abspath(DB)), "shards"), f"{slug}.db")
+
+
+def ensure_school(school):
+    """Registers the school (if new) and creates its shard. Returns the shard path."""
+    slug = _school_slug(school)
+    path = _shard_path(slug)
+    conn = _directory()
+    with conn:
+        conn.execute('INSERT OR IGNORE INTO schools (school, created) VALUES (?, ?)', (slug, datetime.now().strftime('%Y-%m-%d %H:%M')))
+    conn.close()
+    if path != DB:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _init_shard(path)
+    return path
+
+
+def add_school(school, code=None):
+    """Admin-only (run from a shell): creates the school and its sign-up code. Returns (slug, code).
+
+    Sign-up only accepts codes made here, so pupils can't create shards or guess their way into a school by name.
+    """
+    slug = _school_slug(school)
+    if slug == DEFAULT_SCHOOL: raise ValueError("the default school has no code")
+    code = code or secrets.token_urlsafe(9)
+    ensure_school(slug)
+    conn = _directory()
+    with conn: conn.execute('UPDATE schools SET code = ? WHERE school = ?', (code, slug))
+    conn.close()
+    return slug, code
+
+
+def school_for_code(code):
+    """Slug of the school with this sign-up code, or None."""
+    conn = _directory()
+    row = conn.execute('SELECT school FROM schools WHERE code = ?', ((code or "").strip(),)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def shard_for(username):
+    """Shard path for a user; users missing from the directory (pre-sharding accounts) are in the default school."""
+    key = (DB, username)
+    with _shard_lock:
+        if key in _shard_cache: return _shard_cache[key]
+    conn = _directory()
+    row = conn.execute('SELECT school FROM user_shards WHERE username = ?', (username,)).fetchone()
+    conn.close()
+    if not row: return DB  # not cached: the user may be registered on another replica later
+    path = _shard_path(row[0])
+    with _shard_lock: _shard_cache[key] = path
+    return path
+
+
+def school_of(username):
+    conn = _directory()
+    row = conn.execute('SELECT school FROM user_shards WHERE username = ?', (username,)).fetchone()
+    conn.close()
+    return row[0] if row else DEFAULT_SCHOOL
+
+
+def shards(schools=None):
+    """Shard paths for the given schools (slugs), or for every school."""
+    if schools is None:
+        conn = _directory()
+        schools = [r[0] for r in conn.execute('SELECT school FROM schools')]
+        conn.close()
+    paths = {_shard_path(_school_slug(s)) for s in schools} or {DB}
+    return sorted(p for p in paths if p == DB or os.path.exists(p))
+
+
+def query_shards(sql, params=(), schools=None):
+    """Runs a read query on every shard in parallel and concatenates the results (one DataFrame).
+
+    Each user lives in exactly one shard, so per-user aggregates combine by simple concatenation;
+    cross-user aggregates should select SUM/COUNT rather than AVG and be combined by the caller.
+    """
+    def one(path):
+        conn = sqlite3.connect(path)
+        try: return pd.read_sql_query(sql, conn, params=params)
+        finally: conn.close()
+    frames = list(_scatter.map(one, shards(schools)))
+    filled = [f for f in frames if not f.empty]  # empty frames would turn numeric columns into object
+    return pd.concat(filled, ignore_index=True) if filled else frames[0]
+
+
+# ==========================================
+# GROUP-COMMIT WRITE QUEUE
+# ==========================================
+def _apply(conn, statements):
+    for sql, params in statements:
+        if isinstance(params, list): conn.executemany(sql, params)
+        else: conn.execute(sql, params or ())
+
+
+class _Write:
+    __slots__ = ("path", "statements", "done", "error")
+
+    def __init__(self, path, statements):
+        self.path = path
+        self.statements = statements  # [(sql, params)] or [(sql, [params, ...])] for executemany
+        self.done = threading.Event()
+        self.error = None
+
+
+class WriteQueue:
+    """One writer thread that commits queued writes together.
+
+    Writes arriving within COMMIT_WINDOW of each other share one transaction
+    (one fsync) instead of each taking SQLite's write lock in turn. Each write
+    runs in its own SAVEPOINT, so a failing one is rolled back alone and its
+    caller gets the exception; the others still commit.
+    """
+    def __init__(self):
+        self.q = queue.Queue()
+        self.conns = {}  # path -> connection, owned by the writer thread
+        self.thread = threading.Thread(target=self._run, daemon=True, name="db-writer")
+        self.thread.start()
+
+    def submit(self, path, statements):
+        """Queues the statements and blocks until they are committed (durable) or failed."""
+        item = _Write(path, statements)
+        self.q.put(item)
+        item.done.wait()
+        if item.error: raise item.error
+
+    def _conn(self, path):
+        conn = self.conns.get(path)
+        if conn is None:
+            conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")  # readers don't block the writer
+            conn.execute("PRAGMA synchronous=FULL")  # an ack means the batch is on disk
+            self.conns[path] = conn
+        return conn
+
+    def _run(self):
+        while True:
+            batch = [self.q.get()]
+            deadline = time.monotonic() + COMMIT_WINDOW
+            while len(batch) < MAX_BATCH:
+                try: batch.append(self.q.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty: break
+            by_path = {}
+            for item in batch: by_path.setdefault(item.path, []).append(item)
+            for path, items in by_path.items():
+                try:
+                    with metrics.span("db.group_commit"):
+                        self._commit(path, items)
+                except Exception as e:  # never let the writer thread die with callers waiting
+                    self.conns.pop(path, None)
+                    for item in items: item.error = item.error or e
+            metrics.count("db.group_commits")
+            metrics.count("db.grouped_writes", len(batch))
+            for item in batch: item.done.set()
+
+    def _commit(self, path, items):
+        try:
+            conn = self._conn(path)
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            for item in items: item.error = e
+            return
+        for item in items:
+            conn.execute("SAVEPOINT w")
+            try:
+                _apply(conn, item.statements)
+                conn.execute("RELEASE w")
+            except sqlite3.Error as e:
+                conn.execute("ROLLBACK TO w")
+                conn.execute("RELEASE w")
+                item.error = e
+        try:
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            conn.execute("ROLLBACK")
+            for item in items: item.error = item.error or e
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def write(statements, username=None):
+    """Runs [(sql, params)] as one atomic unit on the main DB (or username's shard);
+    through the group-commit writer unless MENTIS_GROUP_COMMIT=0.
+
+    params may be a list of tuples for executemany. Returns once the write is committed.
+    """
+    global _writer
+    path = shard_for(username) if username else DB
+    if not GROUP_COMMIT:
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        with conn: _apply(conn, statements)
+        conn.close()
+        return
+    with _writer_lock:
+        if _writer is None:
+            _writer = WriteQueue()
+            metrics.gauge("db.write_queue_depth", _writer.q.qsize)
+    _writer.submit(path, statements)
+
+
+# ==========================================
+# SCHEMA
+# ==========================================
+def _init_shard(path):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS users 
+                 (username TEXT PRIMARY KEY, password TEXT, role TEXT, name TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS scores 
+                 (username TEXT, topic TEXT, score INTEGER, date TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS notes 
+                 (username TEXT PRIMARY KEY, content TEXT)''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_scores_user ON scores (username, topic)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_scores_user_date ON scores (username, date)')
+    c.execute('''CREATE TABLE IF NOT EXISTS quiz_answers
+                 (username TEXT, topic TEXT, q_index INTEGER, question TEXT, options TEXT,
+                  chosen INTEGER, correct INTEGER, is_correct INTEGER, date TEXT)''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_quiz_answers_user ON quiz_answers (username, topic)')
+    conn.commit()
+    conn.close()
+
+
+_initialised = set()  # (DB, DIRECTORY_DB, SHARD_DIR) this process has already set up
+_init_lock = threading.Lock()
+
+
+@metrics.traced("db.init_db")
+def init_db():
+    """Creates the schema, every school's shard and the pre-sharding backfill, once per process
+    (app.py calls it on every rerun; the backfill alone is O(users) directory writes)."""
+    key = (DB, DIRECTORY_DB, SHARD_DIR)
+    with _init_lock:
+        if key in _initialised: return
+        _init_db()
+        _initialised.add(key)
+
+
+def _init_db():
+    _init_shard(DB)
+    conn = _directory()
+    conn.execute('''CREATE TABLE IF NOT EXISTS schools (school TEXT PRIMARY KEY, created TEXT, code TEXT)''')
+    if "code" not in [r[1] for r in conn.execute('PRAGMA table_info(schools)')]:
+        conn.execute('ALTER TABLE schools ADD COLUMN code TEXT')  # schools made before codes can't be joined until add_school
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_schools_code ON schools (code)')
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_shards (username TEXT PRIMARY KEY, school TEXT)''')
+    conn.execute('INSERT OR IGNORE INTO schools (school, created) VALUES (?, ?)', (DEFAULT_SCHOOL, datetime.now().strftime('%Y-%m-%d %H:%M')))
+    conn.commit()
+    schools = [r[0] for r in conn.execute('SELECT school FROM schools')]
+    conn.close()
+    for school in schools:
+        if school != DEFAULT_SCHOOL: ensure_school(school)
+    # Accounts created before sharding: claim their usernames for the default school
+    main = connect()
+    names = [(r[0], DEFAULT_SCHOOL) for r in main.execute('SELECT username FROM users')]
+    main.close()
+    conn = _directory()
+    with conn: conn.executemany('INSERT OR IGNORE INTO user_shards (username, school) VALUES (?, ?)', names)
+    conn.close()
+
+
+# ==========================================
+# ACCOUNTS
+# ==========================================
+@metrics.traced("db.check_user")
+def check_user(username, password):
+    conn = connect(username)
+    c = conn.cursor()
+    c.execute('SELECT * FROM users WHERE username = ?', (username,))
+    user = c.fetchone()
+    conn.close()
+    if not user: return None
+    try:
+        ok, needs_rehash = verify_password(password, user[1])
+    except: return None 
+    if not ok: return None
+    if needs_rehash:
+        # Cost factor changed since this hash was made: upgrade it transparently
+        conn = connect(username)
+        conn.execute('UPDATE users SET password = ? WHERE username = ?', (hash_password(password), username))
+        conn.commit()
+        conn.close()
+    return user
+
+@metrics.traced("db.register_user")
+def register_user(username, password, role, name, school_code="", reserved_ok=False):
+    """school_code is a code from add_school (empty: the default school).
+    reserved_ok lets an operator create an admin account from a shell; the sign-up form never sets it."""
+    if len(username) < 4: return False, "Username must be at least 4 chars."
+    if not reserved_ok and (username.lower() in RESERVED_USERNAMES or username in ADMINS): return False, "That username is reserved."
+    if len(password) < 6: return False, "Password must be at least 6 chars."
+    if not re.search(r"[A-Z]", password): return False, "Password needs 1 uppercase letter."
+    if not re.search(r"\d", password): return False, "Password needs 1 number."
+
+    slug = school_for_code(school_code) if school_code and school_code.strip() else DEFAULT_SCHOOL
+    if not slug: return False, "Unknown school code."
+
+    # Claim the username in the directory first: it is the one place that is unique across shards
+    d = _directory()
+    try:
+        with d: d.execute('INSERT INTO user_shards (username, school) VALUES (?, ?)', (username, slug))
+    except sqlite3.IntegrityError:
+        return False, "Username exists."
+    finally:
+        d.close()
+    conn = sqlite3.connect(ensure_school(slug))  # slug is from the schools table; creates the shard on a replica that hasn't yet
+    c = conn.cursor()
+    try:
+        hashed = hash_password(password)
+        c.execute('INSERT INTO users(username, password, role, name) VALUES (?, ?, ?, ?)',
+                  (username, hashed, role, name))
+        conn.commit()
+        return True, "Account created successfully!"
+    except sqlite3.IntegrityError:
+        return False, "Username exists."
+    except Exception:
+        d = _directory()
+        with d: d.execute('DELETE FROM user_shards WHERE username = ?', (username,))  # give the name back
+        d.close()
+        raise
+    finally:
+        conn.close()
+
+
+# ==========================================
+# SCORES
+# ==========================================
+@metrics.traced("db.save_score")
+def save_score(username, topic, score):
+    write([('INSERT INTO scores (username, topic, score, date) VALUES (?, ?, ?, ?)',
+            (username, topic, score, datetime.now().strftime('%Y-%m-%d %H:%M')))], username)
+    _score_written(username)
+
+@metrics.traced("db.save_quiz_results")
+def save_quiz_results(username, topic, score, results):
+    """Stores the percentage in scores plus one quiz_answers row per question, in one transaction."""
+    date = datetime.now().strftime('%Y-%m-%d %H:%M')
+    write([('INSERT INTO scores (username, topic, score, date) VALUES (?, ?, ?, ?)', (username, topic, score, date)),
+           ('INSERT INTO quiz_answers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(username, topic, i, r["question"], json.dumps(r["options"]), r["chosen"], r["correct"], int(r["is_correct"]), date)
+             for i, r in enumerate(results)])], username)
+    _score_written(username)
+
+@metrics.traced("db.get_user_scores")
+def get_user_scores(username):
+    conn = connect(username)
+    df = pd.read_sql_query("SELECT topic, score, date FROM scores WHERE username = ? ORDER BY date DESC", conn, params=(username,))
+    conn.close()
+    return df
+
+@metrics.traced("db.get_score_page")
+def get_score_page(username, cursor=None, limit=50, since=None):
+    """One page of history, newest first, using keyset pagination on (date, rowid).
+
+    Returns (df, next_cursor); pass next_cursor back to get the following page
+    (None when there are no more rows). since ('YYYY-MM-DD') limits the window.
+    """
+    sql = "SELECT rowid AS id, topic, score, date FROM scores WHERE username = ?"
+    params = [username]
+    if since:
+        sql += " AND date >= ?"
+        params.append(since)
+    if cursor:
+        sql += " AND (date < ? OR (date = ? AND rowid < ?))"
+        params += [cursor[0], cursor[0], cursor[1]]
+    sql += " ORDER BY date DESC, rowid DESC LIMIT ?"
+    params.append(limit + 1)
+    conn = connect(username)
+    df = pd.read_sql_query(sql, conn, params=params)
+    conn.close()
+    next_cursor = None
+    if len(df) > limit:
+        df = df.iloc[:limit]
+        next_cursor = (df["date"].iloc[-1], int(df["id"].iloc[-1]))
+    return df.drop(columns="id"), next_cursor
+
+@metrics.traced("db.count_scores")
+def count_scores(username, since=None):
+    conn = connect(username)
+    if since:
+        n = conn.execute('SELECT COUNT(*) FROM scores WHERE username = ? AND date >= ?', (username, since)).fetchone()[0]
+    else:
+        n = conn.execute('SELECT COUNT(*) FROM scores WHERE username = ?', (username,)).fetchone()[0]
+    conn.close()
+    return n
+
+@metrics.traced("db.get_leaderboard")
+def get_leaderboard(limit=5, schools=None):
+    """Top users by total XP across all shards (or the given schools): each shard's top `limit`, merged."""
+    ldf = query_shards("SELECT username, SUM(score) as total_xp FROM scores GROUP BY username ORDER BY total_xp DESC LIMIT ?",
+                       (limit,), schools)
+    return ldf.sort_values("total_xp", ascending=False, kind="stable").head(limit).reset_index(drop=True)
@@ -14,6 +14,7 @@ import subprocess
 import re
 import sys
 from PIL import Image
+import llm
 
 # Load env variables
 load_dotenv()
@@ -48,8 +49,7 @@ else:
 
 genai.configure(api_key=API_KEY)
 
-# USE THE FLASH MODEL (Supports Images + Text)
-MODEL = 'gemini-3-flash-preview' 
+# Models are picked per task by the routing table in llm.py
 DB = "school.db"
 
 # ==========================================
@@ -144,21 +144,13 @@ def create_pdf(title, content):
     pdf.multi_cell(0, 8, sanitize_for_pdf(content))
     return pdf.output(dest='S').encode('latin-1')
 
-def ask_ai(prompt):
-    try:
-        model = genai.GenerativeModel(MODEL, generation_config={"temperature": 0.3})
-        response = model.generate_content(prompt)
-        return response.text
-    except Exception as e:
-        return f"Error: {str(e)}"
+def ask_ai(prompt, task=llm.DEFAULT_ROUTE):
+    priority = llm.TEACHER if st.session_state['role'] == "Teacher" else llm.STUDENT
+    return llm.ask_ai(prompt, task, priority)
 
 def ask_ai_vision(prompt, image):
-    try:
-        model = genai.GenerativeModel(MODEL)
-        response = model.generate_content([prompt, image])
-        return response.text
-    except Exception as e:
-        return f"Error processing image: {str(e)}"
+    priority = llm.TEACHER if st.session_state['role'] == "Teacher" else llm.STUDENT
+    return llm.ask_ai_vision(prompt, image, priority)
 
 def render_simulation(html_code):
     html_code = html_code.replace("```html", "").replace("```", "").strip()
@@ -318,13 +310,13 @@ else:
                 prompt = f"{context}\n\nCreate a lesson plan on {topic} for grade {grade}. Examples, Notes, Experiments, everything needed to be put accordingly."
                 
                 with st.spinner("Generating..."):
-                    res = ask_ai(prompt)
+                    res = ask_ai(prompt, "lesson")
                     st.markdown(f'<div class="lesson">{res}</div>', unsafe_allow_html=True)
                     
                     st.divider()
                     st.subheader("🛡️ Audit")
                     if st.button("Run Bias Check"):
-                        audit_res = ask_ai(f"Audit this lesson for bias/hallucinations:\n\n{res[:4000]}")
+                        audit_res = ask_ai(f"Audit this lesson for bias/hallucinations:\n\n{res[:4000]}", "audit")
                         st.markdown(f'<div class="audit-pass">{audit_res}</div>', unsafe_allow_html=True)
 
                     pdf = create_pdf(f"Lesson: {topic}", res)
@@ -340,7 +332,7 @@ else:
                 prompt = f"{context}\n\nCreate a {ctype} for {topic} with answers."
                 
                 with st.spinner("Working..."):
-                    res = ask_ai(prompt)
+                    res = ask_ai(prompt, "quiz")
                     st.markdown(f'<div class="lesson">{res}</div>', unsafe_allow_html=True)
                     st.download_button("Download PDF", create_pdf(f"{ctype}: {topic}", res), f"{ctype}_{topic}.pdf", "application/pdf")
         #3. KNOWLEDGE MAP
@@ -357,11 +349,11 @@ else:
                         Format: Graphviz DOT. Layout: rankdir=TB, splines=ortho.
                         Return ONLY DOT code inside ```dot ... ```.
                         """
-                        graph_res = ask_ai(graph_prompt)
+                        graph_res = ask_ai(graph_prompt, "dot-graph")
                         dot_code = graph_res.replace("```dot", "").replace("```", "").strip()
                         if "digraph" not in dot_code: dot_code = f"digraph G {{ {dot_code} }}"
 
-                        summary_res = ask_ai(f"Summarize this text as smart notes:\n{st.session_state['file_content'][:6000]}")
+                        summary_res = ask_ai(f"Summarize this text as smart notes:\n{st.session_state['file_content'][:6000]}", "summary")
 
                         st.session_state['map_dot'] = dot_code
                         st.session_state['map_sum'] = summary_res
@@ -385,7 +377,7 @@ else:
                     Requirements: Canvas Height 400px, Dark Mode, Sliders at top.
                     Return ONLY raw HTML.
                     """
-                    st.session_state['last_sim'] = ask_ai(sim_prompt)
+                    st.session_state['last_sim'] = ask_ai(sim_prompt, "simulation")
 
             if st.session_state['last_sim']:
                 render_simulation(st.session_state['last_sim'])
@@ -422,8 +414,12 @@ class GenScene(Scene):
                 else:
                     with st.spinner(f"🤖 AI is scripting..."):
                         prompt = f"Write Manim script for: {sim_topic}. Constraints: Use 'Text' only (NO LaTeX), Safe positioning, Class 'GenScene'. Return Python code."
-                        code_res = ask_ai(prompt)
-                        if "retry" in code_res.lower(): st.error("Rate Limit"); st.stop()
+                        try:
+                            code_res = llm.generate(prompt, "manim-code", llm.TEACHER if st.session_state['role'] == "Teacher" else llm.STUDENT)
+                        except llm.RateLimitError:
+                            st.error("🚨 The AI is busy right now (rate limit). Please try again in a minute."); st.stop()
+                        except Exception as e:
+                            st.error(f"Error: {e}"); st.stop()
                         clean_code = code_res.replace("```python", "").replace("```", "").strip()
 
                 if clean_code:
@@ -502,11 +498,11 @@ class GenScene(Scene):
                         Format: Graphviz DOT. Layout: rankdir=TB, splines=ortho.
                         Return ONLY DOT code inside ```dot ... ```.
                         """
-                        graph_res = ask_ai(graph_prompt)
+                        graph_res = ask_ai(graph_prompt, "dot-graph")
                         dot_code = graph_res.replace("```dot", "").replace("```", "").strip()
                         if "digraph" not in dot_code: dot_code = f"digraph G {{ {dot_code} }}"
 
-                        summary_res = ask_ai(f"Summarize this text as smart notes:\n{st.session_state['file_content'][:6000]}")
+                        summary_res = ask_ai(f"Summarize this text as smart notes:\n{st.session_state['file_content'][:6000]}", "summary")
 
                         st.session_state['map_dot'] = dot_code
                         st.session_state['map_sum'] = summary_res
@@ -530,7 +526,7 @@ class GenScene(Scene):
                     Requirements: Canvas Height 400px, Dark Mode, Sliders at top.
                     Return ONLY raw HTML.
                     """
-                    st.session_state['last_sim'] = ask_ai(sim_prompt)
+                    st.session_state['last_sim'] = ask_ai(sim_prompt, "simulation")
 
             if st.session_state['last_sim']:
                 render_simulation(st.session_state['last_sim'])
@@ -547,7 +543,7 @@ class GenScene(Scene):
                 context = f"SOURCE:\n{st.session_state['file_content'][:5000]}" if st.session_state['file_content'] else ""
                 prompt = f"{context}\n\nCreate {num} MCQ questions about {topic} in {diff}. Answer key included."
                 with st.spinner("Generating..."):
-                    res = ask_ai(prompt)
+                    res = ask_ai(prompt, "quiz")
                     st.markdown(f'<div class="lesson">{res}</div>', unsafe_allow_html=True)
             
             st.divider()
@@ -619,7 +615,7 @@ class GenScene(Scene):
                             Style: Mystical but practical. Cyberpunk tone. Use Emojis.
                             Format: Markdown.
                             """
-                            prediction = ask_ai(oracle_prompt)
+                            prediction = ask_ai(oracle_prompt, "oracle")
                             
                             st.markdown(f"""
                             <div class="lesson" style="border-left: 5px solid #a200ff;">
@@ -660,8 +656,12 @@ class GenScene(Scene):
                 else:
                     with st.spinner(f"🤖 AI is scripting..."):
                         prompt = f"Write Manim script for: {sim_topic}. Constraints: Use 'Text' only (NO LaTeX), Safe positioning, Class 'GenScene'. Return Python code."
-                        code_res = ask_ai(prompt)
-                        if "retry" in code_res.lower(): st.error("Rate Limit"); st.stop()
+                        try:
+                            code_res = llm.generate(prompt, "manim-code", llm.TEACHER if st.session_state['role'] == "Teacher" else llm.STUDENT)
+                        except llm.RateLimitError:
+                            st.error("🚨 The AI is busy right now (rate limit). Please try again in a minute."); st.stop()
+                        except Exception as e:
+                            st.error(f"Error: {e}"); st.stop()
                         clean_code = code_res.replace("```python", "").replace("```", "").strip()
 
                 if clean_code:
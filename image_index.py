@@ -0,0 +1,155 @@
+"""Perceptual-hash index of analysed Homework Scanner images.
+
+A class photographing the same worksheet produces images that differ in
+bytes but not in content. Each analysed image is stored with a 64-bit pHash
+(DCT of a 32x32 greyscale thumbnail) and dHash (gradient of a 9x8 one), per
+task type; a new upload within MAX_DISTANCE bits of a stored one on both
+hashes gets the stored analysis back instead of a vision call. Hashes are
+held per task as NumPy arrays, so a lookup is one vectorised XOR/popcount.
+
+PRIVATE_TASKS are never indexed: the hashes see a worksheet's printed layout,
+not the handwriting on it, so one student's grade would be served to the next.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+
+import db
+import metrics
+
+MAX_DISTANCE = int(os.getenv("MENTIS_IMAGE_DUP_BITS", "6"))  # Hamming distance (of 64) still counted as the same page
+MAX_ENTRIES = int(os.getenv("MENTIS_IMAGE_INDEX_SIZE", "5000"))  # per task; least recently used are evicted
+REFRESH = 60  # seconds before the in-memory index is reloaded (picks up other replicas' entries)
+PRIVATE_TASKS = {"Grade Handwritten Text"}  # the answer depends on the student's own writing
+
+_lock = threading.Lock()
+_index = {}  # task -> {"phash", "dhash", "loaded"}; replaced, never mutated, so readers need no lock
+_initialised = set()  # DB paths set up by this process
+
+
+def init_index():
+    """Creates the table once per process; app.py calls this on every rerun."""
+    with _lock:
+        if db.DB in _initialised: return
+        _initialised.add(db.DB)
+    conn = db.connect()
+    conn.execute('''CREATE TABLE IF NOT EXISTS image_index
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT, task TEXT, phash INTEGER, dhash INTEGER,
+                     analysis TEXT, created TEXT, last_used REAL, hits INTEGER DEFAULT 0)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_image_index_task ON image_index (task, last_used)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_image_index_hash ON image_index (task, phash, dhash)')
+    conn.commit()
+    private = [(t,) for t in PRIVATE_TASKS]
+    # One-time migration: entries stored before PRIVATE_TASKS were excluded. add() never writes them now,
+    # so after the first run this is a read that finds nothing.
+    if any(conn.execute('SELECT 1 FROM image_index WHERE task = ? LIMIT 1', t).fetchone() for t in private):
+        with conn: conn.executemany('DELETE FROM image_index WHERE task = ?', private)
+    conn.close()
+
+
+# ==========================================
+# HASHES
+# ==========================================
+def _gray(image, size):
+    img = ImageOps.exif_transpose(image).convert("L")  # phone photos carry their rotation in EXIF
+    return np.asarray(img.resize(size, Image.LANCZOS), dtype=np.float64)
+
+
+def _bits(mask):
+    return int(np.packbits(mask.astype(np.uint8).ravel()).view(">u8")[0])
+
+
+def dhash(image):
+    px = _gray(image, (9, 8))
+    return _bits(px[:, 1:] > px[:, :-1])
+
+
+_n = np.arange(32)
+_DCT = np.sqrt(2 / 32) * np.cos(np.pi * (2 * _n[None, :] + 1) * _n[:, None] / 64)  # DCT-II basis, 32 x 32
+_DCT[0] /= np.sqrt(2)
+
+
+def phash(image):
+    low = (_DCT @ _gray(image, (32, 32)) @ _DCT.T)[:8, :8]
+    return _bits(low > np.median(low.ravel()[1:]))  # DC term excluded from the median
+
+
+def _signed(h):
+    return h - (1 << 64) if h >= 1 << 63 else h  # SQLite INTEGER is signed 64-bit
+
+
+def _popcount(x):
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+# ==========================================
+# INDEX
+# ==========================================
+def indexable(task):
+    return task not in PRIVATE_TASKS
+
+
+def _load(task):
+    conn = db.connect()
+    rows = conn.execute('SELECT phash, dhash FROM image_index WHERE task = ?', (task,)).fetchall()
+    conn.close()
+    ph = np.array([r[0] for r in rows], dtype=np.int64).view(np.uint64)
+    dh = np.array([r[1] for r in rows], dtype=np.int64).view(np.uint64)
+    entry = {"phash": ph, "dhash": dh, "loaded": time.monotonic()}
+    with _lock: _index[task] = entry
+    return entry
+
+
+def _entry(task):
+    with _lock: entry = _index.get(task)
+    if entry is None or time.monotonic() - entry["loaded"] > REFRESH: entry = _load(task)
+    return entry
+
+
+@metrics.traced("image_index.lookup")
+def lookup(image, task, max_distance=None):
+    """(analysis, distance) for the closest stored near-duplicate of image for this task, or None."""
+    if not indexable(task): return None
+    max_distance = MAX_DISTANCE if max_distance is None else max_distance
+    entry = _entry(task)
+    if not len(entry["phash"]):
+        metrics.hit("image_index", False)
+        return None
+    ph, dh = np.uint64(phash(image)), np.uint64(dhash(image))
+    dist_p = _popcount(entry["phash"] ^ ph)
+    dist_d = _popcount(entry["dhash"] ^ dh)
+    ok = (dist_p <= max_distance) & (dist_d <= max_distance)
+    if not ok.any():
+        metrics.hit("image_index", False)
+        return None
+    best = int(np.argmin(np.where(ok, dist_p + dist_d, 1 << 8)))
+    conn = db.connect()
+    row = conn.execute('SELECT id, analysis FROM image_index WHERE task = ? AND phash = ? AND dhash = ? ORDER BY last_used DESC LIMIT 1',
+                       (task, _signed(int(entry["phash"][best])), _signed(int(entry["dhash"][best])))).fetchone()
+    conn.close()
+    if not row:  # evicted since we loaded
+        metrics.hit("image_index", False)
+        return None
+    db.write([('UPDATE image_index SET hits = hits + 1, last_used = ? WHERE id = ?', (time.time(), row[0]))])
+    metrics.hit("image_index", True)
+    return row[1], int(dist_p[best])
+
+
+def add(image, task, analysis):
+    """Stores the analysis for image, evicting the least recently used entries past MAX_ENTRIES. No-op for PRIVATE_TASKS."""
+    if not indexable(task): return
+    ph, dh = phash(image), dhash(image)
+    now = time.time()
+    db.write([
+        ('INSERT INTO image_index (task, phash, dhash, analysis, created, last_used) VALUES (?, ?, ?, ?, ?, ?)',
+         (task, _signed(ph), _signed(dh), analysis, time.strftime('%Y-%m-%d %H:%M'), now)),
+        ('''DELETE FROM image_index WHERE task = ? AND id NOT IN
+            (SELECT id FROM image_index WHERE task = ? ORDER BY last_used DESC LIMIT ?)''', (task, task, MAX_ENTRIES)),
+    ])
+    with _lock:  # append instead of reloading the task; evicted hashes just miss until the next REFRESH
+        entry = _index.get(task)
+        if entry:
+            _index[task] = dict(entry, phash=np.append(entry["phash"], np.uint64(ph)), dhash=np.append(entry["dhash"], np.uint64(dh)))
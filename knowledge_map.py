@@ -0,0 +1,291 @@
+"""Knowledge Map: DOT from the model, validated and laid out server-side.
+
+The graphviz binary (packages.txt) renders each graph to SVG once; the SVG is
+cached by the sha256 of the DOT source, in memory and under GRAPH_CACHE, so
+reruns and other students asking for the same map cost nothing. DOT that
+graphviz rejects is repaired locally first and, failing that, sent back to
+the model once together with the parser error. The SVG is inlined into the
+page, so links graphviz makes from URL/href attributes are stripped first.
+
+build_map() covers a whole document: concepts are extracted per chunk in
+parallel (one wave of at most CONCURRENCY calls), merged and de-duplicated
+locally, and pruned to the TOP_N most central before the DOT is written.
+"""
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import llm
+import metrics
+
+DOT_BIN = os.getenv("MENTIS_DOT", "dot")
+GRAPH_CACHE = os.getenv("MENTIS_GRAPH_CACHE", os.path.join(".cache", "graphs"))
+RENDER_TIMEOUT = 20  # seconds; a runaway layout should not hold a script thread
+MEMORY_SIZE = 64
+CONCURRENCY = int(os.getenv("MENTIS_MAP_CONCURRENCY", "8"))
+CHUNK_MIN = 4000     # chars; short documents still get a single call
+CHUNK_MAX = 120000   # chars per call; past CONCURRENCY * CHUNK_MAX a book takes more than one wave
+TOP_N = 25
+
+_memory = OrderedDict()  # dot sha256 -> (dot, svg)
+_lock = threading.Lock()
+
+
+class DotError(ValueError):
+    """graphviz rejected the DOT source (message is its stderr)."""
+
+
+def available():
+    return shutil.which(DOT_BIN) is not None
+
+
+def dot_key(dot):
+    return hashlib.sha256(dot.strip().encode('utf-8')).hexdigest()
+
+
+# ==========================================
+# DOT CLEAN-UP
+# ==========================================
+_header = re.compile(r"\b(strict\s+)?(di)?graph\b[^{]*\{", re.I)
+_prose = re.compile(r"^[A-Za-z][A-Za-z ,.'()]*[.:]$")
+
+
+def normalize(response):
+    """Model reply -> a single DOT graph: fences and chatter stripped, header and braces ensured."""
+    dot = llm.clean_ai_response(response)
+    dot = re.sub(r"^(dot|graphviz)\s*\n", "", dot, flags=re.I)
+    m = _header.search(dot)
+    if not m:
+        return f"digraph G {{\n{dot.strip()}\n}}"
+    dot = dot[m.start():]
+    if "}" in dot: dot = dot[:dot.rindex("}") + 1]
+    return dot
+
+
+def repair(dot):
+    """Local fixes for the usual model mistakes; cheap enough to try before asking again."""
+    lines = [l for l in dot.splitlines() if not _prose.match(l.strip())]  # stray sentences inside the body
+    dot = "\n".join(lines)
+    if re.match(r"\s*(strict\s+)?graph\b", dot, re.I) and "->" in dot:
+        dot = re.sub(r"^\s*(strict\s+)?graph\b", lambda m: (m.group(1) or "") + "digraph", dot, count=1, flags=re.I)
+    missing = dot.count("{") - dot.count("}")
+    if missing > 0: dot += "\n" + "}" * missing
+    dot = re.sub(r";\s*;", ";", dot)
+    return dot
+
+
+# ==========================================
+# RENDERING
+# ==========================================
+_links = re.compile(r"</?a\b[^>]*>", re.I)
+_link_attrs = re.compile(r"""\s(?:xlink:href|href|target|on\w+)\s*=\s*(?:"[^"]*"|'[^']*')""", re.I)
+
+
+def sanitize_svg(svg):
+    """Drops <a> wrappers and href/target/event attributes: model-written DOT (steerable by an uploaded PDF)
+    can set URL/href, which graphviz turns into <a xlink:href=...> links."""
+    return _link_attrs.sub("", _links.sub("", svg))
+
+
+@metrics.traced("graph.render")
+def render_svg(dot):
+    """Lays out dot with the graphviz binary. Raises DotError on bad input."""
+    try:
+        res = subprocess.run([DOT_BIN, "-Tsvg"], input=dot.encode('utf-8'), capture_output=True, timeout=RENDER_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise DotError(f"layout took longer than {RENDER_TIMEOUT}s")
+    if res.returncode != 0 or b"<svg" not in res.stdout:
+        raise DotError(res.stderr.decode('utf-8', 'replace').strip() or "graphviz produced no SVG")
+    svg = res.stdout.decode('utf-8')
+    return sanitize_svg(svg[svg.index("<svg"):])  # drop the XML prolog / DOCTYPE so it can be inlined
+
+
+def _remember(key, dot, svg):
+    with _lock:
+        _memory[key] = (dot, svg)
+        _memory.move_to_end(key)
+        while len(_memory) > MEMORY_SIZE: _memory.popitem(last=False)
+
+
+def _lookup(key):
+    with _lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            return _memory[key]
+    base = os.path.join(GRAPH_CACHE, key)
+    try:
+        with open(base + ".dot", encoding='utf-8') as f: dot = f.read()
+        with open(base + ".svg", encoding='utf-8') as f: svg = sanitize_svg(f.read())  # may predate sanitising
+    except OSError:
+        return None
+    _remember(key, dot, svg)
+    return dot, svg
+
+
+def _write(path, text):
+    tmp = f"{path}.tmp{threading.get_ident()}"
+    with open(tmp, "w", encoding='utf-8') as f: f.write(text)
+    os.replace(tmp, path)  # atomic, so another replica never reads half a file
+
+
+def _store(key, dot, svg):
+    """Caches under the hash of the DOT as generated; the .dot file holds the version that parsed."""
+    _remember(key, dot, svg)
+    try:
+        os.makedirs(GRAPH_CACHE, exist_ok=True)
+        base = os.path.join(GRAPH_CACHE, key)
+        _write(base + ".dot", dot)
+        _write(base + ".svg", svg)  # written last: its presence marks a complete entry
+    except OSError:
+        pass
+
+
+def _ask_fix(dot, error, priority):
+    prompt = (f"This Graphviz DOT does not parse.\nError: {error}\n\n{dot}\n\n"
+              "Return the corrected graph ONLY, as DOT code inside ```dot ... ```.")
+    return normalize(llm.generate(prompt, "dot-graph", priority))
+
+
+def svg_for(dot, priority=llm.STUDENT):
+    """(dot, svg) for a graph, from cache or rendered; the returned dot is the version that parsed.
+
+    Raises DotError if neither the local repair nor one model retry produces valid DOT.
+    """
+    key = dot_key(dot)
+    found = _lookup(key)
+    metrics.hit("graph", found is not None)
+    if found: return found
+    candidate = dot
+    try:
+        svg = render_svg(candidate)
+    except DotError as e:
+        metrics.count("graph.invalid")
+        candidate = repair(dot)
+        try:
+            svg = render_svg(candidate)
+        except DotError:
+            candidate = _ask_fix(candidate, e, priority)
+            svg = render_svg(candidate)
+        metrics.count("graph.repaired")
+    _store(key, candidate, svg)
+    return candidate, svg
+
+
+# ==========================================
+# WHOLE-DOCUMENT MAP (map-reduce)
+# ==========================================
+CONCEPT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "concepts": {"type": "array", "items": {"type": "object", "properties": {
+            "name": {"type": "string"}, "importance": {"type": "integer"}}, "required": ["name"]}},
+        "relations": {"type": "array", "items": {"type": "object", "properties": {
+            "source": {"type": "string"}, "target": {"type": "string"}, "label": {"type": "string"}},
+            "required": ["source", "target"]}},
+    },
+    "required": ["concepts", "relations"],
+}
+
+_threads = ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix="map-chunk")
+
+
+def chunk_text(text):
+    """Splits on paragraph breaks into at most CONCURRENCY chunks (more only past CHUNK_MAX each)."""
+    size = min(CHUNK_MAX, max(CHUNK_MIN, -(-len(text) // CONCURRENCY)))
+    chunks, cur, cur_len = [], [], 0
+    for para in text.split("\n\n"):
+        while len(para) > size:  # one huge "paragraph" (PDFs often have no blank lines)
+            if cur: chunks.append("\n\n".join(cur))
+            cur, cur_len = [], 0
+            chunks.append(para[:size])
+            para = para[size:]
+        if cur_len + len(para) > size and cur:
+            chunks.append("\n\n".join(cur))
+            cur, cur_len = [], 0
+        cur.append(para)
+        cur_len += len(para) + 2
+    if cur: chunks.append("\n\n".join(cur))
+    return [c for c in chunks if c.strip()]
+
+
+def _concept_key(name):
+    words = re.sub(r"[^a-z0-9]+", " ", name.lower()).split()
+    words = [w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w for w in words]
+    return " ".join(w for w in words if w not in ("the", "a", "an"))
+
+
+def _extract(chunk, priority):
+    prompt = (f"Source:\n{chunk}\n\nTask: List the key concepts in this text (at most 20, short noun phrases, "
+              "importance 1-3) and the relations between them (source -> target with a 1-3 word label).")
+    try:
+        return llm.generate_json(prompt, CONCEPT_SCHEMA, "concepts-json", priority)
+    except Exception:
+        metrics.count("graph.chunk_errors")
+        return None
+
+
+def merge(parts, top_n=TOP_N):
+    """Reduce step: de-duplicates concepts across chunks and keeps the top_n by centrality.
+
+    Centrality = weighted degree in the merged graph + how often/how strongly chunks named the concept.
+    Returns (labels {key: display name}, edges {(src, dst): label}).
+    """
+    names, weight = {}, Counter()
+    spellings = {}
+    edges, edge_count = {}, Counter()
+    for part in parts:
+        for c in part.get("concepts", []):
+            key = _concept_key(c.get("name", ""))
+            if not key: continue
+            spellings.setdefault(key, Counter())[c["name"].strip()] += 1
+            weight[key] += max(1, min(3, int(c.get("importance") or 1)))
+        for r in part.get("relations", []):
+            a, b = _concept_key(r.get("source", "")), _concept_key(r.get("target", ""))
+            if not a or not b or a == b: continue
+            for key, raw in ((a, r["source"]), (b, r["target"])):
+                spellings.setdefault(key, Counter())[raw.strip()] += 1
+            edge_count[(a, b)] += 1
+            edges.setdefault((a, b), (r.get("label") or "").strip())
+    degree = Counter()
+    for (a, b), n in edge_count.items():
+        if (b, a) in edge_count and b < a: continue  # a <-> b counts once
+        degree[a] += n
+        degree[b] += n
+    score = {k: weight[k] + 2 * degree[k] for k in spellings}
+    keep = set(sorted(score, key=lambda k: (-score[k], k))[:top_n])
+    for key in keep:
+        names[key] = spellings[key].most_common(1)[0][0]
+    kept_edges = {}
+    for (a, b), label in edges.items():
+        if a in keep and b in keep and (b, a) not in kept_edges: kept_edges[(a, b)] = label
+    return names, kept_edges
+
+
+def _quote(text):
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def to_dot(names, edges):
+    lines = ["digraph G {", "  rankdir=TB; splines=true; node [shape=box, style=rounded];"]
+    ids = {key: f"n{i}" for i, key in enumerate(sorted(names))}
+    for key in sorted(names):
+        lines.append(f"  {ids[key]} [label={_quote(names[key])}];")
+    for (a, b), label in sorted(edges.items()):
+        lines.append(f"  {ids[a]} -> {ids[b]}" + (f" [label={_quote(label)}];" if label else ";"))
+    lines.append("}")
+    return "\n".join(lines)
+
+
+@metrics.traced("graph.build_map")
+def build_map(text, top_n=TOP_N, priority=llm.STUDENT):
+    """DOT for a concept map of the whole text. Raises ValueError if no chunk could be mapped."""
+    chunks = chunk_text(text)
+    parts = [p for p in _threads.map(lambda c: _extract(c, priority), chunks) if isinstance(p, dict)]
+    if not parts: raise ValueError("no concepts could be extracted from this document")
+    names, edges = merge(parts, top_n)
+    return to_dot(names, edges)
@@ -0,0 +1,411 @@
+"""Gemini access shared by every Streamlit session in the process.
+
+Streamlit re-runs app.py on every click, but imported modules stay loaded,
+so the limiter and the in-flight table below are process-wide.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+import google.generativeai as genai
+from google.api_core import exceptions as gexc
+
+import metrics
+
+# ==========================================
+# MODEL TIERS & ROUTING TABLE
+# ==========================================
+TIERS = {
+    "pro": os.getenv("GEMINI_MODEL_PRO", "gemini-2.5-pro"),
+    "flash": os.getenv("GEMINI_MODEL_FLASH", "gemini-2.5-flash"),
+    "lite": os.getenv("GEMINI_MODEL_LITE", "gemini-2.5-flash-lite"),
+}
+# Where to go when a tier times out or is out of quota
+FALLBACK = {"pro": "flash", "flash": "lite"}
+
+# task -> tier, generation config, request timeout (s)
+ROUTES = {
+    "lesson":     {"tier": "flash", "config": {"temperature": 0.3}, "timeout": 120},
+    "explain":    {"tier": "flash", "config": {"temperature": 0.3}, "timeout": 90},
+    "quiz":       {"tier": "flash", "config": {"temperature": 0.4}, "timeout": 60},
+    "quiz-json":  {"tier": "flash", "config": {"temperature": 0.4, "response_mime_type": "application/json"}, "timeout": 60},
+    "simulation": {"tier": "flash", "config": {"temperature": 0.3}, "timeout": 120},
+    "manim-code": {"tier": "flash", "config": {"temperature": 0.2}, "timeout": 90},
+    "vision":     {"tier": "flash", "config": {"temperature": 0.2}, "timeout": 90},
+    "audit":      {"tier": "lite", "config": {"temperature": 0.1, "max_output_tokens": 2048}, "timeout": 45},
+    "dot-graph":  {"tier": "lite", "config": {"temperature": 0.1, "max_output_tokens": 2048}, "timeout": 45},
+    "concepts-json": {"tier": "lite", "config": {"temperature": 0.1, "response_mime_type": "application/json"}, "timeout": 60},
+    "summary":    {"tier": "lite", "config": {"temperature": 0.3, "max_output_tokens": 4096}, "timeout": 60},
+    "oracle":     {"tier": "lite", "config": {"temperature": 0.8, "max_output_tokens": 2048}, "timeout": 45},
+}
+DEFAULT_ROUTE = "explain"
+MODEL = TIERS[ROUTES[DEFAULT_ROUTE]["tier"]]
+
+# Priority lanes (lower number is served first)
+TEACHER = 0
+STUDENT = 1
+BACKGROUND = 2  # pre-generation work that should only use spare quota
+
+RPM = float(os.getenv("GEMINI_RPM", "60"))
+BURST = int(os.getenv("GEMINI_BURST", "10"))
+MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+
+# Quota and transient server errors worth retrying
+RETRYABLE = (gexc.TooManyRequests, gexc.ResourceExhausted, gexc.ServiceUnavailable,
+             gexc.InternalServerError, gexc.DeadlineExceeded)
+
+
+class RateLimitError(Exception):
+    """Raised when the quota is still exhausted (or calls keep timing out) after all retries."""
+
+
+# ==========================================
+# TOKEN BUCKET (with priority lanes)
+# ==========================================
+class TokenBucket:
+    def __init__(self, rate_per_min, capacity):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.waiting = [0, 0, 0]
+        self.cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority=STUDENT):
+        """Blocks until a token is free. Lower lanes wait while a higher lane is queued."""
+        with self.cond:
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    self._refill()
+                    if self.tokens >= 1 and not any(self.waiting[:priority]):
+                        self.tokens -= 1
+                        return
+                    # Sleep until the next token, waking early if someone is notified
+                    self.cond.wait(max((1 - self.tokens) / self.rate, 0.01))
+            finally:
+                self.waiting[priority] -= 1
+                self.cond.notify_all()
+
+    def drain(self):
+        """Empties the bucket after a 429 so every session backs off together."""
+        with self.cond:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+    def queue_depth(self):
+        with self.cond:
+            return sum(self.waiting)
+
+
+limiter = TokenBucket(RPM, BURST)
+metrics.gauge("llm.limiter.queue_depth", lambda: limiter.queue_depth())
+
+
+# ==========================================
+# SINGLE-FLIGHT COALESCING
+# ==========================================
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+metrics.gauge("llm.inflight", lambda: len(_inflight))
+
+
+def single_flight(key, fn):
+    """Runs fn once per key; concurrent callers with the same key share the result."""
+    with _inflight_lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = _Flight()
+    metrics.hit("llm.coalesce", not leader)
+
+    if not leader:
+        flight.done.wait()
+        if flight.error: raise flight.error
+        return flight.result
+
+    try:
+        flight.result = fn()
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+        flight.done.set()
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def call_with_retry(fn, priority=STUDENT, retries=MAX_RETRIES):
+    for attempt in range(retries + 1):
+        limiter.acquire(priority)
+        try:
+            return fn()
+        except RETRYABLE as e:
+            if isinstance(e, gexc.TooManyRequests): limiter.drain()
+            if attempt == retries:
+                raise RateLimitError(str(e)) from e
+            time.sleep(backoff_delay(attempt))
+
+
+# ==========================================
+# PER-ROUTE LATENCY STATS
+# ==========================================
+STATS_WINDOW = 500
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _record(task, seconds, ok, fell_back):
+    with _stats_lock:
+        s = _stats.setdefault(task, {"calls": 0, "errors": 0, "fallbacks": 0, "latencies": deque(maxlen=STATS_WINDOW)})
+        s["calls"] += 1
+        if not ok: s["errors"] += 1
+        if fell_back: s["fallbacks"] += 1
+        s["latencies"].append(seconds)
+    metrics.observe(f"llm.route.{task}", seconds, ok)
+
+
+def _percentile(sorted_vals, q):
+    if not sorted_vals: return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+
+def route_stats():
+    """Snapshot of {task: {calls, errors, fallbacks, p50_ms, p95_ms}}."""
+    with _stats_lock:
+        out = {}
+        for task, s in _stats.items():
+            lat = sorted(s["latencies"])
+            out[task] = {"calls": s["calls"], "errors": s["errors"], "fallbacks": s["fallbacks"],
+                         "p50_ms": round(_percentile(lat, 0.50) * 1000), "p95_ms": round(_percentile(lat, 0.95) * 1000)}
+        return out
+
+
+# ==========================================
+# BACKENDS (real Gemini or offline fake)
+# ==========================================
+def _prompt_text(contents):
+    if isinstance(contents, str): return contents
+    return "\n".join(c for c in contents if isinstance(c, str))
+
+
+class GeminiBackend:
+    """Calls the real API. With record_path set, every answer is appended as JSONL for FakeBackend."""
+    def __init__(self, record_path=None):
+        self.record_path = record_path
+        self.lock = threading.Lock()
+
+    def generate(self, model_name, task, contents, config, timeout):
+        model = genai.GenerativeModel(model_name, generation_config=config)
+        text = model.generate_content(contents, request_options={"timeout": timeout}).text
+        if self.record_path:
+            line = json.dumps({"task": task, "prompt": _key(_prompt_text(contents)), "text": text})
+            with self.lock, open(self.record_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        return text
+
+
+class FakeBackend:
+    """Deterministic offline stand-in for load tests and benchmarks.
+
+    Replays recorded answers (exact prompt match first, then any answer for the
+    same task), sleeping a lognormal latency and raising quota/timeout errors at
+    the given rates so the limiter, retry and fallback paths all get exercised.
+    """
+    def __init__(self, recordings=None, latency_ms=800, jitter=0.5, error_429=0.0, error_timeout=0.0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_429 = error_429
+        self.error_timeout = error_timeout
+        self.seed = seed
+        self.by_prompt = {}
+        self.by_task = {}
+        self.counter = 0
+        self.lock = threading.Lock()
+        if recordings and os.path.exists(recordings):
+            with open(recordings, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip(): continue
+                    rec = json.loads(line)
+                    self.by_prompt[rec["prompt"]] = rec["text"]
+                    self.by_task.setdefault(rec["task"], []).append(rec["text"])
+
+    def _answer(self, task, prompt_key):
+        if prompt_key in self.by_prompt: return self.by_prompt[prompt_key]
+        answers = self.by_task.get(task)
+        if answers: return answers[int(prompt_key, 16) % len(answers)]
+        return CANNED.get(task, CANNED[DEFAULT_ROUTE])
+
+    def generate(self, model_name, task, contents, config, timeout):
+        prompt_key = _key(_prompt_text(contents))
+        with self.lock:
+            self.counter += 1
+            rng = random.Random(f"{self.seed}:{prompt_key}:{self.counter}")
+        delay = self.latency_ms / 1000 * rng.lognormvariate(0, self.jitter)
+        roll = rng.random()
+        if roll < self.error_429:
+            time.sleep(min(delay, 0.05))
+            raise gexc.ResourceExhausted("fake: quota exceeded")
+        if roll < self.error_429 + self.error_timeout:
+            time.sleep(timeout if delay > timeout else delay)
+            raise gexc.DeadlineExceeded("fake: deadline exceeded")
+        time.sleep(min(delay, timeout))
+        answer = self._answer(task, prompt_key)
+        pages = 0 if isinstance(contents, str) else sum(not isinstance(c, str) for c in contents)
+        if pages > 1 and "=== PAGE" not in answer:  # packed Homework Scanner request: mark each page like the real model is asked to
+            answer = "\n\n".join(f"=== PAGE {i} ===\n{answer}" for i in range(1, pages + 1))
+        return answer
+
+
+# Shown by FakeBackend when nothing was recorded for a task
+CANNED = {
+    "explain": "**Explanation.** Think of it like a bicycle: each part does one job.",
+    "lesson": "# Lesson Plan\n## Engage\n...\n## Explore\n...\n## Explain\n...\n## Elaborate\n...\n## Evaluate\n...",
+    "quiz": "1. What is 2 + 2?\nA) 3\nB) 4\nC) 5\nD) 22\n\nAnswer key: 1-B",
+    "quiz-json": '{"questions": [{"question": "What is 2 + 2?", "options": ["3", "4", "5", "22"], "answer": 1, '
+                 '"explanation": "Two pairs make four."}]}',
+    "dot-graph": "```dot\ndigraph G { rankdir=TB; Topic -> Idea1; Topic -> Idea2; }\n```",
+    "concepts-json": '{"concepts": [{"name": "Topic", "importance": 3}, {"name": "Idea1", "importance": 2}], '
+                     '"relations": [{"source": "Topic", "target": "Idea1", "label": "includes"}]}',
+    "manim-code": "```python\nfrom manim import *\nclass GenScene(Scene):\n    def construct(self):\n        self.play(Write(Text(\"Hello\")))\n```",
+    "simulation": "<html><body><canvas id=\"c\" height=\"400\"></canvas><script>/* fake */</script></body></html>",
+    "vision": "The image shows a worked problem. Step 1: ...",
+    "audit": "No bias or hallucinations detected.",
+    "summary": "- Key idea one\n- Key idea two",
+    "oracle": "1. Quantum Architect\n2. Bio-Ethics Lawyer\n3. Orbital Farmer",
+}
+
+
+def make_backend():
+    """Picks the backend from MENTIS_LLM_BACKEND (gemini | fake)."""
+    if os.getenv("MENTIS_LLM_BACKEND", "gemini") == "fake":
+        return FakeBackend(recordings=os.getenv("MENTIS_LLM_RECORDINGS"),
+                           latency_ms=float(os.getenv("MENTIS_FAKE_LATENCY_MS", "800")),
+                           error_429=float(os.getenv("MENTIS_FAKE_429_RATE", "0")),
+                           error_timeout=float(os.getenv("MENTIS_FAKE_TIMEOUT_RATE", "0")))
+    return GeminiBackend(record_path=os.getenv("MENTIS_LLM_RECORD"))
+
+
+backend = make_backend()
+
+
+def set_backend(new_backend):
+    global backend
+    backend = new_backend
+
+
+# ==========================================
+# PUBLIC HELPERS
+# ==========================================
+def _key(*parts):
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(p if isinstance(p, bytes) else str(p).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _routed(task, contents, priority, schema=None):
+    """Calls the task's tier, stepping down FALLBACK on timeouts or quota errors."""
+    route = ROUTES.get(task, ROUTES[DEFAULT_ROUTE])
+    config = dict(route["config"], response_schema=schema) if schema else route["config"]
+    tier = route["tier"]
+    fell_back = False
+    start = time.monotonic()
+    while True:
+        run = lambda: backend.generate(TIERS[tier], task, contents, config, route["timeout"])
+        try:
+            # The primary tier gets one retry before we step down; the last tier gets the full budget
+            text = call_with_retry(run, priority, 1 if tier in FALLBACK else MAX_RETRIES)
+        except RateLimitError:
+            if tier not in FALLBACK:
+                _record(task, time.monotonic() - start, False, fell_back)
+                raise
+            tier = FALLBACK[tier]
+            fell_back = True
+            continue
+        except Exception:
+            _record(task, time.monotonic() - start, False, fell_back)
+            raise
+        _record(task, time.monotonic() - start, True, fell_back)
+        return text
+
+
+@metrics.traced("llm.ask_ai")
+def generate(prompt, task=DEFAULT_ROUTE, priority=STUDENT):
+    """Text generation through the router and limiter. Raises on failure."""
+    return single_flight(_key(task, prompt), lambda: _routed(task, prompt, priority))
+
+
+@metrics.traced("llm.ask_ai_json")
+def generate_json(prompt, schema, task="quiz-json", priority=STUDENT):
+    """Gemini JSON mode constrained by an OpenAPI-style schema. Returns the parsed object; raises ValueError on bad JSON."""
+    text = single_flight(_key(task, json.dumps(schema, sort_keys=True), prompt), lambda: _routed(task, prompt, priority, schema))
+    return json.loads(text)
+
+
+@metrics.traced("llm.ask_ai_vision")
+def generate_vision(prompt, image, priority=STUDENT):
+    return single_flight(_key("vision", prompt, image.tobytes()), lambda: _routed("vision", [prompt, image], priority))
+
+
+@metrics.traced("llm.ask_ai_vision_pages")
+def generate_vision_pages(prompt, images, priority=STUDENT):
+    """Several images in one multimodal request, each preceded by a "Page n:" label."""
+    contents = [prompt]
+    for i, image in enumerate(images, 1): contents += [f"Page {i}:", image]
+    return single_flight(_key("vision-pages", prompt, *[im.tobytes() for im in images]),
+                         lambda: _routed("vision", contents, priority))
+
+
+def ask_ai(prompt, task=DEFAULT_ROUTE, priority=STUDENT):
+    try:
+        return generate(prompt, task, priority)
+    except RateLimitError:
+        return "Error: The AI is busy right now (rate limit). Please try again in a minute."
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+def ask_ai_vision(prompt, image, priority=STUDENT):
+    try:
+        return generate_vision(prompt, image, priority)
+    except RateLimitError:
+        return "Error processing image: The AI is busy right now (rate limit). Please try again in a minute."
+    except Exception as e:
+        return f"Error processing image: {str(e)}"
+
+
+# --- ROBUST CODE CLEANER (Prevents SyntaxErrors) ---
+def clean_ai_response(response):
+    """Extracts code from markdown blocks to prevent crashes"""
+    match = re.search(r"```python(.*?)```", response, re.DOTALL)
+    if match: return match.group(1).strip()
+    match = re.search(r"```(.*?)```", response, re.DOTALL)
+    if match: return match.group(1).strip()
+    return response.replace("```python", "").replace("```", "").strip()
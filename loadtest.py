@@ -0,0 +1,175 @@
+"""Headless load generator for Mentis.
+
+Simulates concurrent students and teachers hitting the same helpers app.py
+uses (login, PDF upload, Homework Scanner pages, quiz/lesson generation,
+save_score, progress),
+against a throwaway database and the offline FakeBackend by default, then
+prints p50/p95/p99 latency and throughput per feature.
+
+    python loadtest.py --students 40 --teachers 4 --rounds 5
+    python loadtest.py --recordings recordings.jsonl --latency-ms 1500 --error-429 0.05
+"""
+import argparse
+import io
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+from PIL import Image, ImageDraw
+
+import db
+import llm
+import question_bank
+import quiz
+import scanner
+from pdf_tools import create_pdf, extract_text_from_pdf
+
+PASSWORD = "Passw0rd"
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.sources = Counter()  # Homework Scanner pages by source (batched / single / error)
+        self.lock = threading.Lock()
+
+    def time(self, feature, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        except Exception:
+            with self.lock: self.errors[feature] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock: self.samples[feature].append(elapsed)
+
+
+def percentile(sorted_vals, q):
+    if not sorted_vals: return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+
+def make_pdf_fixture(pages):
+    """A locally generated PDF with roughly `pages` pages of text."""
+    para = "Photosynthesis converts light energy into chemical energy stored in glucose. " * 6
+    body = "\n\n".join(f"Section {i}. {para}" for i in range(pages * 3))
+    return create_pdf("Load Test Source", body)
+
+
+def make_scan_fixture(pages):
+    """PNG bytes for `pages` distinct worksheet photos (4 Gemini tiles each, so the default 4 fit one pack)."""
+    out = []
+    for i in range(pages):
+        img = Image.new("RGB", (1100, 1500), "white")
+        d = ImageDraw.Draw(img)
+        for line in range(12):
+            d.text((80, 100 + line * 110), f"Page {i + 1}, question {line + 1}: solve {i + 2}x + {line} = {3 * i + line}", fill="black")
+        buf = io.BytesIO()
+        img.save(buf, "PNG")
+        out.append(buf.getvalue())
+    return out
+
+
+def student(rec, name, rounds, pdf_bytes, scan_pages):
+    user = rec.time("login", db.check_user, name, PASSWORD)
+    assert user, f"login failed for {name}"
+    text = rec.time("pdf_upload", extract_text_from_pdf, io.BytesIO(pdf_bytes))
+    if scan_pages:
+        pages = rec.time("scanner", scanner.analyse_pages, [io.BytesIO(b) for b in scan_pages], "Solve Math Problem",
+                         "Solve this math problem.", llm.STUDENT, False)
+        with rec.lock: rec.sources.update(source for _, _, source in pages)
+    for _ in range(rounds):
+        topic = random.choice(["Fractions", "Photosynthesis", "Gravity", "World War II"])
+        questions = rec.time("quiz", question_bank.get_quiz, topic, "Medium", 5, f"SOURCE:\n{text[:5000]}", llm.STUDENT)
+        correct, results = quiz.grade_quiz(questions, [random.randrange(len(q["options"])) for q in questions])
+        rec.time("save_score", db.save_quiz_results, name, topic, int(correct / len(results) * 100), results)
+        rec.time("progress", db.get_score_page, name)
+        rec.time("leaderboard", db.get_leaderboard, 5)
+
+
+def teacher(rec, name, rounds, pdf_bytes, scan_pages):
+    user = rec.time("login", db.check_user, name, PASSWORD)
+    assert user, f"login failed for {name}"
+    text = rec.time("pdf_upload", extract_text_from_pdf, io.BytesIO(pdf_bytes))
+    for _ in range(rounds):
+        topic = random.choice(["Cells", "Algebra", "Climate"])
+        prompt = f"SOURCE MATERIAL:\n{text[:5000]}\n\nCreate a lesson plan on {topic} for grade 6-8."
+        rec.time("lesson", llm.ask_ai, prompt, "lesson", llm.TEACHER)
+
+
+def run(args):
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix="mentis_load_")
+    db.DB = args.db or os.path.join(workdir, "load.db")
+    db.init_db()
+    question_bank.init_bank()
+
+    if not args.real:
+        llm.set_backend(llm.FakeBackend(recordings=args.recordings, latency_ms=args.latency_ms, jitter=args.jitter,
+                                        error_429=args.error_429, error_timeout=args.error_timeout, seed=args.seed))
+    llm.limiter = llm.TokenBucket(args.rpm, args.burst)
+
+    users = [(f"student{i:04d}", "Student") for i in range(args.students)]
+    users += [(f"teacher{i:04d}", "Teacher") for i in range(args.teachers)]
+    for name, role in users:
+        db.register_user(name, PASSWORD, role, name.title())
+
+    pdf_bytes = make_pdf_fixture(args.pages)
+    scan_pages = make_scan_fixture(args.scan_pages)
+    rec = Recorder()
+    failures = []
+
+    def worker(name, role):
+        try:
+            (teacher if role == "Teacher" else student)(rec, name, args.rounds, pdf_bytes, scan_pages)
+        except Exception as e:
+            failures.append(f"{name}: {e}")
+
+    threads = [threading.Thread(target=worker, args=u) for u in users]
+    start = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - start
+
+    print(f"\n{len(users)} users ({args.students} students, {args.teachers} teachers), "
+          f"{args.rounds} rounds, wall {wall:.1f}s, backend={'gemini' if args.real else 'fake'}")
+    print(f"{'feature':<12}{'n':>7}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>9}")
+    for feature, vals in sorted(rec.samples.items()):
+        vals = sorted(vals)
+        print(f"{feature:<12}{len(vals):>7}{rec.errors[feature]:>6}"
+              f"{percentile(vals, .50) * 1000:>10.1f}{percentile(vals, .95) * 1000:>10.1f}"
+              f"{percentile(vals, .99) * 1000:>10.1f}{len(vals) / wall:>9.1f}")
+    if rec.sources:
+        print("\nscanner pages: " + ", ".join(f"{k} {v}" for k, v in sorted(rec.sources.items())))
+    if failures:
+        print(f"\n{len(failures)} simulated users failed, first: {failures[0]}")
+    return rec
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--students", type=int, default=20)
+    p.add_argument("--teachers", type=int, default=2)
+    p.add_argument("--rounds", type=int, default=3, help="quiz/lesson cycles per user")
+    p.add_argument("--pages", type=int, default=10, help="pages in the generated PDF fixture")
+    p.add_argument("--scan-pages", type=int, default=4, help="photos each student sends to the Homework Scanner (0: skip)")
+    p.add_argument("--db", help="database file (default: a fresh temp file)")
+    p.add_argument("--real", action="store_true", help="use the real Gemini backend (burns quota!)")
+    p.add_argument("--recordings", help="JSONL written with MENTIS_LLM_RECORD to replay")
+    p.add_argument("--latency-ms", type=float, default=800)
+    p.add_argument("--jitter", type=float, default=0.5, help="lognormal sigma of the fake latency")
+    p.add_argument("--error-429", type=float, default=0.0, help="fraction of fake calls that hit quota")
+    p.add_argument("--error-timeout", type=float, default=0.0, help="fraction of fake calls that time out")
+    p.add_argument("--rpm", type=float, default=llm.RPM)
+    p.add_argument("--burst", type=int, default=llm.BURST)
+    p.add_argument("--seed", type=int, default=0)
+    run(p.parse_args())
+
+
+if __name__ == "__main__":
+    main()
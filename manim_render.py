@@ -0,0 +1,469 @@
+"""Manim rendering on a fork-server of warm interpreters.
+
+`python -m manim` re-imports manim, numpy, cairo and pango and rebuilds its
+config on every video, which is most of the wall time of a 10 s scene. Here a
+multiprocessing fork-server preloads manim once; each job is forked from that
+warm state (so scenes still get a fresh, isolated process) and reports how
+long it spent getting ready versus drawing frames. Where fork-server is not
+available (Windows) jobs fall back to the old subprocess call.
+
+render_parallel() splits a long scene at animation boundaries: a dry run
+counts the plays, then each worker renders one range of them with manim's
+from/upto_animation_number (earlier plays are replayed without drawing, so
+the mobject state is right), and ffmpeg stitches the parts with a stream copy.
+
+Every finished video is remuxed with the moov atom up front (faststart) so
+playback starts after the first few KB. Long or high-quality renders can also
+be packaged as multi-bitrate HLS under static/videos for slow connections.
+
+Tex/MathTex glyphs go through a shared, content-addressed SVG cache
+(TEX_CACHE) instead of each job's media/Tex: a job compiles into a private
+directory and publishes the SVG with an atomic rename, so concurrent jobs can
+read the cache without locks. COMMON_FORMULAE are compiled at start-up.
+"""
+import hashlib
+import importlib.util
+import json
+import multiprocessing as mp
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import metrics
+
+WORKERS = int(os.getenv("MENTIS_MANIM_WORKERS", str(os.cpu_count() or 2)))  # render processes allowed at once
+USE_POOL = os.getenv("MENTIS_MANIM_POOL", "1") != "0" and "forkserver" in mp.get_all_start_methods()
+PRELOAD = ["manim", "numpy", "cairo", "manimpango"]
+TIMEOUT = 300
+MEDIA_DIR = "media"
+QUALITY_FLAGS = {"low_quality": "-ql", "medium_quality": "-qm", "high_quality": "-qh"}
+QUALITY_DIRS = {"low_quality": "480p15", "medium_quality": "720p30", "high_quality": "1080p60"}
+# (height, video bitrate) renditions for HLS; only those at or below the source height are made
+HLS_LADDER = [(240, "300k"), (360, "700k"), (480, "1200k"), (720, "2500k"), (1080, "5000k")]
+HLS_DIR = os.path.join("static", "videos")  # served by Streamlit at app/static/videos/
+HLS_MIN_SECONDS = 30  # shorter low-quality clips start fast enough as a single faststart MP4
+MIN_SEGMENT_PLAYS = 4  # fewer plays per segment and the replay cost outweighs the parallelism
+TEX_CACHE = os.getenv("MENTIS_TEX_CACHE", os.path.join(".cache", "tex"))
+COMMON_FORMULAE = [
+    r"a^2 + b^2 = c^2",
+    r"x = \frac{-b \pm \sqrt{b^2 - 4ac}}{2a}",
+    r"ax^2 + bx + c = 0",
+    r"E = mc^2",
+    r"F = ma",
+    r"v = u + at",
+    r"s = ut + \frac{1}{2}at^2",
+    r"v^2 = u^2 + 2as",
+    r"KE = \frac{1}{2}mv^2",
+    r"PE = mgh",
+    r"V = IR",
+    r"PV = nRT",
+    r"y = mx + b",
+    r"A = \pi r^2",
+    r"C = 2\pi r",
+    r"\sin^2\theta + \cos^2\theta = 1",
+    r"e^{i\pi} + 1 = 0",
+    r"f'(x) = \lim_{h \to 0} \frac{f(x+h) - f(x)}{h}",
+    r"\int x^n \, dx = \frac{x^{n+1}}{n+1} + C",
+    r"\sum_{i=1}^{n} i = \frac{n(n+1)}{2}",
+    r"(a + b)^2 = a^2 + 2ab + b^2",
+    r"O(\log n)",
+    r"O(n^2)",
+]
+
+_slots = threading.BoundedSemaphore(WORKERS)
+_ctx = None
+_ctx_lock = threading.Lock()
+_warmed = False  # warm() runs once per process; app.py calls it on every rerun
+_seeded = False
+
+
+def _get_ctx():
+    global _ctx
+    with _ctx_lock:
+        if _ctx is None:
+            _ctx = mp.get_context("forkserver")
+            _ctx.set_forkserver_preload(PRELOAD)
+        return _ctx
+
+
+# ==========================================
+# WORKER (runs in the forked child)
+# ==========================================
+def _load_scene(script, scene):
+    spec = importlib.util.spec_from_file_location(f"_scene_{os.getpid()}", script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, scene)
+
+
+_tex_stats = {"hits": 0, "compiled": 0}
+
+
+def _shared_tex_cache(private_dir):
+    """Routes manim's tex_to_svg_file through TEX_CACHE. Compiles land in private_dir, then are published atomically."""
+    from manim import config
+    from manim.mobject.text import tex_mobject
+    from manim.utils import tex_file_writing
+
+    compile_svg = tex_file_writing.tex_to_svg_file
+
+    def cached(expression, environment=None, tex_template=None):
+        template = tex_template or config.tex_template
+        key = hashlib.sha256("\0".join([getattr(template, "tex_compiler", ""), getattr(template, "output_format", ""),
+                                         getattr(template, "body", ""), environment or "", expression]).encode("utf-8")).hexdigest()
+        dest = os.path.join(TEX_CACHE, key[:2], key + ".svg")
+        if os.path.exists(dest):
+            _tex_stats["hits"] += 1
+            return Path(dest)
+        svg = compile_svg(expression, environment=environment, tex_template=tex_template)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.{os.getpid()}.tmp"
+        shutil.copyfile(svg, tmp)
+        os.replace(tmp, dest)
+        _tex_stats["compiled"] += 1
+        return Path(dest)
+
+    config.tex_dir = private_dir
+    tex_file_writing.tex_to_svg_file = cached
+    tex_mobject.tex_to_svg_file = cached  # imported by name there
+
+
+def _render_job(conn, script, scene, quality, output, extra=None):
+    entered = time.time()
+    t0 = time.perf_counter()
+    private = os.path.join(TEX_CACHE, "jobs", str(os.getpid()))
+    try:
+        from manim import tempconfig
+        with tempconfig({"quality": quality, "media_dir": MEDIA_DIR, "output_file": output,
+                         "disable_caching": True, "input_file": script, **(extra or {})}):
+            _shared_tex_cache(private)
+            scene_obj = _load_scene(script, scene)()
+            ready = time.perf_counter()
+            scene_obj.render()
+            done = time.perf_counter()
+            path = str(scene_obj.renderer.file_writer.movie_file_path)
+        conn.send({"ok": True, "path": path, "entered": entered, "setup": ready - t0, "render": done - ready, "log": "",
+                   "tex": dict(_tex_stats)})
+    except BaseException:
+        conn.send({"ok": False, "path": None, "entered": entered, "setup": time.perf_counter() - t0, "render": 0.0,
+                   "log": traceback.format_exc(), "tex": dict(_tex_stats)})
+    finally:
+        shutil.rmtree(private, ignore_errors=True)
+        conn.close()
+
+
+def _count_job(conn, script, scene):
+    """Dry run (no frames, no file) that reports how many play/wait calls the scene makes.
+
+    It also builds every Tex mobject, so the segments of a parallel render find their glyphs cached.
+    """
+    private = os.path.join(TEX_CACHE, "jobs", str(os.getpid()))
+    try:
+        from manim import tempconfig
+        with tempconfig({"dry_run": True, "disable_caching": True, "input_file": script}):
+            _shared_tex_cache(private)
+            scene_obj = _load_scene(script, scene)()
+            scene_obj.render()
+            conn.send(scene_obj.renderer.num_plays)
+    except BaseException:
+        conn.send(None)
+    finally:
+        shutil.rmtree(private, ignore_errors=True)
+        conn.close()
+
+
+def _seed_job(conn, formulae):
+    private = os.path.join(TEX_CACHE, "jobs", str(os.getpid()))
+    try:
+        from manim import MathTex, tempconfig
+        with tempconfig({"disable_caching": True}):
+            _shared_tex_cache(private)
+            for formula in formulae:
+                try: MathTex(formula)
+                except Exception: pass
+        conn.send(dict(_tex_stats))
+    except BaseException:
+        conn.send(None)
+    finally:
+        shutil.rmtree(private, ignore_errors=True)
+        conn.close()
+
+
+def _noop():
+    pass
+
+
+# ==========================================
+# API
+# ==========================================
+def latex_available():
+    return shutil.which("latex") is not None and shutil.which("dvisvgm") is not None
+
+
+def warm():
+    """Starts the fork-server (which imports manim) in the background so the first video doesn't pay for it,
+    then compiles COMMON_FORMULAE into the shared Tex cache. Only the first call does anything."""
+    global _warmed
+    with _ctx_lock:
+        if _warmed or not USE_POOL: return
+        _warmed = True
+
+    def run():
+        try:
+            p = _get_ctx().Process(target=_noop, daemon=True)
+            p.start()
+            p.join()
+            seed_tex()
+        except (OSError, TimeoutError, EOFError):
+            pass
+    threading.Thread(target=run, daemon=True, name="manim-warm").start()
+
+
+def seed_tex():
+    """Compiles COMMON_FORMULAE into TEX_CACHE once per process, and not at all when a stamp
+    in the cache shows this list was already compiled there (e.g. by an earlier run)."""
+    global _seeded
+    with _ctx_lock:
+        if _seeded or not latex_available(): return
+        _seeded = True
+    stamp = os.path.join(TEX_CACHE, "seeded-" + hashlib.sha256("\0".join(COMMON_FORMULAE).encode('utf-8')).hexdigest()[:16])
+    if os.path.exists(stamp): return
+    stats = _fork(_seed_job, (COMMON_FORMULAE,), TIMEOUT)
+    if not stats: return
+    metrics.count("manim.tex_seeded", stats["compiled"])
+    os.makedirs(TEX_CACHE, exist_ok=True)
+    with open(stamp, "w") as f: f.write(str(stats["compiled"]))
+
+
+def _fork(target, args, timeout):
+    """Runs target(conn, *args) in a process forked from the warm server.
+
+    Returns what it sent; raises TimeoutError (process killed) or EOFError (process died).
+    """
+    ctx = _get_ctx()
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=target, args=(child, *args), daemon=True)
+    proc.start()
+    child.close()
+    try:
+        if not parent.poll(timeout):
+            proc.kill()
+            raise TimeoutError(f"Render timed out after {timeout}s")
+        return parent.recv()
+    except EOFError:
+        proc.join(5)
+        raise EOFError(f"Render worker died (exit code {proc.exitcode})")
+    finally:
+        parent.close()
+        proc.join(5)
+
+
+def _render_forked(script, scene, quality, output, timeout, extra=None):
+    submitted = time.time()
+    try:
+        res = _fork(_render_job, (script, scene, quality, output, extra), timeout)
+    except (TimeoutError, EOFError) as e:
+        return {"ok": False, "path": None, "overhead": None, "render": None, "log": str(e)}
+    res["overhead"] = max(0.0, res.pop("entered") - submitted) + res.pop("setup")  # fork + scene import/config
+    tex = res.pop("tex", {})
+    if tex.get("hits"): metrics.count("cache.tex.hit", tex["hits"])
+    if tex.get("compiled"): metrics.count("cache.tex.miss", tex["compiled"])
+    return res
+
+
+def _render_subprocess(script, scene, quality, output, timeout):
+    cmd = [sys.executable, "-m", "manim", QUALITY_FLAGS.get(quality, "-ql"), "--disable_caching", "-o", output, script, scene]
+    try:
+        result = subprocess.run(cmd, cwd=os.getcwd(), capture_output=True, text=True, encoding="utf-8",
+                                errors="replace", timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"ok": False, "path": None, "overhead": None, "render": None, "log": f"Render timed out after {timeout}s"}
+    ok = result.returncode == 0
+    path = os.path.join(MEDIA_DIR, "videos", os.path.splitext(os.path.basename(script))[0],
+                        QUALITY_DIRS.get(quality, "480p15"), output)
+    return {"ok": ok, "path": path if ok else None, "overhead": None, "render": None, "log": result.stderr}
+
+
+def render(script, scene="GenScene", quality="low_quality", output="final_video.mp4", timeout=TIMEOUT):
+    """Renders one scene. Returns {"ok", "path", "log", "overhead", "render", "wall"} (times in seconds;
+    overhead/render are None on the subprocess fallback, where they cannot be told apart)."""
+    start = time.perf_counter()
+    with _slots:
+        with metrics.span("manim.render"):
+            if USE_POOL:
+                try:
+                    res = _render_forked(script, scene, quality, output, timeout)
+                except OSError:
+                    res = _render_subprocess(script, scene, quality, output, timeout)
+            else:
+                res = _render_subprocess(script, scene, quality, output, timeout)
+    if res["ok"]: faststart(res["path"])
+    res["wall"] = time.perf_counter() - start
+    if res["overhead"] is not None: metrics.observe("manim.overhead", res["overhead"], res["ok"])
+    if res["render"] is not None: metrics.observe("manim.frames", res["render"], res["ok"])
+    return res
+
+
+# ==========================================
+# PARALLEL SEGMENTS
+# ==========================================
+def count_plays(script, scene="GenScene", timeout=TIMEOUT):
+    """Number of animations (play/wait calls) in the scene, or None if the dry run failed."""
+    if not USE_POOL: return None
+    try:
+        return _fork(_count_job, (script, scene), timeout)
+    except (TimeoutError, EOFError, OSError):
+        return None
+
+
+def split_plays(plays, segments):
+    """[(first, last)] inclusive play ranges, as even as possible."""
+    size, extra = divmod(plays, segments)
+    out, start = [], 0
+    for i in range(segments):
+        end = start + size + (1 if i < extra else 0)
+        out.append((start, end - 1))
+        start = end
+    return out
+
+
+def concat(parts, path):
+    """Joins same-codec MP4s without re-encoding (ffmpeg concat demuxer, stream copy)."""
+    listing = path + ".txt"
+    with open(listing, "w", encoding="utf-8") as f:
+        for part in parts:
+            f.write("file '" + os.path.abspath(part).replace("'", "'\\''") + "'\n")
+    try:
+        result = subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", listing,
+                                 "-c", "copy", path], capture_output=True, text=True, timeout=TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return False, f"ffmpeg concat failed: {e}"
+    finally:
+        os.remove(listing)
+    return result.returncode == 0, result.stderr
+
+
+def render_parallel(script, scene="GenScene", quality="low_quality", output="final_video.mp4", segments=None, timeout=TIMEOUT):
+    """Like render(), but long scenes are rendered as segments on several workers and stitched.
+
+    Falls back to render() when the scene is too short to split or fork-server is unavailable.
+    """
+    start = time.perf_counter()
+    plays = count_plays(script, scene, timeout)
+    n = min(segments or WORKERS, (plays or 0) // MIN_SEGMENT_PLAYS)
+    if n < 2: return render(script, scene, quality, output, timeout)
+
+    stem = os.path.splitext(output)[0]
+    ranges = split_plays(plays, n)
+
+    def segment(i):
+        first, last = ranges[i]
+        # upto_animation_number == 0 means "no limit" to manim; MIN_SEGMENT_PLAYS keeps last >= 3 here
+        extra = {"from_animation_number": first, "upto_animation_number": last}
+        with _slots:
+            return _render_forked(script, scene, quality, f"{stem}_part{i:02d}.mp4", timeout, extra)
+
+    with metrics.span("manim.render_parallel"):
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            parts = list(pool.map(segment, range(n)))
+        failed = next((p for p in parts if not p["ok"]), None)
+        if failed:
+            res = dict(failed)
+        else:
+            path = os.path.join(os.path.dirname(parts[0]["path"]), output)
+            ok, log = concat([p["path"] for p in parts], path)
+            res = {"ok": ok, "path": path if ok else None, "log": log,
+                   "overhead": max(p["overhead"] for p in parts), "render": max(p["render"] for p in parts)}
+            if ok:
+                for p in parts: os.remove(p["path"])
+    if res["ok"]: faststart(res["path"])
+    res["wall"] = time.perf_counter() - start
+    res["segments"] = n
+    if res["overhead"] is not None: metrics.observe("manim.overhead", res["overhead"], res["ok"])
+    if res["render"] is not None: metrics.observe("manim.frames", res["render"], res["ok"])
+    return res
+
+
+# ==========================================
+# WEB DELIVERY (faststart MP4 / HLS)
+# ==========================================
+def _ffmpeg(args, timeout=TIMEOUT):
+    try:
+        result = subprocess.run(["ffmpeg", "-y", "-loglevel", "error", *args], capture_output=True, text=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return False, str(e)
+    return result.returncode == 0, result.stderr
+
+
+def probe(path):
+    """(height, duration seconds) of a video, or (None, None) if ffprobe can't tell."""
+    try:
+        out = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries",
+                              "stream=height:format=duration", "-of", "json", path],
+                             capture_output=True, text=True, timeout=30).stdout
+        info = json.loads(out)
+        return int(info["streams"][0]["height"]), float(info["format"]["duration"])
+    except (OSError, subprocess.TimeoutExpired, ValueError, KeyError, IndexError):
+        return None, None
+
+
+@metrics.traced("video.faststart")
+def faststart(path):
+    """Moves the moov atom to the front in place (stream copy). Returns False and leaves the file alone on failure."""
+    tmp = path + ".faststart.mp4"
+    ok, _ = _ffmpeg(["-i", path, "-c", "copy", "-movflags", "+faststart", tmp])
+    if ok: os.replace(tmp, path)
+    elif os.path.exists(tmp): os.remove(tmp)
+    return ok
+
+
+def wants_hls(path, quality):
+    _, duration = probe(path)
+    return quality != "low_quality" or (duration or 0) >= HLS_MIN_SECONDS
+
+
+def _video_id(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""): h.update(block)
+    return h.hexdigest()[:16]
+
+
+@metrics.traced("video.hls")
+def package_hls(path):
+    """Segments the video into HLS renditions from HLS_LADDER; returns the master playlist URL or None.
+
+    Output is content-addressed (same video -> same directory), so a repeat render is not re-encoded.
+    """
+    vid = _video_id(path)
+    out = os.path.join(HLS_DIR, vid)
+    url = f"app/static/videos/{vid}/master.m3u8"
+    if os.path.exists(os.path.join(out, "master.m3u8")): return url
+    height, _ = probe(path)
+    ladder = [r for r in HLS_LADDER if r[0] <= (height or 480)] or HLS_LADDER[:1]
+    n = len(ladder)
+    split = f"[0:v]split={n}" + "".join(f"[s{i}]" for i in range(n)) + ";" + ";".join(
+        f"[s{i}]scale=-2:{h}[o{i}]" for i, (h, _) in enumerate(ladder))
+    args = ["-i", path, "-filter_complex", split]
+    for i, (h, rate) in enumerate(ladder):
+        args += ["-map", f"[o{i}]", f"-c:v:{i}", "libx264", f"-b:v:{i}", rate, f"-maxrate:v:{i}", rate,
+                 f"-bufsize:v:{i}", rate, "-preset", "veryfast", "-g", "48", "-sc_threshold", "0"]
+    tmp = out + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp, exist_ok=True)
+    args += ["-f", "hls", "-hls_time", "4", "-hls_playlist_type", "vod", "-hls_flags", "independent_segments",
+             "-hls_segment_filename", os.path.join(tmp, "v%v", "seg%03d.ts"), "-master_pl_name", "master.m3u8",
+             "-var_stream_map", " ".join(f"v:{i}" for i in range(n)), os.path.join(tmp, "v%v", "index.m3u8")]
+    ok, _ = _ffmpeg(args)
+    if not ok:
+        shutil.rmtree(tmp, ignore_errors=True)
+        return None
+    if os.path.exists(out): shutil.rmtree(tmp, ignore_errors=True)  # another job finished the same video first
+    else: os.replace(tmp, out)
+    return url
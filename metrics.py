@@ -0,0 +1,179 @@
+"""Lightweight in-process tracing: timing spans, counters and gauges.
+
+Spans go into a ring buffer (for the admin Metrics page) and into cumulative
+histograms (for the Prometheus / OpenMetrics text export). Everything here is
+process-wide, like llm.py, because Streamlit keeps imported modules loaded.
+"""
+import functools
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RING_SIZE = int(os.getenv("MENTIS_TRACE_RING", "5000"))
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_lock = threading.Lock()
+spans = deque(maxlen=RING_SIZE)  # (name, start_epoch, seconds, ok)
+_hist = {}      # name -> [bucket counts..., +Inf count, sum]
+_counters = {}  # name -> int
+_gauges = {}    # name -> zero-arg callable
+
+
+# ==========================================
+# RECORDING
+# ==========================================
+def observe(name, seconds, ok=True):
+    with _lock:
+        spans.append((name, time.time() - seconds, seconds, ok))
+        h = _hist.get(name)
+        if h is None:
+            h = _hist[name] = [0] * (len(BUCKETS) + 2) + [0.0]
+        for i, b in enumerate(BUCKETS):
+            if seconds <= b: h[i] += 1
+        h[len(BUCKETS)] += 1
+        if not ok: h[len(BUCKETS) + 1] += 1
+        h[-1] += seconds
+
+
+class span:
+    """Times a block: `with metrics.span("pdf.extract"): ...`"""
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.start, exc_type is None)
+        return False
+
+
+def traced(name):
+    """Decorator form of span."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def count(name, n=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def hit(cache, was_hit):
+    """Cache hit/miss counters, shown as a hit rate on the Metrics page."""
+    count(f"cache.{cache}.{'hit' if was_hit else 'miss'}")
+
+
+def gauge(name, fn):
+    """Registers a callable sampled at export time (e.g. a queue depth)."""
+    with _lock:
+        _gauges[name] = fn
+
+
+# ==========================================
+# SNAPSHOTS (for the Streamlit page)
+# ==========================================
+def recent_spans():
+    with _lock:
+        return list(spans)
+
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+
+def gauges():
+    with _lock:
+        fns = dict(_gauges)
+    out = {}
+    for name, fn in fns.items():
+        try: out[name] = fn()
+        except Exception: out[name] = None
+    return out
+
+
+def cache_hit_rates():
+    c = counters()
+    out = {}
+    for key in c:
+        if key.startswith("cache.") and key.endswith((".hit", ".miss")):
+            cache = key[len("cache."):key.rindex(".")]
+            hits, misses = c.get(f"cache.{cache}.hit", 0), c.get(f"cache.{cache}.miss", 0)
+            out[cache] = {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses else 0.0}
+    return out
+
+
+# ==========================================
+# TEXT EXPORT
+# ==========================================
+def _metric(name):
+    return "mentis_" + "".join(ch if ch.isalnum() else "_" for ch in name)
+
+
+def export_text(openmetrics=False):
+    """Prometheus text format (0.0.4), or OpenMetrics 1.0 when openmetrics=True."""
+    with _lock:
+        hist = {k: list(v) for k, v in _hist.items()}
+        ctrs = dict(_counters)
+    lines = ["# TYPE mentis_span_seconds histogram"]
+    for name, h in sorted(hist.items()):
+        for i, b in enumerate(BUCKETS):
+            lines.append(f'mentis_span_seconds_bucket{{span="{name}",le="{b}"}} {h[i]}')
+        lines.append(f'mentis_span_seconds_bucket{{span="{name}",le="+Inf"}} {h[len(BUCKETS)]}')
+        lines.append(f'mentis_span_seconds_count{{span="{name}"}} {h[len(BUCKETS)]}')
+        lines.append(f'mentis_span_seconds_sum{{span="{name}"}} {h[-1]:.6f}')
+    lines.append("# TYPE mentis_span_errors counter")
+    for name, h in sorted(hist.items()):
+        lines.append(f'mentis_span_errors{"_total" if openmetrics else ""}{{span="{name}"}} {h[len(BUCKETS) + 1]}')
+    for name, v in sorted(ctrs.items()):
+        m = _metric(name)
+        lines.append(f"# TYPE {m} counter")
+        lines.append(f"{m}{'_total' if openmetrics else ''} {v}")
+    for name, v in sorted(gauges().items()):
+        if v is None: continue
+        m = _metric(name)
+        lines.append(f"# TYPE {m} gauge")
+        lines.append(f"{m} {v}")
+    if openmetrics: lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        om = "application/openmetrics-text" in self.headers.get("Accept", "")
+        body = export_text(openmetrics=om).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8" if om
+                         else "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+
+
+def start_exporter(port=None):
+    """Serves /metrics on MENTIS_METRICS_PORT (once per process). No-op when unset."""
+    global _server
+    port = port or os.getenv("MENTIS_METRICS_PORT")
+    with _lock:
+        if _server or not port: return _server
+        _server = ThreadingHTTPServer(("0.0.0.0", int(port)), _Handler)
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
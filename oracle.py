@@ -0,0 +1,108 @@
+"""Oracle career predictions, cached per user against a fingerprint of their scores.
+
+The prediction only depends on the per-topic averages, so it is stored with a
+hash of that vector and served until a new score changes it. Every score
+write queues a background refresh (BACKGROUND limiter lane), so by the time a
+student opens the Oracle page the answer is usually already there.
+"""
+import hashlib
+import json
+import queue
+import threading
+import time
+
+import analytics
+import db
+import llm
+import metrics
+
+_queue = queue.Queue()
+_pending = set()
+_lock = threading.Lock()
+_worker = None
+metrics.gauge("oracle.refresh_queue", lambda: _queue.qsize())
+
+
+def init_oracle():
+    conn = db.connect()
+    conn.execute('''CREATE TABLE IF NOT EXISTS oracle_cache
+                    (username TEXT PRIMARY KEY, fingerprint TEXT, prediction TEXT, created TEXT)''')
+    conn.commit()
+    conn.close()
+
+
+def avg_scores(username):
+    mastery = analytics.user_mastery(username)
+    return dict(zip(mastery["topic"], mastery["mastery"].round(1)))
+
+
+def fingerprint(scores):
+    return hashlib.sha256(json.dumps(sorted(scores.items())).encode('utf-8')).hexdigest()
+
+
+def oracle_prompt(scores):
+    return f"""
+    User Data: {scores}
+    Task: Predict 3 futuristic careers and a roadmap. Cyberpunk tone.
+    """
+
+
+def cached_prediction(username, scores):
+    """The stored prediction if it was made for exactly these scores, else None."""
+    conn = db.connect()
+    row = conn.execute('SELECT fingerprint, prediction FROM oracle_cache WHERE username = ?', (username,)).fetchone()
+    conn.close()
+    hit = bool(row) and row[0] == fingerprint(scores)
+    metrics.hit("oracle", hit)
+    return row[1] if hit else None
+
+
+def _store(username, scores, prediction):
+    conn = db.connect()
+    conn.execute('INSERT OR REPLACE INTO oracle_cache (username, fingerprint, prediction, created) VALUES (?, ?, ?, ?)',
+                 (username, fingerprint(scores), prediction, time.strftime('%Y-%m-%d %H:%M')))
+    conn.commit()
+    conn.close()
+
+
+@metrics.traced("oracle.predict")
+def predict(username, priority=llm.STUDENT):
+    """Cached prediction for the user's current scores, generating (and storing) it on a miss."""
+    scores = avg_scores(username)
+    if not scores: return None
+    cached = cached_prediction(username, scores)
+    if cached: return cached
+    prediction = llm.generate(oracle_prompt(scores), "oracle", priority)
+    _store(username, scores, prediction)
+    return prediction
+
+
+# ==========================================
+# BACKGROUND REFRESH
+# ==========================================
+def is_refreshing(username):
+    with _lock: return username in _pending
+
+
+@db.on_score_write
+def request_refresh(username):
+    global _worker
+    with _lock:
+        if username in _pending: return
+        _pending.add(username)
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work, daemon=True, name="oracle-refresh")
+            _worker.start()
+    _queue.put(username)
+
+
+def _work():
+    while True:
+        username = _queue.get()
+        try:
+            predict(username, llm.BACKGROUND)
+        except Exception:
+            metrics.count("oracle.refresh_errors")
+        finally:
+            with _lock: _pending.discard(username)
+            _queue.task_done()
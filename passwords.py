@@ -0,0 +1,75 @@
+"""bcrypt hashing on a bounded process pool.
+
+bcrypt is CPU-bound by design; running it on the Streamlit script thread
+serialises a whole class logging in at once. Jobs go to a pool of worker
+processes (one per core by default) so login throughput scales with cores.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+import metrics
+
+# bcrypt cost factor (2^ROUNDS iterations). Changing it rehashes users on their next login.
+ROUNDS = int(os.getenv("MENTIS_BCRYPT_ROUNDS", "12"))
+WORKERS = int(os.getenv("MENTIS_BCRYPT_WORKERS", str(os.cpu_count() or 2)))
+# Jobs allowed to wait for a worker before callers block
+MAX_PENDING = WORKERS * 8
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(MAX_PENDING)
+_depth = 0
+metrics.gauge("auth.bcrypt_queue_depth", lambda: _depth)
+
+
+# Run inside the worker processes (must be top-level to pickle)
+def _hash(pwd, rounds):
+    return bcrypt.hashpw(pwd, bcrypt.gensalt(rounds))
+
+def _check(pwd, hashed):
+    return bcrypt.checkpw(pwd, hashed)
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=WORKERS)
+        return _pool
+
+
+def _run(fn, *args):
+    """Runs fn in the pool, falling back to this thread if the pool cannot start."""
+    global _pool, _depth
+    with _pending:
+        with _pool_lock: _depth += 1
+        try:
+            return _get_pool().submit(fn, *args).result()
+        except (BrokenProcessPool, OSError, PermissionError):
+            with _pool_lock:
+                _pool = None
+            return fn(*args)
+        finally:
+            with _pool_lock: _depth -= 1
+
+
+def cost_of(hashed):
+    """'$2b$12$...' -> 12"""
+    try: return int(hashed.split('$')[2])
+    except (IndexError, ValueError): return None
+
+
+@metrics.traced("auth.bcrypt_hash")
+def hash_password(pwd, rounds=None):
+    return _run(_hash, pwd.encode('utf-8'), rounds or ROUNDS).decode('utf-8')
+
+
+@metrics.traced("auth.bcrypt_verify")
+def verify_password(pwd, hashed):
+    """Returns (ok, needs_rehash). needs_rehash is True when the stored cost differs from ROUNDS."""
+    ok = _run(_check, pwd.encode('utf-8'), hashed.encode('utf-8'))
+    return ok, ok and cost_of(hashed) != ROUNDS
@@ -0,0 +1,182 @@
+"""PDF import (PyPDF2) and export (FPDF) helpers."""
+import hashlib
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+
+import PyPDF2
+from fpdf import FPDF
+
+import metrics
+
+# Unicode font for exports. The TTF is copied once per process into FONT_CACHE
+# so FPDF can write its parsed-metrics .pkl next to it (system font dirs are read-only).
+FONT_CANDIDATES = [
+    os.getenv("MENTIS_PDF_FONT", ""),
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/DejaVuSans.ttf",
+    "C:/Windows/Fonts/DejaVuSans.ttf",
+]
+FONT_CACHE = os.getenv("MENTIS_FONT_CACHE", os.path.join(".cache", "fonts"))
+PDF_CACHE_SIZE = 32
+
+_font_lock = threading.Lock()
+_fonts = None  # {"": path, "B": path} or {} when no Unicode font is available
+_coverage = None  # characters every loaded style has a glyph for
+_pdf_cache = OrderedDict()
+_pdf_lock = threading.Lock()
+
+
+@metrics.traced("pdf.extract_text")
+def extract_text_from_pdf(pdf_file):
+    reader = PyPDF2.PdfReader(pdf_file)
+    text = ""
+    for page in reader.pages:
+        text += page.extract_text() + "\n"
+    return text
+
+def sanitize_for_pdf(text):
+    return text.encode('latin-1', 'replace').decode('latin-1')
+
+
+# ==========================================
+# FONTS
+# ==========================================
+def _unicode_fonts():
+    global _fonts
+    if _fonts is not None: return _fonts
+    with _font_lock:
+        if _fonts is not None: return _fonts
+        found = {}
+        src = next((p for p in FONT_CANDIDATES if p and os.path.exists(p)), None)
+        if src:
+            bold = src.replace("DejaVuSans.ttf", "DejaVuSans-Bold.ttf")
+            try:
+                os.makedirs(FONT_CACHE, exist_ok=True)
+                for style, path in (("", src), ("B", bold)):
+                    if not os.path.exists(path): continue
+                    dest = os.path.join(FONT_CACHE, os.path.basename(path))
+                    if not os.path.exists(dest): shutil.copyfile(path, dest)
+                    found[style] = dest
+            except OSError:
+                found = {"": src}
+        _fonts = found
+        return _fonts
+
+
+def _covered(pdf):
+    """Characters with a glyph in both DejaVu styles; FPDF marks code points missing from the cmap with width 0."""
+    global _coverage
+    if _coverage is None:
+        widths = [pdf.fonts[k]["cw"] for k in ("dejavu", "dejavuB")]
+        _coverage = frozenset("\t\n\r").union(chr(i) for i in range(1, 0x10000) if all(cw[i] for cw in widths))
+    return _coverage
+
+
+class _Doc:
+    """Thin wrapper that picks the Unicode font when present, else Arial + latin-1."""
+    def __init__(self):
+        self.pdf = FPDF()
+        fonts = _unicode_fonts()
+        self.unicode = bool(fonts)
+        if self.unicode:
+            self.family = "DejaVu"
+            self.pdf.add_font("DejaVu", "", fonts[""], uni=True)
+            self.pdf.add_font("DejaVu", "B", fonts.get("B", fonts[""]), uni=True)
+            self.covered = _covered(self.pdf)
+        else:
+            self.family = "Arial"
+        self.bullet = "•" if self.unicode else "-"
+
+    def text(self, s):
+        # FPDF 1.7 indexes glyph widths by BMP code point: anything above U+FFFF (emoji) raises IndexError
+        if self.unicode: return "".join(c for c in s if c in self.covered)
+        return sanitize_for_pdf(s)
+
+    def font(self, style, size):
+        self.pdf.set_font(self.family, style, size)
+
+
+# ==========================================
+# MARKDOWN -> PDF
+# ==========================================
+HEADING_SIZES = {1: 15, 2: 13, 3: 12}
+_inline = re.compile(r"(\*\*|__|`)")
+
+
+def _plain(s):
+    """Drops inline markdown markers FPDF cannot style mid-line."""
+    return _inline.sub("", s)
+
+
+def render_markdown(doc, content):
+    pdf = doc.pdf
+    in_code = False
+    for raw in content.splitlines():
+        line = raw.rstrip()
+        if line.strip().startswith("```"):
+            in_code = not in_code
+            continue
+        if in_code:
+            doc.font("", 9)
+            pdf.multi_cell(0, 5, doc.text(line or " "))
+            continue
+        if not line.strip():
+            pdf.ln(3)
+            continue
+
+        heading = re.match(r"^(#{1,6})\s+(.*)", line)
+        bullet = re.match(r"^(\s*)[-*+]\s+(.*)", line)
+        numbered = re.match(r"^(\s*)(\d+[.)])\s+(.*)", line)
+        if heading:
+            level = len(heading.group(1))
+            pdf.ln(2)
+            doc.font("B", HEADING_SIZES.get(level, 11))
+            pdf.multi_cell(0, 8, doc.text(_plain(heading.group(2))))
+        elif bullet or numbered:
+            indent, marker, body = (bullet.group(1), doc.bullet, bullet.group(2)) if bullet else numbered.groups()
+            depth = len(indent.expandtabs(4)) // 2
+            doc.font("", 11)
+            pdf.set_x(pdf.l_margin + 5 + depth * 5)
+            pdf.cell(6, 7, doc.text(marker))
+            pdf.multi_cell(0, 7, doc.text(_plain(body)))
+        elif re.match(r"^\*\*(.+)\*\*:?$", line.strip()):
+            doc.font("B", 11)
+            pdf.multi_cell(0, 7, doc.text(_plain(line.strip())))
+        else:
+            doc.font("", 11)
+            pdf.multi_cell(0, 7, doc.text(_plain(line)))
+
+
+def pdf_key(title, content):
+    return hashlib.sha256(f"{title}\0{content}".encode('utf-8')).hexdigest()
+
+
+def build_pdf(title, content):
+    doc = _Doc()
+    doc.pdf.add_page()
+    doc.font("B", 16)
+    doc.pdf.cell(0, 10, doc.text(title[:50]), 0, 1, 'C')
+    doc.pdf.ln(5)
+    render_markdown(doc, content)
+    return doc.pdf.output(dest='S').encode('latin-1')
+
+
+@metrics.traced("pdf.create")
+def create_pdf(title, content):
+    """PDF bytes for a title + markdown body, memoised by content hash."""
+    key = pdf_key(title, content)
+    with _pdf_lock:
+        if key in _pdf_cache:
+            _pdf_cache.move_to_end(key)
+            metrics.hit("pdf", True)
+            return _pdf_cache[key]
+    metrics.hit("pdf", False)
+    data = build_pdf(title, content)
+    with _pdf_lock:
+        _pdf_cache[key] = data
+        while len(_pdf_cache) > PDF_CACHE_SIZE: _pdf_cache.popitem(last=False)
+    return data
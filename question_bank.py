@@ -0,0 +1,168 @@
+"""Pre-generated question bank, kept stocked by a background worker.
+
+Questions are stored per (topic, difficulty, source document) and deduplicated
+within that bucket by a hash of their text, so "Start Quiz" is a DB sample
+instead of a model call and validated questions get reused across students. When a bucket runs low,
+a refill is queued and generated on the BACKGROUND limiter lane.
+"""
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+import db
+import llm
+import metrics
+import quiz
+
+TARGET = int(os.getenv("MENTIS_BANK_TARGET", "40"))     # questions to keep per bucket
+LOW_WATER = int(os.getenv("MENTIS_BANK_LOW_WATER", "15"))
+REFILL_BATCH = 10  # questions per generation call
+
+_queue = queue.Queue()
+_pending = set()
+_pending_lock = threading.Lock()
+_worker = None
+metrics.gauge("question_bank.refill_queue", lambda: _queue.qsize())
+
+
+_TABLE = '''CREATE TABLE IF NOT EXISTS {name}
+              (id INTEGER PRIMARY KEY, topic_key TEXT, difficulty TEXT, source_hash TEXT,
+               qhash TEXT, question TEXT, options TEXT, answer INTEGER, explanation TEXT,
+               created TEXT, served INTEGER DEFAULT 0, UNIQUE (topic_key, difficulty, source_hash, qhash))'''
+
+
+def _global_unique(conn):
+    """True for banks made before the per-bucket constraint: their UNIQUE(qhash) dropped a question
+    already stored for another difficulty or source, so those buckets never filled."""
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'question_bank'").fetchone()
+    return bool(row) and "qhash TEXT UNIQUE" in row[0]
+
+
+def init_bank():
+    conn = db.connect()
+    if _global_unique(conn):
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')  # DDL doesn't open a transaction by itself; keep the rebuild atomic
+            if _global_unique(conn):  # another replica may have migrated while we waited
+                conn.execute('DROP TABLE IF EXISTS question_bank_new')
+                conn.execute(_TABLE.format(name="question_bank_new"))
+                conn.execute('INSERT INTO question_bank_new SELECT * FROM question_bank')
+                conn.execute('DROP TABLE question_bank')
+                conn.execute('ALTER TABLE question_bank_new RENAME TO question_bank')
+    conn.execute(_TABLE.format(name="question_bank"))
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_bank_bucket ON question_bank (topic_key, difficulty, source_hash)')
+    conn.commit()
+    conn.close()
+
+
+def topic_key(topic):
+    return re.sub(r"[^a-z0-9]+", " ", topic.lower()).strip()
+
+
+def source_hash(context):
+    return hashlib.sha256(context.encode('utf-8')).hexdigest()[:16] if context else ""
+
+
+def _qhash(key, q):
+    norm = re.sub(r"\s+", " ", q["question"].lower()).strip()
+    return hashlib.sha256(f"{key}\0{norm}".encode('utf-8')).hexdigest()
+
+
+def stock(topic, difficulty, context=""):
+    conn = db.connect()
+    n = conn.execute('SELECT COUNT(*) FROM question_bank WHERE topic_key = ? AND difficulty = ? AND source_hash = ?',
+                     (topic_key(topic), difficulty, source_hash(context))).fetchone()[0]
+    conn.close()
+    return n
+
+
+@metrics.traced("question_bank.add")
+def add_questions(topic, difficulty, context, questions):
+    """Inserts validated questions, skipping ones already in this bucket. Returns how many were new."""
+    key, src = topic_key(topic), source_hash(context)
+    now = time.strftime('%Y-%m-%d %H:%M')
+    conn = db.connect()
+    with conn:
+        before = conn.total_changes
+        conn.executemany('''INSERT OR IGNORE INTO question_bank
+                            (topic_key, difficulty, source_hash, qhash, question, options, answer, explanation, created)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                         [(key, difficulty, src, _qhash(key, q), q["question"], json.dumps(q["options"]),
+                           q["answer"], q["explanation"], now) for q in questions])
+        added = conn.total_changes - before
+    conn.close()
+    return added
+
+
+@metrics.traced("question_bank.sample")
+def sample(topic, difficulty, n, context=""):
+    """Up to n random questions from the bucket, least-served first."""
+    conn = db.connect()
+    rows = conn.execute('''SELECT id, question, options, answer, explanation FROM question_bank
+                           WHERE topic_key = ? AND difficulty = ? AND source_hash = ?
+                           ORDER BY served, RANDOM() LIMIT ?''',
+                        (topic_key(topic), difficulty, source_hash(context), n)).fetchall()
+    if rows:
+        with conn:
+            conn.executemany('UPDATE question_bank SET served = served + 1 WHERE id = ?', [(r[0],) for r in rows])
+    conn.close()
+    return [{"question": q, "options": json.loads(o), "answer": a, "explanation": e} for _, q, o, a, e in rows]
+
+
+# ==========================================
+# BACKGROUND REFILL
+# ==========================================
+def request_refill(topic, difficulty, context=""):
+    bucket = (topic_key(topic), difficulty, source_hash(context))
+    with _pending_lock:
+        if bucket in _pending: return
+        _pending.add(bucket)
+    _ensure_worker()
+    _queue.put((bucket, topic, difficulty, context))
+
+
+def _refill(topic, difficulty, context):
+    misses = 0
+    while stock(topic, difficulty, context) < TARGET and misses < 3:
+        questions = quiz.generate_quiz(topic, difficulty, REFILL_BATCH, context, llm.BACKGROUND)
+        # Mostly-duplicate batches mean the model has run out of new questions for this bucket
+        if add_questions(topic, difficulty, context, questions) < len(questions) // 2: misses += 1
+
+
+def _work():
+    while True:
+        bucket, topic, difficulty, context = _queue.get()
+        try:
+            with metrics.span("question_bank.refill"):
+                _refill(topic, difficulty, context)
+        except Exception:
+            metrics.count("question_bank.refill_errors")
+        finally:
+            with _pending_lock: _pending.discard(bucket)
+            _queue.task_done()
+
+
+def _ensure_worker():
+    global _worker
+    with _pending_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work, daemon=True, name="question-bank-refill")
+            _worker.start()
+
+
+def get_quiz(topic, difficulty, n, context="", priority=llm.STUDENT):
+    """Quiz questions from the bank when stocked; otherwise generated live (and banked)."""
+    n = max(1, min(quiz.MAX_QUESTIONS, n))
+    questions = sample(topic, difficulty, n, context)
+    metrics.hit("question_bank", len(questions) == n)
+    if len(questions) < n:
+        fresh = quiz.generate_quiz(topic, difficulty, n, context, priority)
+        add_questions(topic, difficulty, context, fresh)
+        questions = fresh
+    if stock(topic, difficulty, context) < LOW_WATER:
+        request_refill(topic, difficulty, context)
+    return questions
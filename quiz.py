@@ -0,0 +1,84 @@
+"""Structured multiple-choice quizzes: JSON generation, validation and grading."""
+import llm
+
+MAX_QUESTIONS = 20
+
+# OpenAPI-style schema accepted by Gemini's JSON response mode
+QUIZ_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "questions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "question": {"type": "string"},
+                    "options": {"type": "array", "items": {"type": "string"}},
+                    "answer": {"type": "integer"},
+                    "explanation": {"type": "string"},
+                },
+                "required": ["question", "options", "answer"],
+            },
+        },
+    },
+    "required": ["questions"],
+}
+
+
+class QuizFormatError(ValueError):
+    """The model returned JSON that does not describe a usable quiz."""
+
+
+def validate_quiz(data):
+    """Returns a cleaned list of {question, options, answer, explanation}; raises QuizFormatError."""
+    if not isinstance(data, dict) or not isinstance(data.get("questions"), list):
+        raise QuizFormatError("missing 'questions' list")
+    questions = []
+    for i, q in enumerate(data["questions"]):
+        if not isinstance(q, dict): raise QuizFormatError(f"question {i + 1} is not an object")
+        text, options, answer = q.get("question"), q.get("options"), q.get("answer")
+        if not isinstance(text, str) or not text.strip():
+            raise QuizFormatError(f"question {i + 1} has no text")
+        if not isinstance(options, list) or not 2 <= len(options) <= 6 or not all(isinstance(o, str) for o in options):
+            raise QuizFormatError(f"question {i + 1} needs 2-6 text options")
+        if len({o.strip().casefold() for o in options}) < len(options):
+            raise QuizFormatError(f"question {i + 1} has duplicate options")
+        if isinstance(answer, bool) or not isinstance(answer, int) or not 0 <= answer < len(options):
+            raise QuizFormatError(f"question {i + 1} has an invalid answer index")
+        questions.append({"question": text.strip(), "options": [o.strip() for o in options],
+                          "answer": answer, "explanation": str(q.get("explanation") or "").strip()})
+    if not questions: raise QuizFormatError("quiz has no questions")
+    return questions
+
+
+def quiz_prompt(topic, difficulty, num, context=""):
+    return (f"{context}\n\nCreate {num} multiple-choice questions about {topic} at {difficulty} difficulty. "
+            "Each question has 4 options, exactly one correct. 'answer' is the 0-based index of the correct option. "
+            "Keep explanations to one sentence.")
+
+
+def generate_quiz(topic, difficulty, num, context="", priority=llm.STUDENT, attempts=2):
+    """Asks Gemini for a quiz in JSON mode; retries once if the output fails validation."""
+    num = max(1, min(MAX_QUESTIONS, num))
+    err = None
+    for attempt in range(attempts):
+        # Vary the prompt on retry so the coalescing/replay key differs
+        prompt = quiz_prompt(topic, difficulty, num, context) + (" Return valid JSON only." if attempt else "")
+        try:
+            return validate_quiz(llm.generate_json(prompt, QUIZ_SCHEMA, "quiz-json", priority))[:num]
+        except ValueError as e:
+            err = e
+    raise QuizFormatError(str(err))
+
+
+def grade_quiz(questions, chosen):
+    """chosen[i] is the picked option index (or None). Returns (correct_count, per-question results).
+
+    Questions past the end of chosen count as unanswered.
+    """
+    results = []
+    chosen = list(chosen) + [None] * (len(questions) - len(chosen))
+    for q, pick in zip(questions, chosen):
+        results.append({"question": q["question"], "options": q["options"], "chosen": pick,
+                        "correct": q["answer"], "is_correct": pick == q["answer"], "explanation": q["explanation"]})
+    return sum(r["is_correct"] for r in results), results
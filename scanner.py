@@ -0,0 +1,133 @@
+"""Homework Scanner batch pipeline: many pages, few round trips.
+
+Uploads are decoded, rotated and downscaled in parallel, checked against
+image_index, and the remaining pages are packed into multimodal requests of
+up to PACK_PAGES images / PACK_TOKENS image tokens. Packs go out
+concurrently; each reply is split back into pages on its "=== PAGE n ==="
+markers, and any page the model skipped is retried on its own. A file that
+can't be read or a pack that fails only costs the pages involved.
+"""
+import math
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+import image_index
+import llm
+import metrics
+
+MAX_SIDE = 1600   # px; larger photos cost tokens without helping the model read them
+PACK_PAGES = int(os.getenv("MENTIS_VISION_PACK_PAGES", "4"))
+PACK_TOKENS = int(os.getenv("MENTIS_VISION_PACK_TOKENS", "6000"))
+TILE = 768        # Gemini bills images in 768 x 768 tiles...
+TILE_TOKENS = 258  # ...of 258 tokens each
+CONCURRENCY = int(os.getenv("MENTIS_VISION_CONCURRENCY", "4"))
+
+_threads = ThreadPoolExecutor(max_workers=max(CONCURRENCY, 4), thread_name_prefix="scanner")
+_singles = ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix="scanner-page")  # separate pool: packs wait on it
+_marker = re.compile(r"^\s*=+\s*PAGE\s+(\d+)\s*=+\s*$", re.I | re.M)
+
+
+def preprocess(file):
+    """Uploaded file -> upright RGB image no larger than MAX_SIDE."""
+    image = ImageOps.exif_transpose(Image.open(file)).convert("RGB")
+    image.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+    return image
+
+
+def _load(file):
+    """(image, None) or (None, error message) for an upload that can't be decoded."""
+    try:
+        return preprocess(file), None
+    except Exception as e:
+        return None, f"Error processing image: could not read this file ({e})."
+
+
+def image_tokens(image):
+    w, h = image.size
+    return TILE_TOKENS * math.ceil(w / TILE) * math.ceil(h / TILE)
+
+
+def pack(pages):
+    """Greedy packing of [(index, image)] into requests within PACK_PAGES and PACK_TOKENS."""
+    packs, cur, cur_tokens = [], [], 0
+    for idx, image in pages:
+        t = image_tokens(image)
+        if cur and (len(cur) >= PACK_PAGES or cur_tokens + t > PACK_TOKENS):
+            packs.append(cur)
+            cur, cur_tokens = [], 0
+        cur.append((idx, image))
+        cur_tokens += t
+    if cur: packs.append(cur)
+    return packs
+
+
+def split_reply(text, n):
+    """{page number (1-based): text} from a reply using === PAGE n === markers."""
+    marks = list(_marker.finditer(text))
+    out = {}
+    for i, m in enumerate(marks):
+        end = marks[i + 1].start() if i + 1 < len(marks) else len(text)
+        page = int(m.group(1))
+        body = text[m.end():end].strip()
+        if 1 <= page <= n and body: out[page] = body
+    return out
+
+
+def pack_prompt(prompt, n):
+    return (f"{prompt}\n\nThere are {n} separate pages below, labelled Page 1 to Page {n}. Handle each page on its own. "
+            f"Start the answer for each page with a line '=== PAGE n ===' (n = its number) and cover every page.")
+
+
+def _run_pack(items, prompt, priority):
+    """items: [(index, image)] -> {index: (analysis, source)}"""
+    if len(items) == 1:
+        idx, image = items[0]
+        return {idx: (llm.ask_ai_vision(prompt, image, priority), "single")}
+    try:
+        reply = llm.generate_vision_pages(pack_prompt(prompt, len(items)), [im for _, im in items], priority)
+        parts = split_reply(reply, len(items))
+    except Exception:
+        parts = {}
+    out = {idx: (parts[pos], "batched") for pos, (idx, _) in enumerate(items, 1) if pos in parts}
+    missing = [(idx, image) for idx, image in items if idx not in out]
+    if missing: metrics.count("scanner.unpacked_pages", len(missing))
+    for (idx, _), analysis in zip(missing, _singles.map(lambda p: llm.ask_ai_vision(prompt, p[1], priority), missing)):
+        out[idx] = (analysis, "single")
+    return out
+
+
+@metrics.traced("scanner.analyse_pages")
+def analyse_pages(files, task, prompt, priority=llm.STUDENT, use_index=True):
+    """Analyses every uploaded page. Returns [(image, analysis, source)] in upload order;
+    source is "library" (near-duplicate already analysed), "batched", "single" or "error"
+    (image is None when the file could not be read)."""
+    use_index = use_index and image_index.indexable(task)  # never share one student's grade with another
+    loaded = list(_threads.map(_load, files))
+    images = [image for image, _ in loaded]
+    results = {}
+    todo = []
+    for idx, (image, error) in enumerate(loaded):
+        if error:
+            results[idx] = (error, "error")
+            continue
+        found = image_index.lookup(image, task) if use_index else None
+        if found: results[idx] = (found[0], "library")
+        else: todo.append((idx, image))
+
+    futures = [(items, _threads.submit(_run_pack, items, prompt, priority)) for items in pack(todo)]
+    for items, f in futures:
+        try:
+            done = f.result()
+        except Exception as e:
+            metrics.count("scanner.pack_errors")
+            done = {idx: (f"Error processing image: {e}", "error") for idx, _ in items}
+        for idx, (analysis, source) in done.items():
+            if source == "single" and analysis.startswith("Error"): source = "error"  # ask_ai_vision's error reply
+            results[idx] = (analysis, source)
+            if use_index and source != "error" and analysis and not analysis.startswith("Error"):
+                try: image_index.add(images[idx], task, analysis)
+                except Exception: metrics.count("scanner.index_errors")  # the answer still goes back to the student
+    return [(images[i], *results[i]) for i in range(len(images))]
@@ -0,0 +1,127 @@
+"""HMAC-signed, expiring session tokens.
+
+A websocket drop or page refresh wipes st.session_state; the token kept in
+the URL (?s=...) lets app.py restore the login with one HMAC check instead
+of a bcrypt verify. Revocations are stored in the DB and mirrored in memory
+(refreshed every few seconds) so validation never waits on SQLite.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+
+import db
+import metrics
+
+TTL = int(os.getenv("MENTIS_SESSION_TTL", str(12 * 3600)))
+REVOCATION_REFRESH = 5.0  # seconds between reloads of the revoked list
+
+_lock = threading.Lock()
+_secret = None
+_revoked = set()
+_revoked_loaded = 0.0
+
+
+def init_sessions():
+    conn = db.connect()
+    conn.execute('''CREATE TABLE IF NOT EXISTS sessions
+                    (sid TEXT PRIMARY KEY, username TEXT, expires INTEGER, revoked INTEGER DEFAULT 0)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS app_config
+                    (key TEXT PRIMARY KEY, value TEXT)''')
+    conn.execute('DELETE FROM sessions WHERE expires < ?', (int(time.time()),))
+    conn.commit()
+    conn.close()
+
+
+def _get_secret():
+    """MENTIS_SESSION_SECRET, or a random key generated once and kept in the DB (shared by replicas)."""
+    global _secret
+    if _secret: return _secret
+    env = os.getenv("MENTIS_SESSION_SECRET")
+    if env:
+        _secret = env.encode('utf-8')
+        return _secret
+    conn = db.connect()
+    conn.execute('INSERT OR IGNORE INTO app_config (key, value) VALUES (?, ?)', ("session_secret", secrets.token_hex(32)))
+    conn.commit()
+    value = conn.execute('SELECT value FROM app_config WHERE key = ?', ("session_secret",)).fetchone()[0]
+    conn.close()
+    _secret = value.encode('utf-8')
+    return _secret
+
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode('ascii')
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload):
+    return hmac.new(_get_secret(), payload, hashlib.sha256).digest()
+
+
+def issue_token(username, role, name):
+    sid = secrets.token_urlsafe(12)
+    expires = int(time.time()) + TTL
+    db.write([('INSERT INTO sessions (sid, username, expires) VALUES (?, ?, ?)', (sid, username, expires))])
+    payload = json.dumps({"u": username, "r": role, "n": name, "sid": sid, "exp": expires}, separators=(",", ":")).encode('utf-8')
+    return f"{_b64(payload)}.{_b64(_sign(payload))}"
+
+
+def _refresh_revoked():
+    global _revoked, _revoked_loaded
+    now = time.monotonic()
+    if now - _revoked_loaded < REVOCATION_REFRESH: return
+    with _lock:
+        if now - _revoked_loaded < REVOCATION_REFRESH: return
+        conn = db.connect()
+        rows = conn.execute('SELECT sid FROM sessions WHERE revoked = 1 AND expires > ?', (int(time.time()),)).fetchall()
+        conn.close()
+        _revoked = {r[0] for r in rows}
+        _revoked_loaded = now
+
+
+@metrics.traced("auth.session_validate")
+def validate_token(token):
+    """Returns {"username", "role", "name"} for a good token, else None."""
+    try:
+        body, sig = token.split(".")
+        payload = _unb64(body)
+        if not hmac.compare_digest(_unb64(sig), _sign(payload)): return None
+        data = json.loads(payload)
+    except (ValueError, TypeError):
+        return None
+    if data["exp"] < time.time(): return None
+    _refresh_revoked()
+    if data["sid"] in _revoked: return None
+    return {"username": data["u"], "role": data["r"], "name": data["n"], "sid": data["sid"]}
+
+
+def revoke_token(token):
+    data = validate_token(token)
+    if data: revoke(data["sid"])
+
+
+def revoke(sid):
+    conn = db.connect()
+    conn.execute('UPDATE sessions SET revoked = 1 WHERE sid = ?', (sid,))
+    conn.commit()
+    conn.close()
+    with _lock: _revoked.add(sid)
+
+
+def revoke_user(username):
+    """Logs a user out everywhere (e.g. after a password change)."""
+    conn = db.connect()
+    sids = [r[0] for r in conn.execute('SELECT sid FROM sessions WHERE username = ? AND revoked = 0', (username,))]
+    conn.execute('UPDATE sessions SET revoked = 1 WHERE username = ?', (username,))
+    conn.execute('DELETE FROM sessions WHERE expires < ?', (int(time.time()),))
+    conn.commit()
+    conn.close()
+    with _lock: _revoked.update(sids)
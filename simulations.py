@@ -0,0 +1,166 @@
+"""Holodeck simulation library: versioned, gzip-compressed HTML in SQLite.
+
+Simulations are keyed by a normalised topic ("Projectile  motion!" and
+"projectile motion" share one entry), so the first student pays for the
+generation and everyone after is served from the store. Each regenerate adds
+a new version; the newest valid one is served. Popular entries are also kept
+decompressed in memory, and PREWARM topics are generated in the background.
+"""
+import gzip
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import db
+import llm
+import metrics
+
+PREWARM = [t.strip() for t in os.getenv("MENTIS_SIM_PREWARM", "Projectile Motion,Simple Pendulum,Wave Interference,"
+                                                              "Orbital Motion,Ideal Gas,Predator Prey").split(",") if t.strip()]
+MEMORY_SIZE = 32
+
+_memory = OrderedDict()  # topic_key -> (version, html)
+_memory_lock = threading.Lock()
+_prewarm_started = False
+
+
+def init_simulations():
+    conn = db.connect()
+    conn.execute('''CREATE TABLE IF NOT EXISTS simulations
+                    (topic_key TEXT, version INTEGER, topic TEXT, html_gz BLOB, sha256 TEXT,
+                     valid INTEGER, created TEXT, hits INTEGER DEFAULT 0,
+                     PRIMARY KEY (topic_key, version))''')
+    conn.commit()
+    conn.close()
+
+
+def topic_key(topic):
+    words = re.sub(r"[^a-z0-9]+", " ", topic.lower()).split()
+    return " ".join(w for w in words if w not in ("a", "an", "the", "of", "simulation", "simulate"))
+
+
+def is_valid(html):
+    """A usable simulation draws on a canvas and ships its own script."""
+    low = html.lower()
+    return "<canvas" in low and "<script" in low and "</script>" in low
+
+
+def sim_prompt(topic):
+    return f"Write a single HTML5 file with Canvas/JS to simulate: {topic}. Requirements: Canvas Height 400px, Dark Mode, Sliders at top. Return ONLY raw HTML."
+
+
+def clean_html(response):
+    html = llm.clean_ai_response(response)
+    return html[4:].lstrip() if html.lower().startswith("html") else html  # drop a ```html fence tag
+
+
+# ==========================================
+# STORE
+# ==========================================
+def _remember(key, version, html):
+    with _memory_lock:
+        _memory[key] = (version, html)
+        _memory.move_to_end(key)
+        while len(_memory) > MEMORY_SIZE: _memory.popitem(last=False)
+
+
+def latest(topic):
+    """(version, html) of the newest valid version, or None."""
+    key = topic_key(topic)
+    with _memory_lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            version, html = _memory[key]
+        else:
+            version = None
+    conn = db.connect()
+    if version is None:
+        row = conn.execute('SELECT version, html_gz FROM simulations WHERE topic_key = ? AND valid = 1 ORDER BY version DESC LIMIT 1',
+                           (key,)).fetchone()
+        if not row:
+            conn.close()
+            return None
+        version, html = row[0], gzip.decompress(row[1]).decode('utf-8')
+        _remember(key, version, html)
+    with conn:
+        conn.execute('UPDATE simulations SET hits = hits + 1 WHERE topic_key = ? AND version = ?', (key, version))
+    conn.close()
+    return version, html
+
+
+def save(topic, html):
+    """Stores html as the next version of topic. Returns (version, valid).
+
+    Callers coalesced by llm.single_flight all save the same reply; the newest
+    version is reused when its content is identical.
+    """
+    key, valid = topic_key(topic), is_valid(html)
+    sha = hashlib.sha256(html.encode('utf-8')).hexdigest()
+    conn = db.connect()
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')  # take the write lock before reading MAX(version)
+        newest = conn.execute('SELECT version, sha256 FROM simulations WHERE topic_key = ? ORDER BY version DESC LIMIT 1',
+                              (key,)).fetchone()
+        if newest and newest[1] == sha:
+            version = newest[0]
+        else:
+            version = (newest[0] if newest else 0) + 1
+            conn.execute('INSERT INTO simulations (topic_key, version, topic, html_gz, sha256, valid, created) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (key, version, topic.strip(), gzip.compress(html.encode('utf-8'), 9),
+                          sha, int(valid), time.strftime('%Y-%m-%d %H:%M')))
+    conn.close()
+    if valid: _remember(key, version, html)
+    return version, valid
+
+
+@metrics.traced("simulations.generate")
+def generate(topic, priority=llm.STUDENT, attempts=2):
+    """Asks the model for a fresh simulation, retrying once if it fails the canvas/script check."""
+    html = ""
+    for attempt in range(attempts):
+        prompt = sim_prompt(topic) + (" It MUST contain a <canvas> element and a <script> block." if attempt else "")
+        html = clean_html(llm.generate(prompt, "simulation", priority))
+        if is_valid(html): break
+    version, valid = save(topic, html)
+    return version, html, valid
+
+
+def get_or_generate(topic, priority=llm.STUDENT, regenerate=False):
+    """(version, html, valid, from_store)"""
+    if not regenerate:
+        found = latest(topic)
+        metrics.hit("simulations", found is not None)
+        if found: return found[0], found[1], True, True
+    version, html, valid = generate(topic, priority)
+    return version, html, valid, False
+
+
+def search(query="", limit=50):
+    """Library listing: one row per topic with its newest valid version, most-viewed first."""
+    conn = db.connect()
+    rows = conn.execute('''SELECT s.topic_key, s.topic, s.version, t.views, LENGTH(s.html_gz) FROM simulations s
+                           JOIN (SELECT topic_key, MAX(version) AS version, SUM(hits) AS views FROM simulations
+                                 WHERE valid = 1 AND topic_key LIKE ? GROUP BY topic_key) t
+                             ON s.topic_key = t.topic_key AND s.version = t.version
+                           ORDER BY t.views DESC LIMIT ?''', (f"%{topic_key(query)}%", limit)).fetchall()
+    conn.close()
+    return [{"key": k, "topic": t, "version": v, "views": h, "size_kb": round(n / 1024, 1)} for k, t, v, h, n in rows]
+
+
+def prewarm(topics=None):
+    """Generates any missing PREWARM simulations in a background thread (once per process)."""
+    global _prewarm_started
+    with _memory_lock:
+        if _prewarm_started: return
+        _prewarm_started = True
+
+    def run():
+        for topic in topics or PREWARM:
+            try:
+                if latest(topic) is None: generate(topic, llm.BACKGROUND)
+            except Exception:
+                metrics.count("simulations.prewarm_errors")
+    threading.Thread(target=run, daemon=True, name="sim-prewarm").start()
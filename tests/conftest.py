@@ -0,0 +1,22 @@
+"""Shared fixtures: the repo root on sys.path, and a throwaway school database.
+
+Run with `python -m pytest tests` from the repo root.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+@pytest.fixture
+def school_db(tmp_path, monkeypatch):
+    """Points db.DB at an initialised school.db in tmp_path (shards go to tmp_path/shards) and returns its path."""
+    monkeypatch.setattr(db, "DB", str(tmp_path / "school.db"))
+    monkeypatch.setattr(db, "DIRECTORY_DB", None)
+    monkeypatch.setattr(db, "SHARD_DIR", None)
+    db.init_db()
+    return db.DB
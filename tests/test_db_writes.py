@@ -0,0 +1,63 @@
+import sqlite3
+import threading
+
+import pytest
+
+import db
+import metrics
+
+
+@pytest.fixture
+def scores_path(school_db):
+    return school_db
+
+
+def rows(path):
+    conn = sqlite3.connect(path)  # a fresh connection only sees committed data
+    out = conn.execute("SELECT username, score FROM scores ORDER BY username").fetchall()
+    conn.close()
+    return out
+
+
+def insert(user, score):
+    return ("INSERT INTO scores (username, topic, score, date) VALUES (?, 'Algebra', ?, '2024-01-01 00:00')", (user, score))
+
+
+def test_write_is_committed_when_it_returns(scores_path):
+    db.write([insert("alice", 70)])
+    assert rows(scores_path) == [("alice", 70)]
+
+
+def test_bad_write_in_a_group_commit_is_rolled_back_alone(scores_path, monkeypatch):
+    monkeypatch.setattr(db, "COMMIT_WINDOW", 0.5)  # long enough for every submitter to join one batch
+    queue = db.WriteQueue()
+    writes = {
+        "good1": [insert("good1", 1)],
+        "bad": [insert("bad", 2), ("INSERT INTO no_such_table VALUES (1)", ())],
+        "good2": [insert("good2", 3), insert("good2", 4)],
+        "good3": [insert("good3", 5)],
+    }
+    errors = {}
+    start = threading.Barrier(len(writes))
+
+    def submit(name):
+        start.wait()
+        try: queue.submit(scores_path, writes[name])
+        except sqlite3.Error as e: errors[name] = e
+
+    before = metrics.counters().get("db.group_commits", 0)
+    threads = [threading.Thread(target=submit, args=(name,)) for name in writes]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    assert metrics.counters().get("db.group_commits", 0) - before == 1
+    assert list(errors) == ["bad"] and "no_such_table" in str(errors["bad"])
+    assert rows(scores_path) == [("good1", 1), ("good2", 3), ("good2", 4), ("good3", 5)]  # no half of "bad"
+
+
+def test_direct_mode_writes_atomically(scores_path, monkeypatch):
+    monkeypatch.setattr(db, "GROUP_COMMIT", False)
+    with pytest.raises(sqlite3.Error):
+        db.write([insert("bad", 1), ("INSERT INTO no_such_table VALUES (1)", ())])
+    db.write([insert("alice", 70)])
+    assert rows(scores_path) == [("alice", 70)]
@@ -0,0 +1,74 @@
+import pytest
+from PIL import Image, ImageDraw
+
+import db
+import image_index
+
+GRADE, SOLVE = "Grade Handwritten Text", "Solve Math Problem"
+
+
+@pytest.fixture(autouse=True)
+def index_db(school_db, monkeypatch):
+    monkeypatch.setattr(db, "GROUP_COMMIT", False)
+    monkeypatch.setattr(image_index, "_index", {})
+    image_index.init_index()
+
+
+def worksheet(answers):
+    """A printed 10-question worksheet with short handwritten-style answers in the boxes."""
+    img = Image.new("RGB", (1200, 1600), "white")
+    d = ImageDraw.Draw(img)
+    d.rectangle([80, 60, 1120, 160], outline="black", width=4)
+    d.text((100, 90), "Unit 3 worksheet: fractions", fill="black")
+    for i, answer in enumerate(answers):
+        y = 220 + i * 130
+        d.text((100, y), f"{i + 1}. Simplify {i + 2}/{2 * i + 8}", fill="black")
+        d.rectangle([700, y - 20, 1100, y + 60], outline="black", width=3)
+        for k, ch in enumerate(answer):
+            x = 730 + k * 40
+            d.line([(x, y + 40), (x + 12 + (ord(ch) % 7) * 3, y - 5), (x + 25, y + 35)], fill="blue", width=3)
+    return img
+
+
+def test_grade_results_are_not_shared_between_worksheets():
+    a = worksheet(["1/2", "3/5", "2/3", "1/4", "5/6", "1/3", "2/7", "3/8", "4/9", "1/5"])
+    b = worksheet(["1/3", "3/5", "1/9", "1/4", "7/8", "1/3", "2/5", "3/8", "1/1", "1/5"])
+    # the hashes only see the printed layout, so without the exclusion b would match a
+    assert bin(image_index.phash(a) ^ image_index.phash(b)).count("1") <= image_index.MAX_DISTANCE
+    assert bin(image_index.dhash(a) ^ image_index.dhash(b)).count("1") <= image_index.MAX_DISTANCE
+    image_index.add(a, GRADE, "Student A: 10/10")
+    assert image_index.lookup(b, GRADE) is None
+    conn = db.connect()
+    assert conn.execute('SELECT COUNT(*) FROM image_index').fetchone()[0] == 0
+    conn.close()
+
+
+def test_private_rows_from_older_builds_are_removed_once(monkeypatch):
+    conn = db.connect()
+    with conn: conn.execute("INSERT INTO image_index (task, phash, dhash, analysis) VALUES (?, 1, 1, 'Student A: 10/10')", (GRADE,))
+    conn.close()
+    image_index.init_index()  # same process: skipped
+    conn = db.connect()
+    assert conn.execute('SELECT COUNT(*) FROM image_index').fetchone()[0] == 1
+    monkeypatch.setattr(image_index, "_initialised", set())  # a fresh process
+    image_index.init_index()
+    assert conn.execute('SELECT COUNT(*) FROM image_index').fetchone()[0] == 0
+    conn.close()
+
+
+def test_other_tasks_still_dedup():
+    a = worksheet(["1/2"] * 10)
+    image_index.add(a, SOLVE, "x = 4")
+    found = image_index.lookup(a.resize((1000, 1333)), SOLVE)
+    assert found and found[0] == "x = 4"
+
+
+def test_add_appends_without_reloading(monkeypatch):
+    pages = [worksheet([f"{i}/{k + 2}" for i in range(10)]) for k in range(3)]
+    image_index.lookup(pages[0], SOLVE)  # loads the (empty) task index
+    loads = []
+    monkeypatch.setattr(image_index, "_load", lambda task: loads.append(task))
+    for k, page in enumerate(pages): image_index.add(page, SOLVE, f"page {k}")
+    assert not loads and len(image_index._index[SOLVE]["phash"]) == 3
+    found = image_index.lookup(pages[2], SOLVE)
+    assert found and found[0] == "page 2"
@@ -0,0 +1,23 @@
+import knowledge_map
+
+SVG = '''<svg width="100pt" height="50pt" xmlns:xlink="http://www.w3.org/1999/xlink">
+<g id="node1" class="node"><title>A</title>
+<polygon fill="none" stroke="black" points="0,0 10,0"/>
+<text text-anchor="middle" x="27" y="-14">A</text>
+</a></g>
+<image xlink:href="file:///etc/passwd" width="10" height="10" onload="alert(1)"/>
+<a href='https://evil.example'><text x="1" y="1">B</text></a>
+</g></svg>'''
+
+
+def test_links_and_hrefs_are_stripped():
+    svg = knowledge_map.sanitize_svg(SVG)
+    for bad in ("<a", "</a>", "href", "javascript:", "target=", "onload", "evil.example"):
+        assert bad not in svg
+    assert '<text text-anchor="middle" x="27" y="-14">A</text>' in svg
+    assert '<polygon fill="none" stroke="black" points="0,0 10,0"/>' in svg
+
+
+def test_plain_svg_is_unchanged():
+    plain = '<svg><g class="node"><title>A</title><text x="1" y="2">A &amp; B</text></g></svg>'
+    assert knowledge_map.sanitize_svg(plain) == plain
@@ -0,0 +1,19 @@
+import pytest
+
+import pdf_tools
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    pdf_tools._pdf_cache.clear()
+
+
+def test_emoji_in_heading_and_list_item():
+    data = pdf_tools.create_pdf("Forces 🛡️", "# Newton's laws 😀\n- Push the cart 😀\n- Shield 🛡️ up\n1. Measure 🚀")
+    assert data.startswith(b"%PDF")
+
+
+def test_characters_outside_the_font_are_dropped():
+    doc = pdf_tools._Doc()
+    if not doc.unicode: pytest.skip("no DejaVu font installed")
+    assert doc.text("a😀b 中 é") == "ab  é"
@@ -0,0 +1,38 @@
+import sqlite3
+
+import pytest
+
+import db
+import question_bank
+
+Q = [{"question": "What do plants make in photosynthesis?", "options": ["Glucose", "Salt"], "answer": 0, "explanation": ""}]
+
+
+@pytest.fixture(autouse=True)
+def bank_db(school_db):
+    question_bank.init_bank()
+
+
+def test_same_question_fills_every_bucket():
+    assert question_bank.add_questions("Photosynthesis", "Easy", "", Q) == 1
+    assert question_bank.add_questions("Photosynthesis", "Medium", "", Q) == 1
+    assert question_bank.add_questions("Photosynthesis", "Easy", "chapter 3 text", Q) == 1
+    assert question_bank.add_questions("photosynthesis!", "Easy", "", Q) == 0  # same bucket
+    assert question_bank.stock("Photosynthesis", "Medium") == 1
+    assert question_bank.stock("Photosynthesis", "Easy", "chapter 3 text") == 1
+
+
+def test_old_global_unique_bank_is_migrated(tmp_path, monkeypatch):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE question_bank
+                    (id INTEGER PRIMARY KEY, topic_key TEXT, difficulty TEXT, source_hash TEXT,
+                     qhash TEXT UNIQUE, question TEXT, options TEXT, answer INTEGER, explanation TEXT,
+                     created TEXT, served INTEGER DEFAULT 0)''')
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(db, "DB", path)
+    question_bank.add_questions("Photosynthesis", "Easy", "", Q)
+    question_bank.init_bank()
+    assert question_bank.stock("Photosynthesis", "Easy") == 1
+    assert question_bank.add_questions("Photosynthesis", "Hard", "", Q) == 1
@@ -0,0 +1,48 @@
+import pytest
+
+import quiz
+
+
+def question(**overrides):
+    q = {"question": "What is 2 + 2?", "options": ["3", "4", "5", "22"], "answer": 1, "explanation": "Two pairs."}
+    q.update(overrides)
+    return q
+
+
+def test_valid_quiz_is_cleaned():
+    [q] = quiz.validate_quiz({"questions": [question(question="  What is 2 + 2? ", options=[" 3", "4 ", "5", "22"])]})
+    assert q == {"question": "What is 2 + 2?", "options": ["3", "4", "5", "22"], "answer": 1, "explanation": "Two pairs."}
+
+
+@pytest.mark.parametrize("answer", [-1, 4, 17, True, "1", None])
+def test_invalid_answer_index_is_rejected(answer):
+    with pytest.raises(quiz.QuizFormatError, match="answer index"):
+        quiz.validate_quiz({"questions": [question(answer=answer)]})
+
+
+def test_duplicate_options_are_rejected():
+    with pytest.raises(quiz.QuizFormatError, match="duplicate"):
+        quiz.validate_quiz({"questions": [question(options=["4", "5", " 4", "6"])]})
+
+
+@pytest.mark.parametrize("missing", [{}, {"explanation": None}])
+def test_missing_explanation_becomes_empty(missing):
+    q = question()
+    del q["explanation"]
+    q.update(missing)
+    assert quiz.validate_quiz({"questions": [q]})[0]["explanation"] == ""
+
+
+@pytest.mark.parametrize("data", [None, {}, {"questions": []}, {"questions": [question(question=" ")]},
+                                  {"questions": [question(options=["only one"])]}])
+def test_unusable_quizzes_are_rejected(data):
+    with pytest.raises(quiz.QuizFormatError):
+        quiz.validate_quiz(data)
+
+
+def test_grade_counts_unanswered_as_wrong():
+    questions = quiz.validate_quiz({"questions": [question(), question(answer=0), question(answer=2)]})
+    correct, results = quiz.grade_quiz(questions, [1, None])
+    assert correct == 1
+    assert [r["chosen"] for r in results] == [1, None, None]
+    assert [r["is_correct"] for r in results] == [True, False, False]
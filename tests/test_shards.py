@@ -0,0 +1,63 @@
+import os
+import sqlite3
+
+import pytest
+
+import db
+
+PASSWORD = "Passw0rd"
+
+
+@pytest.fixture(autouse=True)
+def direct_writes(school_db, monkeypatch):
+    monkeypatch.setattr(db, "GROUP_COMMIT", False)
+
+
+def users_in(path):
+    conn = sqlite3.connect(path)
+    names = [r[0] for r in conn.execute("SELECT username FROM users ORDER BY username")]
+    conn.close()
+    return names
+
+
+def test_unissued_school_code_is_rejected(school_db):
+    assert db.register_user("alice", PASSWORD, "Student", "Alice", "oak-primary") == (False, "Unknown school code.")
+    assert not os.path.exists(os.path.join(os.path.dirname(school_db), "shards"))  # no shard made from user input
+    assert db.school_of("alice") == db.DEFAULT_SCHOOL and users_in(school_db) == []  # username not claimed
+
+
+def test_issued_code_routes_the_user_to_the_school_shard(school_db):
+    slug, code = db.add_school("Oak Primary")
+    assert db.register_user("alice", PASSWORD, "Student", "Alice", f" {code} ")[0]
+    assert db.register_user("bobby", PASSWORD, "Student", "Bobby", "")[0]
+
+    oak = os.path.join(os.path.dirname(school_db), "shards", "oak-primary.db")
+    assert (slug, db.school_of("alice")) == ("oak-primary", "oak-primary")
+    assert db.shard_for("alice") == oak and users_in(oak) == ["alice"]
+    assert db.shard_for("bobby") == school_db and users_in(school_db) == ["bobby"]
+    assert db.shard_for("nobody") == school_db  # unknown / pre-sharding accounts: default school
+    assert db.check_user("alice", PASSWORD)[0] == "alice"
+
+    db.save_score("alice", "Algebra", 90)
+    assert db.get_user_scores("alice")["score"].tolist() == [90]
+    assert db.get_user_scores("bobby").empty
+
+
+def test_username_is_unique_across_shards(school_db):
+    _, code = db.add_school("Oak Primary")
+    assert db.register_user("alice", PASSWORD, "Student", "Alice", code)[0]
+    assert db.register_user("alice", PASSWORD, "Student", "Alice", "") == (False, "Username exists.")
+
+
+def test_leaderboard_merges_every_shard(school_db):
+    _, oak = db.add_school("Oak Primary")
+    _, elm = db.add_school("Elm High")
+    xp = {"alice": (oak, [90, 80]), "bobby": (oak, [10]), "carol": (elm, [100, 100]),
+          "dylan": (elm, [50]), "erin": ("", [95, 60])}
+    for user, (code, scores) in xp.items():
+        assert db.register_user(user, PASSWORD, "Student", user.title(), code)[0]
+        for s in scores: db.save_score(user, "Algebra", s)
+
+    top = db.get_leaderboard(3)
+    assert top.values.tolist() == [["carol", 200], ["alice", 170], ["erin", 155]]
+    assert db.get_leaderboard(5, schools=["elm-high"])["username"].tolist() == ["carol", "dylan"]